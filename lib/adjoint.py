@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+
+### adjoint.py
+### gradient of the cost with respect to the controls of the police vessels
+###
+### The gradient is computed by the discrete adjoint of the scheme of
+### evolution.one_step_evolution: the time steps are reversed one by one,
+### transposing the linearization of each step. The states needed by the
+### backward sweep are recomputed from a limited number of checkpoints,
+### placed by the binomial strategy of Griewank and Walther (revolve).
+### The derivatives of the functions given by the user (kappa, the speed of
+### the ships and the cut-off functions) are computed by finite differences.
+
+import os
+import numpy
+import scipy.signal
+import pde
+import convolution
+import evolution
+
+# relative step of the finite differences
+EPSILON = 1e-6
+
+
+#
+# transposes of the linear operators of the schemes
+#
+def augment_transpose(U):
+    """
+    This function is the transpose of pde.augment: it maps an array of shape
+    (u1 + 2, u2 + 2) to an array of shape (u1, u2).
+    """
+    a = U[:, 1:-1].copy()
+    a[:, 1] += U[:, 0]
+    a[:, -2] += U[:, -1]
+
+    u = a[1:-1].copy()
+    u[1] += a[0]
+    u[-2] += a[-1]
+
+    return u
+
+
+def gradient_transpose(g, h, axis):
+    """
+    This function is the transpose of the derivative along axis computed by
+    numpy.gradient with spacing h (centered differences inside, one-sided
+    differences at the boundary).
+    """
+    if axis == 1:
+        return gradient_transpose(g.T, h, 0).T
+
+    u = numpy.zeros_like(g)
+    u[2:] += g[1:-1] / (2. * h)
+    u[:-2] -= g[1:-1] / (2. * h)
+    u[1] += g[0] / h
+    u[0] -= g[0] / h
+    u[-1] += g[-1] / h
+    u[-2] -= g[-1] / h
+
+    return u
+
+
+def laplacian_transpose(mu, dx, dy):
+    """
+    This function is the transpose of the discrete Laplacian with zero
+    Neumann boundary conditions of pde.parabolic_stencil.
+    """
+    (n1, n2) = numpy.shape(mu)
+    U = numpy.zeros((n1 + 2, n2 + 2), dtype = mu.dtype)
+    U[1:-1, 2:] += mu / dx**2
+    U[1:-1, :-2] += mu / dx**2
+    U[2:, 1:-1] += mu / dy**2
+    U[:-2, 1:-1] += mu / dy**2
+    U[1:-1, 1:-1] -= 2. * (1. / dx**2 + 1. / dy**2) * mu
+
+    return augment_transpose(U)
+
+
+def convolve_transpose(c, kernel):
+    """
+    This function is the transpose of the map h |---> kernel.convolve(h),
+    where kernel is a convolution.cropped_kernel.
+    """
+    if kernel.data is None:
+        return numpy.zeros_like(c)
+
+    (n1, n2) = numpy.shape(c)
+    (c1, c2) = numpy.shape(kernel.data)
+    r_0 = - kernel.first[0] - c1 + 1
+    s_0 = - kernel.first[1] - c2 + 1
+    w = convolution.window(c, r_0, r_0 + n1 + c1 - 1, s_0, s_0 + n2 + c2 - 1)
+
+    return scipy.signal.convolve2d(w, kernel.data[::-1, ::-1], mode = 'valid')
+
+
+#
+# derivatives of the functions given by the user
+#
+def derivative(function, u):
+    """
+    This function returns the derivative of the function (acting entrywise
+    on numpy arrays) at the entries of u, by centered differences.
+    """
+    h = EPSILON * numpy.maximum(numpy.abs(u), 1.)
+    return (numpy.asarray(function(u + h), dtype = numpy.float64) -
+            numpy.asarray(function(u - h), dtype = numpy.float64)) / (2. * h)
+
+
+def cut_off(function, xx, yy, d, sign):
+    """
+    This function returns function(sign * (xx - d_x), sign * (yy - d_y)).
+    """
+    return function(sign * (xx - d[0]), sign * (yy - d[1]))
+
+
+def cut_off_derivatives(function, xx, yy, d, sign, h):
+    """
+    This function returns the derivatives with respect to d_x and d_y of
+    cut_off(function, xx, yy, d, sign), by centered differences of step h.
+    """
+    (e_x, e_y) = (numpy.array([h, 0.]), numpy.array([0., h]))
+    return ((cut_off(function, xx, yy, d + e_x, sign) - cut_off(function, xx, yy, d - e_x, sign)) / (2. * h),
+            (cut_off(function, xx, yy, d + e_y, sign) - cut_off(function, xx, yy, d - e_y, sign)) / (2. * h))
+
+
+#
+# x-split of the Godunov-type scheme and its transpose
+#
+def split(A, v, w, h, dt):
+    """
+    This function performs the x-split of pde.godunov_stencil.
+
+    :output (A_new, tape): the tape contains the quantities needed by
+                           split_transpose
+    """
+    U = pde.augment(A)
+    W = pde.augment(w)
+    W = 0.5 * (W[:, 1:] + W[:, :-1])
+    G = pde.Godunov_Flux_x(U, v, 0.5)
+    gf = G * W
+
+    A_new = U[1:-1, 1:-1] + (dt / h) * (gf[1:-1, :-1] - gf[1:-1, 1:])
+
+    # masks of pde.Godunov_Flux_x selecting the left and the right fluxes
+    f1 = U * v(U)
+    left = ((U[:, :-1] <= U[:, 1:]) & (f1[:, :-1] <= f1[:, 1:])) | \
+           ((U[:, :-1] > U[:, 1:]) & (U[:, :-1] <= 0.5))
+    right = ((U[:, :-1] <= U[:, 1:]) & (f1[:, :-1] > f1[:, 1:])) | \
+            ((U[:, :-1] > U[:, 1:]) & (U[:, 1:] >= 0.5))
+
+    return (A_new, (U, W, G, left, right))
+
+
+def split_transpose(A_bar, tape, v, h, dt):
+    """
+    This function applies the transpose of the linearization of split to
+    A_bar.
+
+    :output (A_bar, w_bar): derivatives with respect to A and to w
+    """
+    (U, W, G, left, right) = tape
+
+    U_bar = numpy.zeros_like(U)
+    U_bar[1:-1, 1:-1] = A_bar
+    gf_bar = numpy.zeros_like(G)
+    gf_bar[1:-1, :-1] += (dt / h) * A_bar
+    gf_bar[1:-1, 1:] -= (dt / h) * A_bar
+
+    G_bar = gf_bar * W
+    W_bar = gf_bar * G
+
+    # derivative of the flux u v(u)
+    df1 = v(U) + U * derivative(v, U)
+    U_bar[:, :-1] += left * G_bar * df1[:, :-1]
+    U_bar[:, 1:] += right * G_bar * df1[:, 1:]
+
+    W_aug = numpy.zeros_like(U)
+    W_aug[:, 1:] += 0.5 * W_bar
+    W_aug[:, :-1] += 0.5 * W_bar
+
+    return (augment_transpose(U_bar), augment_transpose(W_aug))
+
+
+#
+# class containing the discrete adjoint
+#
+class adjoint(object):
+
+    def __init__(self, pirates, controls = None, snapshots = 10, directory = None):
+        """
+        Initialization function for the class.
+
+        :param pirates: pirate class
+        :param controls: function or numpy array, as in evolution.evaluate_cost.
+                         If None, the controls are pirates.controls
+        :param snapshots: int. Number of states kept at the same time by the
+                          checkpointing, besides the initial one
+        :param directory: string or None. If not None, the checkpoints are
+                          saved in this directory instead of in memory
+        """
+        self.pirates = pirates
+        self.steps = len(pirates.time) - 1
+        M = pirates.police_vessels
+
+        if controls is None:
+            controls = pirates.controls
+        if isinstance(controls, numpy.ndarray):
+            self.controls = numpy.array(controls, dtype = numpy.float64).reshape((self.steps, M, 2))
+        else:
+            self.controls = numpy.array([controls(t) for t in pirates.time[1:]],
+                                        dtype = numpy.float64).reshape((self.steps, M, 2))
+
+        self.snapshots = snapshots
+        self.directory = directory
+        self.stored = {}
+
+        # kernels cropped to their supports
+        self.p_kernel = convolution.cropped_kernel(pirates.kernel_mathcal_K)
+        self.s_kernels = (convolution.cropped_kernel(pirates.ships_kernels[0]),
+                          convolution.cropped_kernel(pirates.ships_kernels[1]))
+
+        # step of the finite differences of the cut-off functions
+        self.h = EPSILON * max(pirates.x_2 - pirates.x_1, pirates.y_2 - pirates.y_1)
+
+
+    #
+    # Function for the checkpoints
+    #
+    def store(self, k, state):
+        if self.directory is None:
+            self.stored[k] = state
+        else:
+            filename = os.path.join(self.directory, 'checkpoint_' + str(k).zfill(6) + '.npz')
+            numpy.savez(filename, p = state[0], s = state[1], d = state[2])
+            self.stored[k] = filename
+
+
+    def load(self, k):
+        if self.directory is None or k == 0:
+            return self.stored[k]
+
+        data = numpy.load(self.stored[k])
+        return (data['p'], data['s'], data['d'])
+
+
+    def free(self, k):
+        filename = self.stored.pop(k)
+        if self.directory is not None:
+            os.remove(filename)
+
+
+    #
+    # Function for a time step
+    #
+    def step(self, k, state, tape = False):
+        """
+        This function performs the time step from pirates.time[k] to
+        pirates.time[k + 1], as evolution.one_step_evolution followed by
+        pirates.project.
+
+        :param k: int. Index of the time step
+        :param state: tuple (p_density, s_density, police), police being a
+                      numpy array of shape (M, 2)
+        :param tape: bool. If True, the quantities needed by step_transpose
+                     are returned as well
+
+        :output state_new: tuple (p_new, s_new, police_new), or
+                           (state_new, tape) if tape is True
+        """
+        P = self.pirates
+        (p, s, d) = state
+        (xx, yy, dx, dy, dt) = (P.x_mesh, P.y_mesh, P.dx, P.dy, P.dt)
+        M = P.police_vessels
+
+        # pirates
+        c = dx * dy * self.p_kernel.convolve(s)
+        (gy, gx) = numpy.gradient(c, dy, dx)
+        norm = numpy.sqrt(gx**2 + gy**2)
+        kappa = numpy.asarray(P.kappa(norm), dtype = p.dtype)
+        trash, div1 = numpy.gradient(kappa * gx * p, dy, dx)
+        div2, trash = numpy.gradient(kappa * gy * p, dy, dx)
+        C_pirates = [cut_off(P.cut_off_C_pirates, xx, yy, d[i], 1.) for i in xrange(M)]
+        f = numpy.zeros_like(xx)
+        for i in xrange(M):
+            f += P.a[i] * C_pirates[i]
+        p_new = pde.parabolic_stencil(p, - div1 - div2, -f, dx, dy, dt)
+
+        # ships
+        C_ships = [cut_off(P.cut_off_C_ships, xx, yy, d[i], 1.) for i in xrange(M)]
+        V_x = - dx * dy * self.s_kernels[0].convolve(p) + P.ships_direction_mesh[0]
+        V_y = - dx * dy * self.s_kernels[1].convolve(p) + P.ships_direction_mesh[1]
+        for i in xrange(M):
+            V_x += C_ships[i] * (d[i][0] - xx)
+            V_y += C_ships[i] * (d[i][1] - yy)
+        (w_x, w_y) = evolution.unit_velocity(V_x, V_y)
+        (s_half, tape_x) = split(s, P.ships_speed, w_x, dx, dt)
+        (s_full, tape_y) = split(s_half.T, P.ships_speed, w_y.T, dy, dt)
+        s_full = s_full.T
+        s_new = numpy.minimum(numpy.maximum(s_full, 0.), 1.)
+
+        # police
+        C_police = [cut_off(P.cut_off_C_police, xx, yy, d[i], -1.) for i in xrange(M)]
+        forces = []
+        for i in xrange(M):
+            temp = C_police[i] * p * s
+            forces.append((dx * dy * numpy.sum(temp * (xx - d[i][0]), dtype = numpy.float64),
+                           dx * dy * numpy.sum(temp * (yy - d[i][1]), dtype = numpy.float64)))
+        d_pre = numpy.array(evolution.police_evolution([tuple(e) for e in d], forces, dt,
+                                                       lambda t: self.controls[k], P.time[k + 1]),
+                            dtype = numpy.float64).reshape((M, 2))
+        d_new = numpy.array(P.project(d_pre), dtype = numpy.float64).reshape((M, 2))
+
+        if not tape:
+            return (p_new, s_new, d_new)
+
+        return ((p_new, s_new, d_new),
+                (p, s, d, gx, gy, norm, kappa, f, C_pirates, C_ships, C_police,
+                 V_x, V_y, tape_x, tape_y, s_full, d_pre))
+
+
+    #
+    # Function for the transpose of a time step
+    #
+    def step_transpose(self, tape, p_bar, s_bar, d_bar):
+        """
+        This function applies the transpose of the linearization of step to
+        the derivatives (p_bar, s_bar, d_bar) of the cost with respect to the
+        state at time pirates.time[k + 1].
+
+        :output (p_bar, s_bar, d_bar, u_bar): derivatives of the cost with
+                 respect to the state at time pirates.time[k] and to the
+                 controls of the time step
+        """
+        P = self.pirates
+        (p, s, d, gx, gy, norm, kappa, f, C_pirates, C_ships, C_police,
+         V_x, V_y, tape_x, tape_y, s_full, d_pre) = tape
+        (xx, yy, dx, dy, dt) = (P.x_mesh, P.y_mesh, P.dx, P.dy, P.dt)
+        M = P.police_vessels
+
+        # police
+        inside = numpy.ones_like(d_pre)
+        inside[:, 0] = (d_pre[:, 0] >= P.x_1) & (d_pre[:, 0] <= P.x_2)
+        inside[:, 1] = (d_pre[:, 1] >= P.y_1) & (d_pre[:, 1] <= P.y_2)
+        d_pre_bar = d_bar * inside
+        u_bar = dt * d_pre_bar
+
+        d_out = d_pre_bar + dt * (numpy.sum(d_pre_bar, axis = 0) - M * d_pre_bar)
+        p_out = numpy.zeros_like(p)
+        s_out = numpy.zeros_like(s)
+        for i in xrange(M):
+            (F_x, F_y) = dt * d_pre_bar[i]
+            q = dx * dy * ((xx - d[i][0]) * F_x + (yy - d[i][1]) * F_y)
+            p_out += C_police[i] * s * q
+            s_out += C_police[i] * p * q
+            temp = C_police[i] * p * s
+            d_out[i] -= dx * dy * numpy.array([numpy.sum(temp) * F_x, numpy.sum(temp) * F_y])
+            (D_x, D_y) = cut_off_derivatives(P.cut_off_C_police, xx, yy, d[i], -1., self.h)
+            d_out[i] += [numpy.sum(D_x * p * s * q), numpy.sum(D_y * p * s * q)]
+
+        # ships
+        s_full_bar = s_bar * ((s_full >= 0.) & (s_full <= 1.))
+        (s_half_bar, w_y_bar) = split_transpose(s_full_bar.T, tape_y, P.ships_speed, dy, dt)
+        (s_half_bar, w_y_bar) = (s_half_bar.T, w_y_bar.T)
+        (s_in_bar, w_x_bar) = split_transpose(s_half_bar, tape_x, P.ships_speed, dx, dt)
+        s_out += s_in_bar
+
+        # transpose of evolution.unit_velocity
+        r = numpy.sqrt(V_x**2 + V_y**2)
+        big = r > 1.
+        r = numpy.maximum(r, 1.)
+        dot = (V_x * w_x_bar + V_y * w_y_bar) / r**3
+        V_x_bar = w_x_bar / r - big * V_x * dot
+        V_y_bar = w_y_bar / r - big * V_y * dot
+
+        p_out -= dx * dy * (convolve_transpose(V_x_bar, self.s_kernels[0]) +
+                            convolve_transpose(V_y_bar, self.s_kernels[1]))
+        for i in xrange(M):
+            d_out[i] += [numpy.sum(V_x_bar * C_ships[i]), numpy.sum(V_y_bar * C_ships[i])]
+            q = V_x_bar * (d[i][0] - xx) + V_y_bar * (d[i][1] - yy)
+            (D_x, D_y) = cut_off_derivatives(P.cut_off_C_ships, xx, yy, d[i], 1., self.h)
+            d_out[i] += [numpy.sum(D_x * q), numpy.sum(D_y * q)]
+
+        # pirates
+        p_out += p_bar + dt * laplacian_transpose(p_bar, dx, dy) - dt * f * p_bar
+        f_bar = - dt * p * p_bar
+        for i in xrange(M):
+            (D_x, D_y) = cut_off_derivatives(P.cut_off_C_pirates, xx, yy, d[i], 1., self.h)
+            d_out[i] += P.a[i] * numpy.array([numpy.sum(f_bar * D_x), numpy.sum(f_bar * D_y)])
+
+        # divergence term: - D_x(kappa g_x p) - D_y(kappa g_y p)
+        F_x_bar = - dt * gradient_transpose(p_bar, dx, 1)
+        F_y_bar = - dt * gradient_transpose(p_bar, dy, 0)
+        p_out += kappa * (gx * F_x_bar + gy * F_y_bar)
+        kappa_bar = p * (gx * F_x_bar + gy * F_y_bar)
+        dkappa = derivative(P.kappa, norm) * kappa_bar / numpy.maximum(norm, numpy.finfo(float).tiny)
+        gx_bar = kappa * p * F_x_bar + dkappa * gx
+        gy_bar = kappa * p * F_y_bar + dkappa * gy
+        c_bar = gradient_transpose(gx_bar, dx, 1) + gradient_transpose(gy_bar, dy, 0)
+        s_out += dx * dy * convolve_transpose(c_bar, self.p_kernel)
+
+        return (p_out, s_out, d_out, u_bar)
+
+
+    #
+    # Function for the gradient
+    #
+    def gradient(self):
+        """
+        This function computes the cost and its gradient with respect to the
+        controls.
+
+        :output (cost, gradient): cost is a float, gradient a numpy array of
+                                  the shape of the table of the controls
+        """
+        P = self.pirates
+        M = P.police_vessels
+        state = (P.initial_density_pirates, P.initial_density_ships,
+                 numpy.array(P.police_initial_positions, dtype = numpy.float64).reshape((M, 2)))
+
+        self.stored = {0: state}
+        self.cost = P.dt * numpy.sum(state[0] * state[1], dtype = numpy.float64)
+        self.bar = (numpy.zeros_like(state[0]), numpy.zeros_like(state[1]), numpy.zeros((M, 2)))
+        self.gradient_controls = numpy.zeros_like(self.controls)
+
+        self.reverse(0, self.steps, self.snapshots)
+
+        return (self.cost, self.gradient_controls)
+
+
+    #
+    # Function for reversing the time steps from k_0 to k_1
+    #
+    def reverse(self, k_0, k_1, snapshots):
+        """
+        This function reverses the time steps k_0, ..., k_1 - 1, in
+        decreasing order, starting from the checkpoint at k_0. The number of
+        free checkpoints is snapshots.
+        """
+        l = k_1 - k_0
+        if l == 1:
+            self.backward(k_0, self.load(k_0))
+            return
+
+        if snapshots == 0:
+            for k in xrange(k_1 - 1, k_0 - 1, -1):
+                self.backward(k, self.advance(k_0, k))
+            return
+
+        # binomial checkpointing: the steps after the new checkpoint are
+        # reversed with one checkpoint less, the ones before it with one
+        # repetition less
+        r = repetitions(l, snapshots)
+        k = k_0 + max(l - binomial(snapshots - 1, r), 1)
+        self.store(k, self.advance(k_0, k))
+        self.reverse(k, k_1, snapshots - 1)
+        self.free(k)
+        self.reverse(k_0, k, snapshots)
+
+
+    def advance(self, k_0, k):
+        state = self.load(k_0)
+        for j in xrange(k_0, k):
+            state = self.step(j, state)
+
+        return state
+
+
+    #
+    # Function for the backward step from time k + 1 to time k
+    #
+    def backward(self, k, state):
+        P = self.pirates
+        ((p, s, d), tape) = self.step(k, state, tape = True)
+        (p_bar, s_bar, d_bar) = self.bar
+
+        # running cost at time k + 1
+        displacement = d - state[2]
+        length = numpy.sqrt(numpy.sum(displacement**2))
+        self.cost += P.dt * numpy.sum(p * s, dtype = numpy.float64) + length
+        p_bar = p_bar + P.dt * s
+        s_bar = s_bar + P.dt * p
+        if length > 0.:
+            d_bar = d_bar + displacement / length
+
+        (p_bar, s_bar, d_bar, u_bar) = self.step_transpose(tape, p_bar, s_bar, d_bar)
+        if length > 0.:
+            d_bar -= displacement / length
+
+        self.bar = (p_bar, s_bar, d_bar)
+        self.gradient_controls[k] = u_bar
+
+
+#
+# binomial checkpointing
+#
+def binomial(snapshots, r):
+    """
+    This function returns the maximum number of time steps which can be
+    reversed with the given number of checkpoints and r repetitions, i.e.
+    the binomial coefficient (snapshots + r, snapshots).
+    """
+    b = 1
+    for j in xrange(1, snapshots + 1):
+        b = b * (r + j) // j
+
+    return b
+
+
+def repetitions(steps, snapshots):
+    """
+    This function returns the smallest number of repetitions needed to
+    reverse steps time steps with the given number of checkpoints.
+    """
+    r = 0
+    while binomial(snapshots, r) < steps:
+        r += 1
+
+    return r
+
+
+#
+# function for the gradient of the cost
+#
+def gradient(pirates, controls = None, snapshots = 10, directory = None):
+    """
+    This function computes the cost of the evolution and its gradient with
+    respect to the controls of the police vessels at each time step.
+
+    :param pirates: pirate class
+    :param controls: function or numpy array, as in evolution.evaluate_cost.
+                     If None, the controls are pirates.controls
+    :param snapshots: int. Number of checkpoints kept at the same time
+    :param directory: string or None. If not None, the checkpoints are saved
+                      in this directory instead of in memory
+
+    :output (cost, gradient): cost is a float, gradient is a numpy array of
+                              shape (len(pirates.time) - 1, M, 2) whose entry
+                              k is the derivative of the cost with respect to
+                              the controls used in the time step from
+                              pirates.time[k] to pirates.time[k + 1]
+    """
+    return adjoint(pirates, controls, snapshots, directory).gradient()
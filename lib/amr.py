@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+
+### amr.py
+### block-structured adaptive mesh refinement for the densities
+###
+### The base mesh of the pirates class is covered by a single level of
+### rectangular patches refined by an integer ratio r. On each patch the
+### densities are advanced by r**2 (pirates) and r (ships) substeps, with
+### ghost cells interpolated from the base mesh, and their fluxes are
+### computed with the fine densities. The base mesh is then corrected
+### with the fluxes of the patches through their boundaries and the patches
+### are averaged back onto it, so that the base mesh always carries the
+### composite solution and the mass is conserved as on the base mesh.
+###
+### The convolutions, the velocity fields and the source term of the police
+### are only computed on the base mesh and interpolated on the patches: they
+### are smooth, and the convolutions on the patches would cost as much as
+### a convolution on a mesh refined everywhere.
+
+import numpy
+import scipy.ndimage
+import pde
+
+
+#
+# class containing a refined patch
+#
+class patch(object):
+
+    def __init__(self, box, ratio, p_density, s_density):
+        """
+        Initialization function for the class.
+
+        :param box: tuple (i_0, i_1, j_0, j_1). The patch covers the cells
+                    [i_0:i_1, j_0:j_1] of the base mesh
+        :param ratio: int. Refinement ratio
+        :param p_density: numpy 2d array. Density of pirates on the base mesh
+        :param s_density: numpy 2d array. Density of ships on the base mesh
+        """
+        self.box = box
+        self.ratio = ratio
+
+        self.p_density = prolong(p_density, box, ratio)
+        self.s_density = prolong(s_density, box, ratio)
+
+
+    #
+    # Function for the coordinates of the fine cells
+    #
+    def coordinates(self, i, j):
+        """
+        This function returns the coordinates, in the indices of an array
+        whose first cell is the base cell (i, j), of the centers of the fine
+        cells of the patch, ghost cells included.
+
+        :output (Y, X): tuple of numpy 2d arrays with the shape of the fine
+                        patch plus two ghost cells in each direction
+        """
+        (i_0, i_1, j_0, j_1) = self.box
+        r = float(self.ratio)
+        rows = i_0 - i + (numpy.arange(-1, self.ratio * (i_1 - i_0) + 1) + 0.5) / r - 0.5
+        cols = j_0 - j + (numpy.arange(-1, self.ratio * (j_1 - j_0) + 1) + 0.5) / r - 0.5
+
+        return numpy.meshgrid(rows, cols, indexing = 'ij')
+
+
+    #
+    # Function for interpolating a field of the base mesh
+    #
+    def interpolate(self, u):
+        """
+        This function interpolates (bilinearly) a smooth field of the base
+        mesh at the fine cells of the patch, ghost cells included.
+
+        :param u: numpy 2d array on the base mesh
+
+        :output u_fine: numpy 2d array with the shape of the fine patch plus
+                        two ghost cells in each direction
+        """
+        return scipy.ndimage.map_coordinates(u, self.coordinates(0, 0), order = 1, mode = 'nearest')
+
+
+    #
+    # Function for adding the ghost cells to a fine density
+    #
+    def pad(self, u, coarse):
+        """
+        This function adds one layer of ghost cells to a fine density.
+        The ghost cells are interpolated bilinearly from the base cells
+        around them.
+
+        :param u: numpy 2d array. Fine density on the patch
+        :param coarse: numpy 2d array. Augmented base density restricted to
+                       the patch and to its neighbouring cells
+
+        :output u_pad: numpy 2d array of shape (u1 + 2, u2 + 2)
+        """
+        # the first cell of coarse is the base cell (i_0 - 1, j_0 - 1)
+        u_pad = scipy.ndimage.map_coordinates(coarse, self.coordinates(self.box[0] - 1, self.box[2] - 1),
+                                              order = 1, mode = 'nearest')
+        u_pad[1:-1, 1:-1] = u
+
+        return u_pad
+
+
+    #
+    # Function for the time step on the patch
+    #
+    def advance(self, p_old, p_new, s_old, s_new, v_x, v_y, f2, w_x, w_y, v,
+                dx, dy, dt):
+        """
+        This function advances the fine densities from t to t + dt.
+        The ghost cells are interpolated in time between the states of the
+        base mesh at time t and t + dt. The fluxes of pirates and ships are
+        computed with the fine densities; the fields v_x, v_y, f2, w_x and
+        w_y, which do not depend on the density itself, are interpolated
+        from the base mesh.
+
+        :param p_old: numpy 2d array. Pirates on the base mesh at time t
+        :param p_new: numpy 2d array. Pirates on the base mesh at time t + dt
+        :param s_old: numpy 2d array. Ships on the base mesh at time t
+        :param s_new: numpy 2d array. Ships on the base mesh at time t + dt
+        :param v_x: numpy 2d array. x-component of the velocity of pirates
+        :param v_y: numpy 2d array. y-component of the velocity of pirates
+        :param f2: numpy 2d array. Coefficient f2 on the base mesh
+        :param w_x: numpy 2d array. x-component of the ships' velocity field
+        :param w_y: numpy 2d array. y-component of the ships' velocity field
+        :param v: function. It gives the speed of ships depending on the density
+        :param dx: float. The size of the x-mesh of the base mesh
+        :param dy: float. The size of the y-mesh of the base mesh
+        :param dt: float. The time step of the base mesh
+
+        The output is a tuple (p_fluxes, s_fluxes). Each element is a tuple
+        (left, right, bottom, top) containing the fluxes through the boundary
+        of the patch, averaged in time and on the faces of the base mesh.
+        The fluxes are oriented as in pde.one_step_hyperbolic_godunov.
+        """
+        (i_0, i_1, j_0, j_1) = self.box
+        r = self.ratio
+        b = numpy.s_[i_0:i_1 + 2, j_0:j_1 + 2]
+        dx_f = dx / r
+        dy_f = dy / r
+
+        ################################
+        # pirates: r**2 substeps
+        ################################
+        n_sub = r * r
+        dt_f = dt / n_sub
+        coarse_old = pde.augment(p_old)[b]
+        coarse_new = pde.augment(p_new)[b]
+        v_x_f = self.interpolate(v_x)
+        v_y_f = self.interpolate(v_y)
+        f2_f = self.interpolate(f2)[1:-1, 1:-1]
+
+        u = self.p_density
+        faces = [0., 0., 0., 0.]
+        for k in xrange(n_sub):
+            theta = float(k) / n_sub
+            u_pad = self.pad(u, (1. - theta) * coarse_old + theta * coarse_new)
+
+            # fluxes through the faces of the fine cells: - grad(rho) plus
+            # the transport v rho, averaged between the two cells
+            # (the centered differences of the base mesh)
+            flux_x = ((u_pad[1:-1, :-1] - u_pad[1:-1, 1:]) / dx_f +
+                      0.5 * (v_x_f * u_pad)[1:-1, :-1] + 0.5 * (v_x_f * u_pad)[1:-1, 1:])
+            flux_y = ((u_pad[:-1, 1:-1] - u_pad[1:, 1:-1]) / dy_f +
+                      0.5 * (v_y_f * u_pad)[:-1, 1:-1] + 0.5 * (v_y_f * u_pad)[1:, 1:-1])
+            faces[0] += flux_x[:, 0]
+            faces[1] += flux_x[:, -1]
+            faces[2] += flux_y[0, :]
+            faces[3] += flux_y[-1, :]
+
+            u = u + dt_f * (- (flux_x[:, 1:] - flux_x[:, :-1]) / dx_f
+                            - (flux_y[1:, :] - flux_y[:-1, :]) / dy_f + f2_f * u)
+
+        self.p_density = u
+        p_fluxes = self.average(faces, n_sub)
+
+        ################################
+        # ships: r substeps
+        ################################
+        n_sub = r
+        dt_f = dt / n_sub
+        coarse_old = pde.augment(s_old)[b]
+        coarse_new = pde.augment(s_new)[b]
+        w_x_f = self.interpolate(w_x)
+        w_y_f = self.interpolate(w_y)
+
+        u = self.s_density
+        faces = [0., 0., 0., 0.]
+        for k in xrange(n_sub):
+            theta = float(k) / n_sub
+            u = self.pad(u, (1. - theta) * coarse_old + theta * coarse_new)
+
+            (u, flux_x, flux_y) = pde.one_step_hyperbolic_godunov(u, v, w_x_f, w_y_f,
+                                                                  dx_f, dy_f, dt_f,
+                                                                  fluxes = True)
+            faces[0] += flux_x[1:-1, 1]
+            faces[1] += flux_x[1:-1, -2]
+            faces[2] += flux_y[1, 1:-1]
+            faces[3] += flux_y[-2, 1:-1]
+
+            # as in evolution.one_step_ships
+            u = numpy.minimum(numpy.maximum(u[1:-1, 1:-1], 0.), 1.)
+
+        self.s_density = u
+        s_fluxes = self.average(faces, n_sub)
+
+        return (p_fluxes, s_fluxes)
+
+
+    #
+    # Function for averaging the fluxes on the faces of the base mesh
+    #
+    def average(self, faces, n_sub):
+        r = self.ratio
+        return tuple(f.reshape((-1, r)).mean(axis = 1) / n_sub for f in faces)
+
+
+    #
+    # Function for copying the fine data of an old patch
+    #
+    def copy_from(self, old):
+        """
+        This function copies the fine densities of the patch old on the
+        intersection of the two patches.
+
+        :param old: patch with the same refinement ratio
+        """
+        r = self.ratio
+        i_0 = max(self.box[0], old.box[0])
+        i_1 = min(self.box[1], old.box[1])
+        j_0 = max(self.box[2], old.box[2])
+        j_1 = min(self.box[3], old.box[3])
+        if i_0 >= i_1 or j_0 >= j_1 or old.ratio != r:
+            return
+
+        new = numpy.s_[r * (i_0 - self.box[0]):r * (i_1 - self.box[0]),
+                       r * (j_0 - self.box[2]):r * (j_1 - self.box[2])]
+        fine = numpy.s_[r * (i_0 - old.box[0]):r * (i_1 - old.box[0]),
+                        r * (j_0 - old.box[2]):r * (j_1 - old.box[2])]
+        self.p_density[new] = old.p_density[fine]
+        self.s_density[new] = old.s_density[fine]
+
+
+#
+# linear prolongation
+#
+def prolong(u, box, r):
+    """
+    This function refines the box (i_0, i_1, j_0, j_1) of a 2d array by a
+    factor r, with a linear function on each cell whose slopes are limited
+    by minmod. It preserves the integral of u and does not create new
+    maxima or minima.
+    """
+    (i_0, i_1, j_0, j_1) = box
+    u = pde.augment(u)[i_0:i_1 + 2, j_0:j_1 + 2]
+
+    def minmod(a, b):
+        return numpy.where(a * b > 0., numpy.sign(a) * numpy.minimum(numpy.abs(a), numpy.abs(b)), 0.)
+
+    slope_x = minmod(u[1:-1, 2:] - u[1:-1, 1:-1], u[1:-1, 1:-1] - u[1:-1, :-2])
+    slope_y = minmod(u[2:, 1:-1] - u[1:-1, 1:-1], u[1:-1, 1:-1] - u[:-2, 1:-1])
+
+    # offsets of the centers of the fine cells from the center of the base cell
+    offsets = (numpy.arange(r) + 0.5) / r - 0.5
+    u_fine = numpy.repeat(numpy.repeat(u[1:-1, 1:-1], r, axis = 0), r, axis = 1)
+    u_fine += numpy.repeat(numpy.repeat(slope_x, r, axis = 0), r, axis = 1) * numpy.tile(offsets, j_1 - j_0)
+    u_fine += numpy.repeat(numpy.repeat(slope_y, r, axis = 0), r, axis = 1) * numpy.tile(offsets, i_1 - i_0)[:, None]
+
+    return u_fine
+
+
+#
+# conservative restriction
+#
+def restrict(u, r):
+    """
+    This function coarsens a 2d array by a factor r, averaging each block of
+    r x r cells. It preserves the integral of u.
+    """
+    (u1, u2) = numpy.shape(u)
+    return u.reshape((u1 // r, r, u2 // r, r)).mean(axis = 3).mean(axis = 1)
+
+
+#
+# cells to be refined
+#
+def flag_cells(p_density, s_density, dx, dy, threshold):
+    """
+    This function flags the cells of the base mesh where the norm of the
+    gradient of the density of pirates or of ships exceeds threshold.
+
+    :output flags: numpy 2d array of bools
+    """
+    flags = numpy.zeros(numpy.shape(p_density), dtype = bool)
+    for u in (p_density, s_density):
+        grad_y, grad_x = numpy.gradient(u, dy, dx)
+        flags |= numpy.sqrt(grad_x**2 + grad_y**2) > threshold
+
+    return flags
+
+
+#
+# boxes covering the flagged cells
+#
+def cluster(flags, buffer):
+    """
+    This function covers the flagged cells with rectangular boxes.
+    The flagged cells are enlarged by buffer cells, and the boxes are merged
+    until any two of them are separated by at least one cell.
+
+    :param flags: numpy 2d array of bools
+    :param buffer: int. Number of cells added around the flagged cells
+
+    :output boxes: list of tuples (i_0, i_1, j_0, j_1)
+    """
+    if not numpy.any(flags):
+        return []
+
+    if buffer > 0:
+        flags = scipy.ndimage.binary_dilation(flags, structure = numpy.ones((3, 3)),
+                                              iterations = buffer)
+    (labels, n) = scipy.ndimage.label(flags)
+    boxes = [(s[0].start, s[0].stop, s[1].start, s[1].stop)
+             for s in scipy.ndimage.find_objects(labels)]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in xrange(len(boxes)):
+            for j in xrange(i + 1, len(boxes)):
+                (b1, b2) = (boxes[i], boxes[j])
+                if b1[0] <= b2[1] and b2[0] <= b1[1] and \
+                   b1[2] <= b2[3] and b2[2] <= b1[3]:
+                    boxes[i] = (min(b1[0], b2[0]), max(b1[1], b2[1]),
+                                min(b1[2], b2[2]), max(b1[3], b2[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return boxes
+
+
+#
+# new patches
+#
+def regrid(patches, p_density, s_density, dx, dy, threshold, ratio, buffer):
+    """
+    This function creates the patches covering the cells where the gradients
+    of the densities exceed threshold. The fine data of the old patches are
+    kept where the old and the new patches intersect, elsewhere the fine
+    data are prolongated from the base mesh.
+
+    :param patches: list of patches
+    :param p_density: numpy 2d array. Density of pirates on the base mesh
+    :param s_density: numpy 2d array. Density of ships on the base mesh
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param threshold: float. Threshold for the norm of the gradients
+    :param ratio: int. Refinement ratio
+    :param buffer: int. Number of cells added around the flagged cells
+
+    :output new_patches: list of patches
+    """
+    boxes = cluster(flag_cells(p_density, s_density, dx, dy, threshold), buffer)
+
+    new_patches = []
+    for box in boxes:
+        q = patch(box, ratio, p_density, s_density)
+        for old in patches:
+            q.copy_from(old)
+        new_patches.append(q)
+
+    return new_patches
+
+
+#
+# correction of the base mesh with the fluxes of a patch
+#
+def reflux(u, box, flux_x, flux_y, fine_fluxes, dx, dy, dt):
+    """
+    This function replaces, in the cells of the base mesh next to the patch,
+    the fluxes of the base mesh with the fluxes of the patch.
+
+    :param u: numpy 2d array. Density on the base mesh at time t + dt.
+              It is modified in place
+    :param box: tuple (i_0, i_1, j_0, j_1) of the patch
+    :param flux_x: numpy 2d array. x-fluxes of the base mesh
+    :param flux_y: numpy 2d array. y-fluxes of the base mesh
+    :param fine_fluxes: tuple (left, right, bottom, top) given by patch.advance
+    """
+    (i_0, i_1, j_0, j_1) = box
+    (u1, u2) = numpy.shape(u)
+    (left, right, bottom, top) = fine_fluxes
+
+    if j_0 > 0:
+        u[i_0:i_1, j_0 - 1] += (dt / dx) * (flux_x[i_0:i_1, j_0] - left)
+    if j_1 < u2:
+        u[i_0:i_1, j_1] += (dt / dx) * (right - flux_x[i_0:i_1, j_1])
+    if i_0 > 0:
+        u[i_0 - 1, j_0:j_1] += (dt / dy) * (flux_y[i_0, j_0:j_1] - bottom)
+    if i_1 < u1:
+        u[i_1, j_0:j_1] += (dt / dy) * (top - flux_y[i_1, j_0:j_1])
+
+
+#
+# function for the composite time step
+#
+def one_step(patches, p_density, s_density, xx, yy, div, v_x, v_y, f2, w_x, w_y, v,
+             dx, dy, dt):
+    """
+    This function performs a one time step on the base mesh and on the
+    patches for the equations
+    \partial_t rho = \Delta rho - div(V rho) + f2 rho
+    \partial_t A + div(A v(A) w) = 0
+    The fields V, f2 and w are computed on the base mesh and interpolated on
+    the patches, where the fluxes are computed with the fine densities.
+    The fluxes of the patches replace the ones of the base mesh through the
+    boundaries of the patches, so that the step conserves the mass as the
+    one of the base mesh. The densities of ships are clipped to [0, 1] on
+    each mesh, as in evolution.one_step_ships, but not after the correction.
+
+    :param patches: list of patches. They are advanced in place
+    :param p_density: numpy 2d array. Density of pirates on the base mesh
+    :param s_density: numpy 2d array. Density of ships on the base mesh
+    :param xx: numpy 2d array describing the x-mesh.
+    :param yy: numpy 2d array describing the y-mesh.
+    :param div: numpy 2d array. Term - div(V rho) on the base mesh
+    :param v_x: numpy 2d array. x-component of the velocity V of pirates
+    :param v_y: numpy 2d array. y-component of the velocity V of pirates
+    :param f2: numpy 2d array. Coefficient f2
+    :param w_x: numpy 2d array. x-component of the ships' velocity field
+    :param w_y: numpy 2d array. y-component of the ships' velocity field
+    :param v: function. It gives the speed of ships depending on the density
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param dt: float. The time step
+
+    The output is a tuple (p_new, s_new) with the composite densities at
+    time t + dt, averaged on the base mesh.
+    """
+    p_new = pde.one_step_parabolic(p_density, xx, yy, div, f2, dx, dy, dt)
+    (s_new, s_flux_x, s_flux_y) = pde.one_step_hyperbolic_godunov(s_density, v, w_x, w_y,
+                                                                   dx, dy, dt, fluxes = True)
+    s_new = numpy.minimum(numpy.maximum(s_new, 0.), 1.)
+
+    # fluxes of pirates of the base mesh, with the orientation of the
+    # hyperbolic ones (the centered differences of div are the differences
+    # of the means of V rho on the two sides of the faces)
+    p_aug = pde.augment(p_density)
+    t_x = pde.augment(v_x * p_density)
+    t_y = pde.augment(v_y * p_density)
+    p_flux_x = (p_aug[1:-1, :-1] - p_aug[1:-1, 1:]) / dx + 0.5 * (t_x[1:-1, :-1] + t_x[1:-1, 1:])
+    p_flux_y = (p_aug[:-1, 1:-1] - p_aug[1:, 1:-1]) / dy + 0.5 * (t_y[:-1, 1:-1] + t_y[1:, 1:-1])
+
+    fine_fluxes = [q.advance(p_density, p_new, s_density, s_new, v_x, v_y, f2, w_x, w_y, v,
+                             dx, dy, dt) for q in patches]
+
+    for (q, (p_fluxes, s_fluxes)) in zip(patches, fine_fluxes):
+        reflux(p_new, q.box, p_flux_x, p_flux_y, p_fluxes, dx, dy, dt)
+        reflux(s_new, q.box, s_flux_x, s_flux_y, s_fluxes, dx, dy, dt)
+
+    for q in patches:
+        b = numpy.s_[q.box[0]:q.box[1], q.box[2]:q.box[3]]
+        p_new[b] = restrict(q.p_density, q.ratio)
+        s_new[b] = restrict(q.s_density, q.ratio)
+
+    return (p_new, s_new)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+### artefacts.py
+### cache of the arrays computed at the set up of a simulation
+###
+### The meshes, the sampled kernels and direction of the ships, the
+### factorizations and the spectra of the kernels only depend on the mesh,
+### on the dtype and on some functions of parameters.py. They are saved as
+### .npy files, named by a hash of these parameters (the functions are
+### hashed through their code), and the following runs map them in memory:
+### their pages are read when they are used, and they are shared by the
+### runs on the same machine.
+
+import os
+import types
+import hashlib
+import numpy
+
+
+#
+# hash of a function
+#
+def function_key(function, seen = None):
+    """
+    This function returns a string identifying a function of parameters.py
+    by its code: its bytecode, its constants, its default arguments and the
+    values of the global names it uses (functions are hashed recursively,
+    modules by their name).
+    """
+    if seen is None:
+        seen = set()
+    if id(function) in seen:
+        return function.__name__
+    seen.add(id(function))
+
+    h = hashlib.sha1()
+
+    def update_code(code):
+        h.update(code.co_code)
+        h.update(repr(code.co_names) + repr(code.co_varnames))
+        for c in code.co_consts:
+            if isinstance(c, types.CodeType):
+                update_code(c)
+            else:
+                h.update(repr(c))
+        for name in code.co_names:
+            if name in function.__globals__:
+                h.update(name + '=' + value_key(function.__globals__[name], seen))
+
+    update_code(function.__code__)
+    h.update(value_key(function.__defaults__, seen))
+    for cell in function.__closure__ or ():
+        h.update(value_key(cell.cell_contents, seen))
+
+    return h.hexdigest()
+
+
+def value_key(value, seen):
+    """
+    This function returns a string identifying a value used by a function.
+    """
+    if isinstance(value, types.FunctionType):
+        return function_key(value, seen)
+    if isinstance(value, types.ModuleType):
+        return 'module ' + value.__name__
+    if isinstance(value, numpy.ndarray):
+        return hashlib.sha1(str(value.dtype) + str(value.shape) + value.tobytes()).hexdigest()
+    if isinstance(value, (tuple, list)):
+        return '(' + ', '.join(value_key(v, seen) for v in value) + ')'
+
+    return repr(value)
+
+
+#
+# key of an artefact
+#
+def key(*parameters):
+    """
+    This function returns the name (an hexadecimal string) of the artefact
+    depending on parameters: numbers, strings, arrays and functions.
+    """
+    return hashlib.sha1('|'.join(value_key(p, set()) for p in parameters)).hexdigest()
+
+
+#
+# class containing the cache of the artefacts
+#
+class store(object):
+
+    def __init__(self, directory):
+        """
+        Initialization function for the class.
+
+        :param directory: string. Directory of the .npy files
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+
+    #
+    # Function for getting an artefact
+    #
+    def array(self, name, compute):
+        """
+        This function returns the artefact name, mapped in memory read-only
+        if it is in the cache. Otherwise it is computed by compute(), saved
+        in the cache and returned.
+
+        :param name: string. Key of the artefact (see key)
+        :param compute: function without arguments returning a numpy array
+        """
+        path = os.path.join(self.directory, name[:2], name + '.npy')
+        if os.path.isfile(path):
+            self.hits += 1
+            return numpy.load(path, mmap_mode = 'r')
+
+        self.misses += 1
+        a = numpy.asarray(compute())
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another run
+                pass
+
+        # the file appears atomically for the other runs
+        temporary = path[:-4] + '.' + str(os.getpid()) + '.npy'
+        numpy.save(temporary, a)
+        os.rename(temporary, path)
+
+        return a
+
+
+    #
+    # Function for the artefacts depending on some parameters
+    #
+    def cached(self, *parameters):
+        """
+        This function returns the function (name, compute) returning the
+        artefact name depending on parameters (see array), as accepted by the
+        kernels of convolution.py.
+        """
+        def cached_array(name, compute):
+            return self.array(key(name, *parameters), compute)
+
+        return cached_array
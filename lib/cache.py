@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+### cache.py
+### cache of the results of finished simulations
+###
+### The key of a simulation is a hash of its normalized parameters: the
+### meshes, the initial data, the kernels, the cut-off functions and kappa
+### sampled on the mesh, the controls on the time mesh, the options changing
+### the results, and the source of the library. The results (saving_*.npz
+### or series*, and cost.npz) of a simulation are hard-linked in the entry
+### of its key; a simulation with the same key reuses them. The least recently used
+### entries are removed when the cache exceeds its size.
+
+import os
+import glob
+import shutil
+import hashlib
+import logging
+import numpy
+
+# source of the library, part of every key
+LIBRARY = os.path.dirname(os.path.abspath(__file__))
+
+
+#
+# hash of the source of the library
+#
+def library_version():
+    h = hashlib.sha1()
+    for name in sorted(glob.glob(os.path.join(LIBRARY, '*.py'))):
+        h.update(os.path.basename(name))
+        with open(name, 'rb') as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+#
+# key of a simulation
+#
+def key(pirates):
+    """
+    This function returns the key (an hexadecimal string) of the simulation
+    described by the pirate class. The functions of parameters.py are
+    compared through their values: the cut-off functions are sampled around
+    the center of the domain and the initial positions of the vessels, kappa
+    and speed_ships on [0, 2] and [0, 1].
+    The options of the saved states (output format, compression, encoding,
+    keyframes and precision) are part of the key, since the results are the
+    saved files. The number of processes, of threads and the concurrent
+    updates are not part of the key.
+    """
+    h = hashlib.sha1()
+
+    def update(a):
+        a = numpy.ascontiguousarray(a)
+        h.update(str(a.dtype) + str(a.shape))
+        h.update(a.tobytes())
+
+    xx = pirates.x_mesh
+    yy = pirates.y_mesh
+    centers = [((pirates.x_1 + pirates.x_2) / 2., (pirates.y_1 + pirates.y_2) / 2.)]
+    centers += [tuple(d) for d in pirates.police_initial_positions]
+    sample = numpy.linspace(0., 2., 201)
+
+    for a in [pirates.x, pirates.y, pirates.time, pirates.printing,
+              pirates.initial_density_pirates, pirates.initial_density_ships,
+              pirates.kernel_mathcal_K, pirates.ships_kernels[0], pirates.ships_kernels[1],
+              pirates.ships_direction_mesh[0], pirates.ships_direction_mesh[1],
+              numpy.array(pirates.police_initial_positions, dtype = float),
+              numpy.array(pirates.a, dtype = float),
+              numpy.array([pirates.controls(t) for t in pirates.time[1:]], dtype = float),
+              pirates.kappa(sample), pirates.ships_speed(sample / 2.)]:
+        update(a)
+
+    for (c_x, c_y) in centers:
+        update(pirates.cut_off_C_pirates(xx - c_x, yy - c_y))
+        update(pirates.cut_off_C_ships(xx - c_x, yy - c_y))
+        update(pirates.cut_off_C_police(c_x - xx, c_y - yy))
+
+    options = (pirates.dtype.str, pirates.active_region, pirates.amr_threshold, pirates.amr_ratio,
+               pirates.amr_regrid, pirates.amr_buffer, pirates.kernel_tolerance, pirates.fft_memory,
+               pirates.prune_threshold, pirates.steady_tolerance, pirates.steady_window,
+               pirates.output_format, pirates.compression, pirates.encoding, pirates.keyframes,
+               pirates.precision)
+    h.update(repr(options))
+    h.update(library_version())
+
+    return h.hexdigest()
+
+
+#
+# function linking a file
+#
+def link(source, target):
+    """
+    This function hard-links source to target, replacing target. It copies
+    source if the hard link is not possible (another file system).
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+#
+# function reusing the results of a simulation
+#
+def restore(cacheDir, key, dirName):
+    """
+    This function links the results of the entry key of the cache in
+    dirName, and marks the entry as the most recently used.
+
+    :output found: bool. False if the cache has no entry key
+    """
+    entry = os.path.join(cacheDir, key)
+    if not os.path.isdir(entry):
+        return False
+
+    for name in sorted(os.listdir(entry)):
+        link(os.path.join(entry, name), os.path.join(dirName, name))
+    os.utime(entry, None)
+
+    return True
+
+
+#
+# function saving the results of a simulation
+#
+def store(cacheDir, key, dirName, start):
+    """
+    This function adds to the cache the results of the simulation in
+    dirName (the files saving_*.npz or the time series written after the
+    time start, and cost.npz). The entry appears atomically.
+
+    :param start: float. Time (as time.time()) of the start of the run
+    """
+    entry = os.path.join(cacheDir, key)
+    temporary = entry + '.' + str(os.getpid())
+    if os.path.isdir(entry):
+        return
+
+    os.makedirs(temporary)
+    names = [os.path.basename(f) for pattern in ['saving_*.npz', 'series*']
+             for f in glob.glob(os.path.join(dirName, pattern))
+             if os.path.getmtime(f) >= int(start)]
+    for name in sorted(names) + ['cost.npz']:
+        link(os.path.join(dirName, name), os.path.join(temporary, name))
+
+    try:
+        os.rename(temporary, entry)
+    except OSError:
+        # the same entry was stored by another run
+        shutil.rmtree(temporary)
+
+
+#
+# function bounding the size of the cache
+#
+def evict(cacheDir, size):
+    """
+    This function removes the least recently used entries of the cache
+    until its size is at most size bytes. The files of the entries which
+    are hard-linked in simulation directories are counted as well.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(cacheDir):
+        entry = os.path.join(cacheDir, name)
+        if not os.path.isdir(entry) or '.' in name:
+            continue
+        occupied = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), occupied, entry))
+        total += occupied
+
+    for (used, occupied, entry) in sorted(entries):
+        if total <= size:
+            break
+        shutil.rmtree(entry)
+        total -= occupied
+        logging.info('Cache entry ' + os.path.basename(entry) + ' evicted (' + str(occupied) + ' bytes)')
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+### convolution.py
+### 2d convolutions on a fixed mesh
+
+import numpy
+import scipy.signal
+import scipy.ndimage
+import scipy.fftpack
+
+
+#
+# function for computing a convolution
+#
+def convolve(h, kernel, box = None):
+    """
+    This function computes the entries [i_0:i_1, j_0:j_1] of
+    scipy.signal.convolve2d(h, kernel, mode='same'), using only the entries
+    of h which may contribute to them.
+
+    :param h: numpy 2d array
+    :param kernel: numpy 2d array or an object with a method
+                   convolve(h, box), like cropped_kernel
+    :param box: tuple (i_0, i_1, j_0, j_1) or None for the whole array
+
+    :output c: numpy 2d array of the shape of the box
+    """
+    if isinstance(kernel, numpy.ndarray):
+        kernel = cropped_kernel(kernel)
+
+    return kernel.convolve(h, box)
+
+
+#
+# zero padded window of an array
+#
+def window(h, i_0, i_1, j_0, j_1):
+    """
+    This function returns h[i_0:i_1, j_0:j_1], where the indices outside h
+    are allowed and correspond to zero entries. For a stack of arrays of
+    shape (..., h1, h2) the window is taken on the last two axes.
+    """
+    (h1, h2) = numpy.shape(h)[-2:]
+    w = numpy.zeros(numpy.shape(h)[:-2] + (i_1 - i_0, j_1 - j_0), dtype = h.dtype)
+
+    (a_0, a_1) = (max(i_0, 0), min(i_1, h1))
+    (b_0, b_1) = (max(j_0, 0), min(j_1, h2))
+    if a_0 < a_1 and b_0 < b_1:
+        w[..., a_0 - i_0:a_1 - i_0, b_0 - j_0:b_1 - j_0] = h[..., a_0:a_1, b_0:b_1]
+
+    return w
+
+
+#
+# class containing a kernel cropped to its support
+#
+class cropped_kernel(object):
+
+    def __init__(self, kernel):
+        """
+        Initialization function for the class.
+        The kernels sampled on the whole mesh are mostly zero. This class
+        keeps only the smallest rectangle containing the non-zero entries,
+        and its position with respect to the center used by
+        scipy.signal.convolve2d(..., mode='same').
+
+        :param kernel: numpy 2d array
+        """
+        (k1, k2) = numpy.shape(kernel)
+        self.shape = (k1, k2)
+
+        rows = numpy.flatnonzero(numpy.any(kernel != 0, axis = 1))
+        cols = numpy.flatnonzero(numpy.any(kernel != 0, axis = 0))
+        if len(rows) == 0:
+            self.data = None
+            return
+
+        self.data = kernel[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        # first entry of h contributing to the entry (0, 0) of the convolution
+        self.first = ((k1 - 1) // 2 - rows[-1], (k2 - 1) // 2 - cols[-1])
+
+
+    #
+    # Function for computing the convolution
+    #
+    def convolve(self, h, box = None):
+        """
+        This function computes the entries [i_0:i_1, j_0:j_1] of
+        scipy.signal.convolve2d(h, kernel, mode='same'), using only the
+        entries of h which may contribute to them.
+
+        :param h: numpy 2d array
+        :param box: tuple (i_0, i_1, j_0, j_1) or None for the whole array
+
+        :output c: numpy 2d array of the shape of the box
+        """
+        if box is None:
+            box = (0, numpy.shape(h)[0], 0, numpy.shape(h)[1])
+        (i_0, i_1, j_0, j_1) = box
+
+        if self.data is None:
+            return numpy.zeros((i_1 - i_0, j_1 - j_0), dtype = h.dtype)
+
+        (c1, c2) = numpy.shape(self.data)
+        r_0 = i_0 + self.first[0]
+        s_0 = j_0 + self.first[1]
+        w = window(h, r_0, r_0 + i_1 - i_0 + c1 - 1, s_0, s_0 + j_1 - j_0 + c2 - 1)
+
+        return scipy.signal.convolve2d(w, self.data, mode = 'valid')
+
+
+#
+# class containing a kernel approximated by a sum of separable kernels
+#
+class separable_kernel(cropped_kernel):
+
+    def __init__(self, kernel, tolerance, cached = None):
+        """
+        Initialization function for the class.
+        The kernel, cropped to its support, is approximated by the truncated
+        singular value decomposition
+            sum_k columns[k] * rows[k]^T,
+        keeping the smallest number of terms whose relative error in the
+        Frobenius norm is at most tolerance. The convolution is then a sum of
+        convolutions along the columns and along the rows.
+
+        :param kernel: numpy 2d array
+        :param tolerance: float. Relative error allowed on the kernel
+        :param cached: function (name, compute) returning the array
+                       compute() or a copy kept in a cache (see
+                       artefacts.store.cached), or None
+        """
+        cropped_kernel.__init__(self, kernel)
+        self.rank = 0
+        if self.data is None:
+            return
+
+        if cached is None:
+            (U, S, V) = numpy.linalg.svd(self.data, full_matrices = False)
+        else:
+            factors = []
+            def svd(k):
+                if not factors:
+                    factors.extend(numpy.linalg.svd(self.data, full_matrices = False))
+                return factors[k]
+            (U, S, V) = [cached(name, lambda k = k: svd(k)) for (k, name) in enumerate(['U', 'S', 'V'])]
+        # tail[k] = norm of the terms k, k+1, ...
+        tail = numpy.sqrt(numpy.cumsum((S**2)[::-1])[::-1])
+        self.rank = max(int(numpy.sum(tail > tolerance * tail[0])), 1)
+
+        self.columns = [U[:, k] * S[k] for k in xrange(self.rank)]
+        self.rows = [V[k, :] for k in xrange(self.rank)]
+        self.error = tail[self.rank] / tail[0] if self.rank < len(S) else 0.
+
+
+    #
+    # Function for computing the convolution
+    #
+    def convolve(self, h, box = None):
+        """
+        This function computes the entries [i_0:i_1, j_0:j_1] of
+        scipy.signal.convolve2d(h, kernel, mode='same'), up to the error of
+        the separable approximation of the kernel.
+
+        :param h: numpy 2d array
+        :param box: tuple (i_0, i_1, j_0, j_1) or None for the whole array
+
+        :output c: numpy 2d array of the shape of the box
+        """
+        if box is None:
+            box = (0, numpy.shape(h)[0], 0, numpy.shape(h)[1])
+        (i_0, i_1, j_0, j_1) = box
+
+        c = numpy.zeros((i_1 - i_0, j_1 - j_0), dtype = h.dtype)
+        if self.data is None:
+            return c
+
+        (c1, c2) = numpy.shape(self.data)
+        r_0 = i_0 + self.first[0]
+        s_0 = j_0 + self.first[1]
+        w = window(h, r_0, r_0 + i_1 - i_0 + c1 - 1, s_0, s_0 + j_1 - j_0 + c2 - 1)
+
+        for k in xrange(self.rank):
+            c += valid_convolve1d(valid_convolve1d(w, self.rows[k], 1), self.columns[k], 0)
+
+        return c
+
+
+#
+# class containing a kernel whose convolutions are computed by tiled FFTs
+#
+class fft_kernel(cropped_kernel):
+
+    def __init__(self, kernel, memory, cached = None):
+        """
+        Initialization function for the class.
+        The convolution is computed by overlap-save: the box is split in
+        tiles, and each tile is obtained from the FFT of the window of h it
+        depends on. The FFTs are about four times the support of the kernel,
+        and smaller (down to twice the support) if the temporaries of a tile
+        would exceed memory. The spectra of the kernel cropped to its support
+        are cached for each size of the FFTs.
+
+        :param kernel: numpy 2d array
+        :param memory: float. Memory budget in bytes for the temporaries of
+                       one tile (the spectrum of the kernel excluded)
+        :param cached: function (name, compute) returning the array
+                       compute() or a copy kept in a cache (see
+                       artefacts.store.cached), or None
+        """
+        cropped_kernel.__init__(self, kernel)
+        self.memory = memory
+        self.spectra = {}
+        self.cached = cached
+        if self.data is None:
+            return
+
+        (c1, c2) = numpy.shape(self.data)
+        (f1, f2) = (scipy.fftpack.next_fast_len(4 * c1), scipy.fftpack.next_fast_len(4 * c2))
+        # below twice the support most of each FFT is wasted on the overlap,
+        # hence the budget is not respected for very large kernels
+        (g1, g2) = (scipy.fftpack.next_fast_len(2 * c1), scipy.fftpack.next_fast_len(2 * c2))
+        while tile_memory(f1, f2) > memory and (f1 > g1 or f2 > g2):
+            if f1 * c2 >= f2 * c1 and f1 > g1:
+                f1 = max(scipy.fftpack.next_fast_len(3 * f1 // 4), g1)
+            else:
+                f2 = max(scipy.fftpack.next_fast_len(3 * f2 // 4), g2)
+        self.tile = (f1 - c1 + 1, f2 - c2 + 1)
+
+
+    #
+    # Function for the spectrum of the kernel
+    #
+    def spectrum(self, shape):
+        if shape not in self.spectra:
+            # only the spectrum of the full tiles is worth keeping: the
+            # sizes of the boxes change at each time step
+            (c1, c2) = numpy.shape(self.data)
+            if self.cached is None or shape != (self.tile[0] + c1 - 1, self.tile[1] + c2 - 1):
+                self.spectra[shape] = numpy.fft.rfft2(self.data, shape)
+            else:
+                self.spectra[shape] = self.cached('spectrum ' + str(shape),
+                                                  lambda: numpy.fft.rfft2(self.data, shape))
+
+        return self.spectra[shape]
+
+
+    #
+    # Function for computing the convolution
+    #
+    def convolve(self, h, box = None):
+        """
+        This function computes the entries [i_0:i_1, j_0:j_1] of
+        scipy.signal.convolve2d(h, kernel, mode='same'), up to the rounding
+        errors of the FFTs.
+
+        :param h: numpy 2d array
+        :param box: tuple (i_0, i_1, j_0, j_1) or None for the whole array
+
+        :output c: numpy 2d array of the shape of the box
+        """
+        if box is None:
+            box = (0, numpy.shape(h)[0], 0, numpy.shape(h)[1])
+        (i_0, i_1, j_0, j_1) = box
+
+        c = numpy.zeros((i_1 - i_0, j_1 - j_0), dtype = h.dtype)
+        if self.data is None:
+            return c
+
+        (c1, c2) = numpy.shape(self.data)
+        # the last tiles are not larger than the box
+        (t1, t2) = (min(self.tile[0], i_1 - i_0), min(self.tile[1], j_1 - j_0))
+        shape = (t1 + c1 - 1, t2 + c2 - 1)
+        K = self.spectrum(shape)
+
+        for k_0 in xrange(0, i_1 - i_0, t1):
+            for l_0 in xrange(0, j_1 - j_0, t2):
+                r_0 = i_0 + k_0 + self.first[0]
+                s_0 = j_0 + l_0 + self.first[1]
+                w = window(h, r_0, r_0 + shape[0], s_0, s_0 + shape[1])
+                tile = numpy.fft.irfft2(numpy.fft.rfft2(w) * K, shape)
+                (n1, n2) = (min(t1, i_1 - i_0 - k_0), min(t2, j_1 - j_0 - l_0))
+                c[k_0:k_0 + n1, l_0:l_0 + n2] = tile[c1 - 1:c1 - 1 + n1, c2 - 1:c2 - 1 + n2]
+
+        return c
+
+
+#
+# class containing a kernel convolved with stacks of arrays by batched FFTs
+#
+class stacked_kernel(cropped_kernel):
+
+    def __init__(self, kernel):
+        """
+        Initialization function for the class.
+        The convolutions of all the arrays of a stack of shape (S, h1, h2)
+        are computed together, by FFTs along the last two axes. The spectra
+        of the kernel cropped to its support are cached for each size of the
+        FFTs.
+
+        :param kernel: numpy 2d array
+        """
+        cropped_kernel.__init__(self, kernel)
+        self.spectra = {}
+
+
+    #
+    # Function for the spectrum of the kernel
+    #
+    def spectrum(self, shape):
+        if shape not in self.spectra:
+            self.spectra[shape] = numpy.fft.rfft2(self.data, shape)
+
+        return self.spectra[shape]
+
+
+    #
+    # Function for computing the convolution
+    #
+    def convolve(self, h, box = None):
+        """
+        This function computes the entries [..., i_0:i_1, j_0:j_1] of the
+        convolutions scipy.signal.convolve2d(h[s], kernel, mode='same') of
+        the arrays of the stack h, up to the rounding errors of the FFTs.
+
+        :param h: numpy array of shape (..., h1, h2)
+        :param box: tuple (i_0, i_1, j_0, j_1) or None for the whole arrays
+
+        :output c: numpy array of shape (..., i_1 - i_0, j_1 - j_0)
+        """
+        (h1, h2) = numpy.shape(h)[-2:]
+        if box is None:
+            box = (0, h1, 0, h2)
+        (i_0, i_1, j_0, j_1) = box
+
+        if self.data is None:
+            return numpy.zeros(numpy.shape(h)[:-2] + (i_1 - i_0, j_1 - j_0), dtype = h.dtype)
+
+        # overlap-save with a single tile
+        (c1, c2) = numpy.shape(self.data)
+        (n1, n2) = (i_1 - i_0 + c1 - 1, j_1 - j_0 + c2 - 1)
+        shape = (scipy.fftpack.next_fast_len(n1), scipy.fftpack.next_fast_len(n2))
+        r_0 = i_0 + self.first[0]
+        s_0 = j_0 + self.first[1]
+        w = window(h, r_0, r_0 + n1, s_0, s_0 + n2)
+        c = numpy.fft.irfft2(numpy.fft.rfft2(w, shape) * self.spectrum(shape), shape)
+
+        return numpy.asarray(c[..., c1 - 1:n1, c2 - 1:n2], dtype = h.dtype)
+
+
+#
+# memory used by the FFTs of a tile
+#
+def tile_memory(f1, f2):
+    """
+    This function returns the number of bytes of the temporaries of the FFT
+    of a f1 x f2 tile: the window and the inverse transform (doubles), the
+    spectrum and its product with the kernel (complex numbers).
+    """
+    return 2 * 8 * f1 * f2 + 2 * 16 * f1 * (f2 // 2 + 1)
+
+
+#
+# 1d convolution along an axis of a 2d array
+#
+def valid_convolve1d(h, weights, axis):
+    """
+    This function computes the convolution of the 2d array h with the 1d
+    array weights along the given axis, keeping only the entries where they
+    overlap completely (as mode='valid' of scipy.signal.convolve2d).
+    """
+    L = len(weights)
+    c = scipy.ndimage.convolve1d(h, weights, axis = axis, mode = 'constant')
+    o = L - 1 - L // 2
+    if axis == 0:
+        return c[o:o + numpy.shape(h)[0] - L + 1]
+
+    return c[:, o:o + numpy.shape(h)[1] - L + 1]
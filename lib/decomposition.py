@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+### decomposition.py
+### domain decomposition of the mesh across worker processes
+###
+### The densities live in shared memory. Each worker owns a strip of rows of
+### the mesh and advances it, reading the rows of the other strips it needs
+### (the halo of the stencils and the support of the kernels) directly from
+### the shared arrays. The master process combines the police forces and the
+### cost, and synchronizes the workers at each time step.
+
+import numpy
+import multiprocessing
+import multiprocessing.sharedctypes
+import logging
+import traceback
+import pde
+import convolution
+import evolution
+
+# rows above and below each strip recomputed by its worker: one for the
+# gradient of the convolution and one for the divergence of the flux
+HALO = 2
+
+
+#
+# numpy array in shared memory
+#
+def shared_array(shape, dtype = numpy.float64):
+    """
+    This function returns a numpy array of the given shape and dtype
+    (float32 or float64), whose memory is shared with the processes forked
+    afterwards.
+    """
+    dtype = numpy.dtype(dtype)
+    raw = multiprocessing.sharedctypes.RawArray('f' if dtype == numpy.float32 else 'd',
+                                                int(numpy.prod(shape)))
+    return numpy.frombuffer(raw, dtype = dtype).reshape(shape)
+
+
+#
+# kernel cropped to its support
+#
+def crop(kernel):
+    """
+    This function returns convolution.cropped_kernel(kernel) if kernel is a
+    numpy array, and kernel itself otherwise.
+    """
+    if isinstance(kernel, numpy.ndarray):
+        return convolution.cropped_kernel(kernel)
+
+    return kernel
+
+
+#
+# class containing the decomposed domain
+#
+class decomposition(object):
+
+    def __init__(self, pirates, processes):
+        """
+        Initialization function for the class. It starts the workers.
+
+        :param pirates: pirate class
+        :param processes: int. Number of worker processes, i.e. of strips
+        """
+        self.pirates = pirates
+        (n_y, n_x) = (pirates.n_y, pirates.n_x)
+        M = pirates.police_vessels
+
+        # double buffered densities and cut-off functions centered at the vessels
+        self.p_density = [shared_array((n_y, n_x), pirates.dtype) for i in xrange(2)]
+        self.s_density = [shared_array((n_y, n_x), pirates.dtype) for i in xrange(2)]
+        self.cut_offs = shared_array((3, max(M, 1), n_y, n_x), pirates.dtype)
+        self.current = 0
+        self.last_integral = None
+
+        # kernels cropped to their supports (or their separable approximations)
+        self.p_kernel = crop(pirates.p_kernel)
+        self.s_kernels = tuple(crop(k) for k in pirates.s_kernels)
+
+        # strips of rows
+        processes = max(min(processes, n_y), 1)
+        bounds = numpy.linspace(0, n_y, processes + 1).astype(int)
+        self.strips = zip(bounds[:-1], bounds[1:])
+
+        # the cut-off functions are normalized on the whole mesh, hence each
+        # of them is evaluated by a single worker: (kind, vessel)
+        tasks = [(kind, i) for kind in xrange(3) for i in xrange(M)]
+        self.tasks = [tasks[k::processes] for k in xrange(processes)]
+
+        self.connections = []
+        self.workers = []
+        for strip in self.strips:
+            (parent, child) = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target = run_worker, args = (self, strip, child))
+            worker.daemon = True
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+        logging.info('Domain decomposed in ' + str(processes) + ' strips: ' + str(self.strips))
+
+
+    #
+    # Function for sending a message to each worker and waiting for them
+    #
+    def broadcast(self, messages):
+        for (connection, message) in zip(self.connections, messages):
+            connection.send(message)
+
+        results = [connection.recv() for connection in self.connections]
+        for (error, result) in results:
+            if error is not None:
+                raise RuntimeError('Error in a worker process:\n' + error)
+
+        return [result for (error, result) in results]
+
+
+    #
+    # Function for the time step
+    #
+    def one_step(self, p_density, s_density, police, time):
+        """
+        This function performs a one time step evolution for the whole system.
+        It has the same output as evolution.one_step_evolution; the densities
+        are views of the shared arrays and are overwritten two steps later.
+        """
+        c = self.current
+        if p_density is not self.p_density[c]:
+            self.p_density[c][...] = p_density
+        if s_density is not self.s_density[c]:
+            self.s_density[c][...] = s_density
+
+        if len(police) > 0:
+            self.broadcast([('cut_offs', police, tasks) for tasks in self.tasks])
+
+        results = self.broadcast([('step', police, c)] * len(self.connections))
+
+        # global reductions
+        forces = [(sum(r[0][i][0] for r in results), sum(r[0][i][1] for r in results))
+                  for i in xrange(len(police))]
+        self.last_integral = sum(r[1] for r in results)
+        self.current = 1 - c
+
+        police_new = evolution.police_evolution(police, forces, self.pirates.dt,
+                                                self.pirates.controls, time)
+
+        return (self.p_density[1 - c], self.s_density[1 - c], police_new)
+
+
+    #
+    # Function for the integral in the cost
+    #
+    def integral(self, p_density, s_density):
+        """
+        This function returns numpy.sum(p_density * s_density), using the
+        partial sums of the workers when the densities are the last ones.
+        """
+        if p_density is self.p_density[self.current] and self.last_integral is not None:
+            return self.last_integral
+
+        return numpy.sum(p_density * s_density, dtype = numpy.float64)
+
+
+    #
+    # Function for stopping the workers
+    #
+    def close(self):
+        for connection in self.connections:
+            connection.send(('stop', ))
+        for worker in self.workers:
+            worker.join()
+
+
+#
+# main loop of a worker
+#
+def run_worker(domain, strip, connection):
+    """
+    This function is executed by each worker process.
+
+    :param domain: decomposition class
+    :param strip: tuple (r_0, r_1). Rows owned by the worker
+    :param connection: end of the pipe connected to the master process
+    """
+    while True:
+        message = connection.recv()
+        if message[0] == 'stop':
+            break
+
+        try:
+            if message[0] == 'cut_offs':
+                result = worker_cut_offs(domain, message[1], message[2])
+            else:
+                result = worker_step(domain, strip, message[1], message[2])
+            connection.send((None, result))
+        except Exception:
+            connection.send((traceback.format_exc(), None))
+
+
+#
+# cut-off functions centered at the police vessels
+#
+def worker_cut_offs(domain, police, tasks):
+    pirates = domain.pirates
+    xx = pirates.x_mesh
+    yy = pirates.y_mesh
+
+    for (kind, i) in tasks:
+        if kind == 0:
+            domain.cut_offs[0, i] = pirates.a[i] * pirates.cut_off_C_pirates(xx - police[i][0], yy - police[i][1])
+        elif kind == 1:
+            domain.cut_offs[1, i] = pirates.cut_off_C_ships(xx - police[i][0], yy - police[i][1])
+        else:
+            domain.cut_offs[2, i] = pirates.cut_off_C_police(police[i][0] - xx, police[i][1] - yy)
+
+
+#
+# time step on a strip
+#
+def worker_step(domain, strip, police, c):
+    """
+    This function advances the rows r_0:r_1 of the densities.
+
+    :param domain: decomposition class
+    :param strip: tuple (r_0, r_1)
+    :param police: list containing the position of police
+    :param c: int. Index of the buffers containing the densities at time t
+
+    :output (forces, integral): partial sums over the strip of the police
+                                forces F1 and of p_new * s_new
+    """
+    pirates = domain.pirates
+    (dx, dy, dt) = (pirates.dx, pirates.dy, pirates.dt)
+    (r_0, r_1) = strip
+    (e_0, e_1) = (max(r_0 - HALO, 0), min(r_1 + HALO, pirates.n_y))
+    box = (e_0, e_1, 0, pirates.n_x)
+    e = numpy.s_[e_0:e_1]
+    own = numpy.s_[r_0 - e_0:r_1 - e_0]
+    xx = pirates.x_mesh
+    yy = pirates.y_mesh
+
+    p_density = domain.p_density[c]
+    s_density = domain.s_density[c]
+
+    ################################
+    # Evolution of pirate density
+    ################################
+    p_convolution = dx * dy * convolution.convolve(s_density, domain.p_kernel, box)
+    div = evolution.pirates_divergence(p_density[e], p_convolution, dx, dy, pirates.kappa)
+
+    f = numpy.zeros_like(xx[e])
+    for i in xrange(len(police)):
+        f += domain.cut_offs[0, i, e_0:e_1]
+
+    p_new = pde.one_step_parabolic(p_density[e], xx[e], yy[e], div, -f, dx, dy, dt)
+    domain.p_density[1 - c][r_0:r_1] = p_new[own]
+
+    ################################
+    # Evolution of ship density
+    ################################
+    cal_I1_x = - dx * dy * convolution.convolve(p_density, domain.s_kernels[0], box)
+    cal_I1_y = - dx * dy * convolution.convolve(p_density, domain.s_kernels[1], box)
+
+    cal_I2_x = numpy.zeros_like(xx[e])
+    cal_I2_y = numpy.zeros_like(xx[e])
+    for i in xrange(len(police)):
+        C_i = domain.cut_offs[1, i, e_0:e_1]
+        cal_I2_x += C_i * (police[i][0] - xx[e])
+        cal_I2_y += C_i * (police[i][1] - yy[e])
+
+    (vel_x, vel_y) = evolution.unit_velocity(cal_I1_x + cal_I2_x + pirates.ships_direction_mesh[0][e],
+                                             cal_I1_y + cal_I2_y + pirates.ships_direction_mesh[1][e])
+
+    s_new = pde.one_step_hyperbolic_godunov(s_density[e], pirates.ships_speed, vel_x, vel_y, dx, dy, dt)
+    domain.s_density[1 - c][r_0:r_1] = numpy.minimum(numpy.maximum(s_new[own], 0.), 1.)
+
+    ################################
+    # Partial sums
+    ################################
+    r = numpy.s_[r_0:r_1]
+    forces = []
+    for i in xrange(len(police)):
+        temp = domain.cut_offs[2, i, r_0:r_1] * p_density[r] * s_density[r]
+        F1_x = dx * dy * numpy.sum(temp * (xx[r] - police[i][0]), dtype = numpy.float64)
+        F1_y = dx * dy * numpy.sum(temp * (yy[r] - police[i][1]), dtype = numpy.float64)
+        forces.append((F1_x, F1_y))
+
+    integral = numpy.sum(domain.p_density[1 - c][r] * domain.s_density[1 - c][r], dtype = numpy.float64)
+
+    return (forces, integral)
+
+
+#
+# function for solving the system on the decomposed domain
+#
+def run(pirates, processes):
+    """
+    This function performs the evolution for the whole system, as
+    evolution.evolution, with the mesh decomposed in strips advanced by
+    processes worker processes.
+
+    :param pirates: pirate class
+    :param processes: int. Number of worker processes
+    """
+    domain = decomposition(pirates, processes)
+    try:
+        evolution.evolution(pirates, one_step = domain.one_step, integral = domain.integral)
+    finally:
+        domain.close()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+### ensemble.py
+### evolution of many scenarios differing only in the police
+###
+### The scenarios share the mesh, the time steps, the kernels, the initial
+### densities and the functions kappa and speed_ships; they may differ in
+### the number a_i, the initial positions and the controls of the police
+### vessels, and in the cut-off functions around them. The densities of the
+### S scenarios are stacked in arrays of shape (S, n_y, n_x) and the police
+### vessels in an array of shape (S, M, 2): the convolutions (by batched
+### FFTs), the fluxes and the Laplacians are computed once for the whole
+### stack at each time step.
+
+import numpy
+import pde
+import convolution
+import evolution
+import sys
+import logging
+from datetime import datetime
+
+
+#
+# function checking that two scenarios can be stacked
+#
+def compatible(p, q):
+    """
+    This function returns True if the pirate classes p and q can be evolved
+    in the same ensemble. The functions kappa and speed_ships are compared
+    on sample values.
+    """
+    if (p.dtype != q.dtype or p.police_vessels != q.police_vessels or
+        numpy.shape(p.x_mesh) != numpy.shape(q.x_mesh) or len(p.time) != len(q.time)):
+        return False
+
+    sample = numpy.linspace(0., 2., 201)
+    arrays = [(p.x_mesh, q.x_mesh), (p.y_mesh, q.y_mesh), (p.time, q.time),
+              (p.initial_density_pirates, q.initial_density_pirates),
+              (p.initial_density_ships, q.initial_density_ships),
+              (p.kernel_mathcal_K, q.kernel_mathcal_K),
+              (p.ships_kernels[0], q.ships_kernels[0]), (p.ships_kernels[1], q.ships_kernels[1]),
+              (p.ships_direction_mesh[0], q.ships_direction_mesh[0]),
+              (p.ships_direction_mesh[1], q.ships_direction_mesh[1]),
+              (p.kappa(sample), q.kappa(sample)),
+              (p.ships_speed(sample / 2.), q.ships_speed(sample / 2.))]
+
+    return all(numpy.array_equal(u, v) for (u, v) in arrays)
+
+
+#
+# function grouping the scenarios which can be stacked
+#
+def groups(members):
+    """
+    This function splits the list of pirate classes members in lists of
+    compatible scenarios.
+    """
+    result = []
+    for p in members:
+        for group in result:
+            if compatible(group[0], p):
+                group.append(p)
+                break
+        else:
+            result.append([p])
+
+    return result
+
+
+#
+# class containing the ensemble of scenarios
+#
+class ensemble(object):
+
+    def __init__(self, members):
+        """
+        Initialization function for the class.
+
+        :param members: list of compatible pirate classes (see compatible),
+                        one for each scenario. The outputs of each scenario
+                        are saved in its base_directory
+        """
+        for p in members[1:]:
+            if not compatible(members[0], p):
+                raise ValueError('The scenario ' + p.base_directory + ' cannot be stacked with ' +
+                                 members[0].base_directory)
+
+        self.members = members
+        self.base = members[0]
+        self.S = len(members)
+
+        # kernels convolved with the stacks by batched FFTs
+        self.p_kernel = convolution.stacked_kernel(self.base.kernel_mathcal_K)
+        self.s_kernels = tuple(convolution.stacked_kernel(k) for k in self.base.ships_kernels)
+
+
+    #
+    # Function for the initial state
+    #
+    def initial_state(self):
+        """
+        This function returns the tuple (p_density, s_density, police) of the
+        stacked initial densities, of shape (S, n_y, n_x), and of the
+        positions of the police vessels, of shape (S, M, 2).
+        """
+        shape = (self.S, ) + numpy.shape(self.base.initial_density_pirates)
+        p_density = numpy.empty(shape, dtype = self.base.dtype)
+        s_density = numpy.empty(shape, dtype = self.base.dtype)
+        p_density[...] = self.base.initial_density_pirates
+        s_density[...] = self.base.initial_density_ships
+        police = numpy.array([p.police_initial_positions for p in self.members], dtype = float)
+
+        return (p_density, s_density, police.reshape((self.S, self.base.police_vessels, 2)))
+
+
+    #
+    # Function for the time step
+    #
+    def one_step(self, p_density, s_density, police, time):
+        """
+        This function performs a one time step evolution for all the
+        scenarios, as evolution.one_step_evolution for each of them (up to
+        the rounding errors of the FFTs in the convolutions).
+
+        :param p_density: numpy 3d array of shape (S, n_y, n_x). Densities of
+                          pirates at time t
+        :param s_density: numpy 3d array of shape (S, n_y, n_x). Densities of
+                          ships at time t
+        :param police: numpy 3d array of shape (S, M, 2). Positions of the
+                       police vessels
+        :param time: float. initial time
+
+        :output (p_new, s_new, police_new): the stacks at time t + dt. The
+                       positions of the police are projected into the domain
+        """
+        base = self.base
+        xx = base.x_mesh
+        yy = base.y_mesh
+        (dx, dy, dt) = (base.dx, base.dy, base.dt)
+        M = base.police_vessels
+
+        ################################
+        # Evolution of pirate densities
+        ################################
+        p_convolution = dx * dy * self.p_kernel.convolve(s_density)
+        div = evolution.pirates_divergence(p_density, p_convolution, dx, dy, base.kappa)
+
+        # the cut-off functions are normalized on the mesh they receive,
+        # hence they are evaluated on the mesh of each scenario
+        f = numpy.zeros_like(p_density)
+        for (s, p) in enumerate(self.members):
+            for i in xrange(M):
+                f[s] += p.a[i] * p.cut_off_C_pirates(xx - police[s, i, 0], yy - police[s, i, 1])
+
+        p_new = pde.strip_map(pde.parabolic_stencil, [p_density, div, -f, dx, dy, dt], 1)
+
+        ################################
+        # Evolution of ship densities
+        ################################
+        cal_I1_x = - dx * dy * self.s_kernels[0].convolve(p_density)
+        cal_I1_y = - dx * dy * self.s_kernels[1].convolve(p_density)
+
+        cal_I2_x = numpy.zeros_like(p_density)
+        cal_I2_y = numpy.zeros_like(p_density)
+        for (s, p) in enumerate(self.members):
+            for i in xrange(M):
+                C_i = p.cut_off_C_ships(xx - police[s, i, 0], yy - police[s, i, 1])
+                cal_I2_x[s] += C_i * (police[s, i, 0] - xx)
+                cal_I2_y[s] += C_i * (police[s, i, 1] - yy)
+
+        (vel_x, vel_y) = evolution.unit_velocity(cal_I1_x + cal_I2_x + base.ships_direction_mesh[0],
+                                                 cal_I1_y + cal_I2_y + base.ships_direction_mesh[1])
+
+        s_new = pde.strip_map(pde.godunov_stencil, [s_density, base.ships_speed, vel_x, vel_y, dx, dy, dt], 1)
+        s_new = numpy.minimum(numpy.maximum(s_new, 0.), 1.)
+
+        ################################
+        # Evolution of police vessels
+        ################################
+        police_new = numpy.empty_like(police)
+        for (s, p) in enumerate(self.members):
+            forces = evolution.police_forces(p_density[s], s_density[s], police[s], xx, yy,
+                                             p.cut_off_C_police, dx, dy)
+            police_new[s] = numpy.reshape(p.project(evolution.police_evolution(police[s], forces, dt, p.controls, time)),
+                                          (M, 2))
+
+        return (p_new, s_new, police_new)
+
+
+    #
+    # Function for the evolution
+    #
+    def run(self):
+        """
+        This function performs the evolution of all the scenarios, and saves
+        the solutions and the costs of each of them as evolution.evolution.
+        The output streams of each scenario are saved as well. The refined
+        patches, the active regions, the pruning and the steady state
+        detection are not used.
+
+        :output costs: numpy vector of the S final costs
+        """
+        output = evolution.writer(self.members)
+        try:
+            costs = self.time_loop(output)
+        except:
+            output.close(check = False)
+            raise
+        output.close()
+
+        return costs
+
+
+    def time_loop(self, output):
+        """
+        This function contains the time loop of run. The states and the
+        costs are saved by output (see save.writer).
+        """
+        base = self.base
+        (p_density, s_density, police) = self.initial_state()
+
+        print_number = numpy.ones(self.S, dtype = int)
+        steps = len(base.time)
+        streams = [[(q, q.prepare(p)) for q in p.streams] for p in self.members]
+        costs = numpy.array([base.dt * numpy.sum(p_density[s] * s_density[s], dtype = numpy.float64)
+                             for s in xrange(self.S)])
+        logging.info('Ensemble of ' + str(self.S) + ' scenarios: ' +
+                     ', '.join(p.base_directory for p in self.members))
+
+        for i in xrange(1, steps):
+
+            police_old = police
+
+            # evolution from t to t + dt
+            (p_density, s_density, police) = self.one_step(p_density, s_density, police, base.time[i])
+
+            # costs
+            product = p_density * s_density
+            for s in xrange(self.S):
+                lenght2 = 0.
+                for ii in xrange(0, base.police_vessels):
+                    lenght2 += (police[s, ii, 0] - police_old[s, ii, 0])**2 + (police[s, ii, 1] - police_old[s, ii, 1])**2
+                costs[s] += base.dt * numpy.sum(product[s], dtype = numpy.float64)
+                costs[s] += numpy.sqrt(lenght2)
+
+            # progresses
+            sys.stdout.write('\r')
+            percentage = i * 100 /steps
+            sys.stdout.write("[%-100s] %d%%" % ('='*percentage, percentage))
+            sys.stdout.flush()
+
+            if i%100 == 0:
+                logging.info('Completed step ' + str(i) + ' over ' + str(steps) + ' steps at time ' + str(datetime.now()))
+
+            # printing
+            for (s, p) in enumerate(self.members):
+                if p.printing[i]:
+                    name = 'saving_' + str(print_number[s]).zfill(4)
+                    output.solution_Save(p.base_directory, name, base.time[i], p_density[s], s_density[s],
+                                         police[s], costs[s])
+                    print_number[s] += 1
+
+                # output streams
+                for (q, directory) in streams[s]:
+                    if i % q.every == 0 or i == steps - 1:
+                        (x, y, p_saved, s_saved) = q.extract(p, p_density[s], s_density[s], police[s])
+                        output.solution_Save(directory, q.next_name(), base.time[i], p_saved, s_saved,
+                                             police[s], costs[s], mesh = (x, y))
+
+        # saving the costs
+        for (s, p) in enumerate(self.members):
+            output.cost_Save(p.base_directory, 'cost', costs[s])
+            logging.info('Final cost of ' + p.base_directory + ' = ' + str(costs[s]))
+
+        return costs
@@ -1,13 +1,345 @@
 #!/usr/bin/env python
 
 import numpy
-import scipy.signal
 import pde
 import ode
+import amr
+import convolution
 import save
+import cache
+import steady
 import sys
+import os
 import logging
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+#
+# divergence term of the equation for pirates
+#
+def pirates_divergence(p_density, p_convolution, dx, dy, kappa):
+    """
+    This function computes the term - div(kappa(|grad(K * A)|) grad(K * A) rho)
+    of the equation for pirates. The arrays may have leading axes (a stack
+    of states, see ensemble.py).
+
+    :param p_density: numpy 2d array describing the density of pirates
+    :param p_convolution: numpy 2d array of the same shape as p_density.
+                          Convolution of the density of ships with the kernel
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param kappa: function. It is the normalized function in the equation for pirates
+
+    :output div: numpy 2d array of the same shape as p_density
+    """
+    return pde.strip_map(divergence_stencil, [p_density, p_convolution, dx, dy, kappa], 2)
+
+
+def divergence_stencil(p_density, p_convolution, dx, dy, kappa):
+    """
+    This function computes the stencil of pirates_divergence. The arrays may
+    have leading axes (a stack of states, see ensemble.py): the derivatives
+    are taken along the last two.
+    """
+    (vel_x, vel_y) = pirates_velocity(p_convolution, dx, dy, kappa, p_density.dtype)
+    flux_x = vel_x * p_density
+    flux_y = vel_y * p_density
+    # divergence
+    trash, div1 = numpy.gradient(flux_x, dy, dx, axis = (-2, -1))
+    div2, trash = numpy.gradient(flux_y, dy, dx, axis = (-2, -1))
+
+    return - div1 - div2
+
+
+#
+# velocity of pirates
+#
+def pirates_velocity(p_convolution, dx, dy, kappa, dtype):
+    """
+    This function computes the velocity kappa(|grad(K * A)|) grad(K * A) of
+    the flux of pirates, along the last two axes of p_convolution.
+
+    :param p_convolution: numpy array. Convolution of the density of ships
+                          with the kernel
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param kappa: function. It is the normalized function in the equation for pirates
+    :param dtype: numpy dtype of the densities
+
+    :output (vel_x, vel_y): tuple of numpy arrays of the shape of p_convolution
+    """
+    # gradient of the convolution
+    grad_py, grad_px = numpy.gradient(p_convolution, dy, dx, axis = (-2, -1))
+    # norm of the gradient
+    norm_grad_p_convolution = numpy.sqrt(grad_px**2 + grad_py**2)
+    # kappa may return an array of doubles
+    kappa_norm = numpy.asarray(kappa(norm_grad_p_convolution), dtype = dtype)
+
+    return (kappa_norm * grad_px, kappa_norm * grad_py)
+
+
+#
+# terms of the equation for pirates
+#
+def pirates_terms(p_density, s_density, police, xx, yy, p_kernel,
+                  cut_off_pirates, dx, dy, kappa, a, box, pruned = ()):
+    """
+    This function computes the terms of the equation for pirates which do
+    not depend on the diffusion, i.e. the divergence of the flux generated by
+    the ships and the source term f generated by the police.
+
+    :param p_density: numpy 2d array describing the density of pirates at time t
+    :param s_density: numpy 2d array describing the density of ships at time t
+    :param police: list containing the position of police
+    :param xx: numpy 2d array describing the x-mesh.
+    :param yy: numpy 2d array describing the y-mesh.
+    :param p_kernel: numpy 2d array describing the kernel in the equation for
+                     pirates, or a kernel accepted by convolution.convolve
+    :param cut_off_pirates: cut_off function for pirates.
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param kappa: function. It is the normalized function in the equation for pirates
+    :param a: array of floats. Coefficients a for the source term f.
+    :param box: tuple (i_0, i_1, j_0, j_1). The terms are computed on
+                [i_0:i_1, j_0:j_1]
+    :param pruned: terms given by inactive_terms. The pruned terms are 0.
+
+    :output (div, f): tuple of numpy 2d arrays of the shape of the box, or
+                      floats equal to 0. for the pruned terms.
+    """
+    b = numpy.s_[box[0]:box[1], box[2]:box[3]]
+
+    if 'pirates_flux' in pruned:
+        div = 0.
+    else:
+        # 2d convolution on a fixed mesh
+        # h * k [n, m] = dx * dy * convolve2d(h, k)
+        p_convolution = dx * dy * convolution.convolve(s_density, p_kernel, box)
+        div = pirates_divergence(p_density[b], p_convolution, dx, dy, kappa)
+
+    if 'pirates_source' in pruned:
+        return (div, 0.)
+
+    # term depending on the police
+    # (the cut-off functions are normalized on the mesh they receive,
+    # hence they are evaluated on the whole grid)
+    f = numpy.zeros_like(xx[b])
+    for i in xrange(len(police)):
+        f += a[i] * cut_off_pirates(xx - police[i][0], yy - police[i][1])[b]
+
+    return (div, f)
+
+
+#
+# velocity field in the equation for ships
+#
+def ships_velocity(p_density, police, xx, yy, cut_off_ships, dx, dy,
+                   nu_x, nu_y, box, s_kernels = None, pruned = ()):
+    """
+    This function computes the velocity field w in the equation for ships.
+    It is normalized so that its norm is at most 1.
+
+    :param p_density: numpy 2d array describing the density of pirates at time t
+    :param police: list containing the position of police
+    :param xx: numpy 2d array describing the x-mesh.
+    :param yy: numpy 2d array describing the y-mesh.
+    :param cut_off_ships: cut_off function for ships.
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+    :param nu_x: x-direction of the geometric component of nu
+    :param nu_y: y-direction of the geometric component of nu
+    :param box: tuple (i_0, i_1, j_0, j_1). The field is computed on
+                [i_0:i_1, j_0:j_1]
+    :param s_kernels: tuple of two kernels accepted by convolution.convolve,
+                      the sampled x * cut_off_ships and y * cut_off_ships.
+                      If None, they are computed from cut_off_ships.
+    :param pruned: terms given by inactive_terms. The pruned terms are 0.
+
+    :output (vel_x, vel_y): tuple of numpy 2d arrays of the shape of the box.
+    """
+    b = numpy.s_[box[0]:box[1], box[2]:box[3]]
+
+    if 'ships_interaction' in pruned:
+        (cal_I1_x, cal_I1_y) = (0., 0.)
+    else:
+        if s_kernels is None:
+            C = cut_off_ships(xx, yy)
+            s_kernels = (xx * C, yy * C)
+
+        # 2d convolution on a fixed mesh
+        # h * k [n, m] = dx * dy * convolve2d(h, k)
+        cal_I1_x = - dx * dy * convolution.convolve(p_density, s_kernels[0], box)
+        cal_I1_y = - dx * dy * convolution.convolve(p_density, s_kernels[1], box)
+
+    cal_I2_x = numpy.zeros_like(xx[b])
+    cal_I2_y = numpy.zeros_like(xx[b])
+    for i in xrange(len(police)):
+        C_i = cut_off_ships(xx - police[i][0], yy - police[i][1])[b]
+        cal_I2_x += C_i * (police[i][0] - xx[b])
+        cal_I2_y += C_i * (police[i][1] - yy[b])
+
+    return unit_velocity(cal_I1_x + cal_I2_x + nu_x[b], cal_I1_y + cal_I2_y + nu_y[b])
+
+
+#
+# normalization of the velocity field
+#
+def unit_velocity(vel_x, vel_y):
+    """
+    This function divides the vector field (vel_x, vel_y) by the maximum
+    between its norm and 1.
+    """
+    # (vel_x, vel_y) should be at most of norm 1!!!
+    vel_pseudo_norm = numpy.maximum(numpy.sqrt(vel_x**2 + vel_y**2), 1.)
+
+    return (vel_x / vel_pseudo_norm, vel_y / vel_pseudo_norm)
+
+
+#
+# interaction between the police vessels and the densities
+#
+def police_forces(p_density, s_density, police, xx, yy, cut_off_police, dx, dy):
+    """
+    This function computes the term F1 of the vector field driving the
+    police vessels.
+
+    :param p_density: numpy 2d array describing the density of pirates at time t
+    :param s_density: numpy 2d array describing the density of ships at time t
+    :param police: list containing the position of police
+    :param xx: numpy 2d array describing the x-mesh.
+    :param yy: numpy 2d array describing the y-mesh.
+    :param cut_off_police: cut_off function for police.
+    :param dx: float. The size of the x-mesh
+    :param dy: float. The size of the y-mesh
+
+    :output forces: list of tuples (F1_x, F1_y), one for each vessel
+    """
+    forces = []
+    for i in xrange(len(police)):
+        temp = cut_off_police(police[i][0] - xx, police[i][1] - yy) * p_density * s_density
+        F1_x = dx * dy * numpy.sum(temp * (xx - police[i][0]), dtype = numpy.float64)
+        F1_y = dx * dy * numpy.sum(temp * (yy - police[i][1]), dtype = numpy.float64)
+        forces.append((F1_x, F1_y))
+
+    return forces
+
+
+#
+# evolution of the police vessels
+#
+def police_evolution(police, forces, dt, controls, time):
+    """
+    This function performs a one time step evolution for the police vessels
+
+    :param police: list containing the position of police
+    :param forces: list of tuples (F1_x, F1_y) given by police_forces
+    :param dt: float. The time step.
+    :param controls: function giving the controls for police vessels
+    :param time: float. initial time
+
+    :output police_new: list of final position of police vessels
+    """
+    police_sum_x = sum(i[0] for i in police)
+    police_sum_y = sum(i[1] for i in police)
+    M = len(police)
+
+    police_new = []
+    for i in xrange(len(police)):
+        (F1_x, F1_y) = forces[i]
+
+        F2_x = police_sum_x - M * police[i][0]
+        F2_y = police_sum_y - M * police[i][1]
+
+        F3_x = controls(time)[i][0]   #control_x
+        F3_y = controls(time)[i][1]   #control_y
+
+        police_new.append(ode.ode(F1_x + F2_x + F3_x, F1_y + F2_y + F3_y, police[i], dt))
+
+    return police_new
+
+
+#
+# evolution of the density of pirates
+#
+def one_step_pirates(p_density, s_density, police, xx, yy, p_kernel,
+                     cut_off_pirates, dx, dy, dt, kappa, a, active_region, pruned = ()):
+    """
+    This function performs a one time step evolution for the density of
+    pirates. The parameters are the ones of one_step_evolution.
+
+    :output p_new: numpy 2d array of the same shape as p_density
+                   describing the density of pirates at time t + dt
+    """
+    # the explicit schemes move the support of the densities by at most one
+    # cell per time step; one more cell is left for the ghost cells of the
+    # stencils, so that restricting them to the active box gives the same
+    # result as the computation on the whole grid
+    if 'pirates' in pruned:
+        return p_density
+
+    if active_region:
+        box = pde.active_box(p_density, 2)
+    else:
+        box = (0, numpy.shape(p_density)[0], 0, numpy.shape(p_density)[1])
+
+    p_new = numpy.zeros_like(p_density)
+    if box is not None:
+        b = numpy.s_[box[0]:box[1], box[2]:box[3]]
+        (div, f) = pirates_terms(p_density, s_density, police, xx, yy, p_kernel,
+                                 cut_off_pirates, dx, dy, kappa, a, box, pruned)
+        p_new[b] = pde.one_step_parabolic(p_density[b], xx[b], yy[b], div, -f, dx, dy, dt)
+
+    return p_new
+
+
+#
+# evolution of the density of ships
+#
+def one_step_ships(p_density, s_density, police, xx, yy, cut_off_ships,
+                   dx, dy, dt, velocity, nu_x, nu_y, active_region, s_kernels, pruned = ()):
+    """
+    This function performs a one time step evolution for the density of
+    ships. The parameters are the ones of one_step_evolution.
+
+    :output s_new: numpy 2d array of the same shape as s_density
+                   describing the density of ships at time t + dt
+    """
+    if 'ships' in pruned:
+        return s_density
+
+    if active_region:
+        box = pde.active_box(s_density, 2)
+    else:
+        box = (0, numpy.shape(s_density)[0], 0, numpy.shape(s_density)[1])
+
+    s_new = numpy.zeros_like(s_density)
+    if box is not None:
+        b = numpy.s_[box[0]:box[1], box[2]:box[3]]
+        (vel_x, vel_y) = ships_velocity(p_density, police, xx, yy, cut_off_ships,
+                                        dx, dy, nu_x, nu_y, box, s_kernels, pruned)
+        s_new[b] = pde.one_step_hyperbolic_godunov(s_density[b], velocity, vel_x, vel_y, dx, dy, dt)
+
+    return numpy.minimum(numpy.maximum(s_new, 0.), 1.)
+
+
+#
+# evolution of the position of the police vessels
+#
+def one_step_police(p_density, s_density, police, xx, yy, cut_off_police,
+                    dx, dy, dt, controls, time, pruned = ()):
+    """
+    This function performs a one time step evolution for the police vessels.
+    The parameters are the ones of one_step_evolution.
+
+    :output police_new: list of final position of police vessels
+    """
+    if 'police_forces' in pruned:
+        forces = [(0., 0.)] * len(police)
+    else:
+        forces = police_forces(p_density, s_density, police, xx, yy, cut_off_police, dx, dy)
+
+    return police_evolution(police, forces, dt, controls, time)
+
 
 #
 # function for solving the system in a one temporal step 
@@ -16,7 +348,8 @@ def one_step_evolution(p_density, s_density, police, xx, yy,
                        p_kernel, cut_off_pirates,
                        cut_off_ships, cut_off_police,
                        dx, dy, dt, kappa, a,
-                       velocity, nu_x, nu_y, controls, time):
+                       velocity, nu_x, nu_y, controls, time,
+                       active_region = False, s_kernels = None, pool = None, pruned = ()):
     """
     This function performs a one time step evolution for the whole system
 
@@ -28,7 +361,8 @@ def one_step_evolution(p_density, s_density, police, xx, yy,
     :param yy: numpy 2d array describing the y-mesh. Same shape as p_density
                and s_density
     :param p_kernel: numpy 2d array describing the kernel in the equation for
-                     pirates. Same shape as p_density
+                     pirates. Same shape as p_density. It may also be a
+                     kernel accepted by convolution.convolve
     :param cut_off_pirates: cut_off function for pirates.
     :param cut_off_ships: cut_off function for ships.
     :param cut_off_police: cut_off function for police.
@@ -42,6 +376,14 @@ def one_step_evolution(p_density, s_density, police, xx, yy,
     :param nu_y: x-direction of the geometric component of nu
     :param controls: function giving the controls for police vessels
     :param time: float. initial time
+    :param active_region: bool. If True, the stencils are only computed on
+                          the boxes containing the supports of the densities
+    :param s_kernels: tuple of the two kernels in the equation for ships
+                      (see ships_velocity)
+    :param pool: multiprocessing.pool.ThreadPool or None. If not None, the
+                 densities of pirates and ships and the police vessels are
+                 updated concurrently
+    :param pruned: terms given by inactive_terms, which are skipped
 
     The output is a tuple (p_new, s_new, police_new) of three elements.
     :output p_new: numpy 2d array of the same shape as p_density
@@ -57,88 +399,126 @@ def one_step_evolution(p_density, s_density, police, xx, yy,
     assert (shape_p_density == numpy.shape(yy))
     assert (shape_p_density == numpy.shape(yy))
 
-    # Calculus of common terms ?
-    police_sum_x = sum(i[0] for i in police)
-    police_sum_y = sum(i[1] for i in police)
-    M = len(police)
-    
-    ################################
-    # Evolution of pirate density
-    ################################
-
-    # 2d convolution on a fixed mesh
-    # h * k [n, m] = dx * dy * convolve2d(h, k)
-    p_convolution = dx * dy * scipy.signal.convolve2d(s_density, p_kernel, mode='same')
-    # gradient of the convolution
-    grad_py, grad_px = numpy.gradient(p_convolution, dy, dx)
-    # norm of the gradient
-    norm_grad_p_convolution = numpy.sqrt(grad_px**2 + grad_py**2)
-    flux_x = kappa(norm_grad_p_convolution) * grad_px * p_density
-    flux_y = kappa(norm_grad_p_convolution) * grad_py * p_density
-    # divergence
-    trash, div1 = numpy.gradient(flux_x, dy, dx)
-    div2, trash = numpy.gradient(flux_y, dy, dx)
-    div = - div1 - div2
-    
-    # term depending on the police
-    f = numpy.zeros_like(xx)
-    for i in xrange(len(police)):
-        f += a[i] * cut_off_pirates(xx - police[i][0], yy - police[i][1])
+    p_args = (p_density, s_density, police, xx, yy, p_kernel, cut_off_pirates,
+              dx, dy, dt, kappa, a, active_region, pruned)
+    s_args = (p_density, s_density, police, xx, yy, cut_off_ships,
+              dx, dy, dt, velocity, nu_x, nu_y, active_region, s_kernels, pruned)
+    d_args = (p_density, s_density, police, xx, yy, cut_off_police,
+              dx, dy, dt, controls, time, pruned)
+
+    # the three updates only depend on the state at time t
+    if pool is None:
+        p_new = one_step_pirates(*p_args)
+        s_new = one_step_ships(*s_args)
+        police_new = one_step_police(*d_args)
+    else:
+        jobs = [pool.apply_async(one_step_pirates, p_args),
+                pool.apply_async(one_step_ships, s_args),
+                pool.apply_async(one_step_police, d_args)]
+        (p_new, s_new, police_new) = [job.get() for job in jobs]
+
 
-    p_new = pde.one_step_parabolic(p_density, xx, yy, div, -f, dx, dy, dt)
+    return (p_new, s_new, police_new)
 
 
 
-    ################################
-    # Evolution of ship density
-    ################################
 
-    # 2d convolution on a fixed mesh
-    # h * k [n, m] = dx * dy * convolve2d(h, k)
-    cal_I1_x = - dx * dy * scipy.signal.convolve2d(p_density, xx * cut_off_ships(xx, yy), mode='same')
-    cal_I1_y = - dx * dy * scipy.signal.convolve2d(p_density, yy * cut_off_ships(xx, yy), mode='same')
+#
+# terms of the system which vanish identically
+#
+def inactive_terms(pirates):
+    """
+    This function finds the terms of the system which are identically zero
+    for the whole evolution, so that one_step_evolution can skip them:
+    'pirates' and 'ships': the density vanishes at time 0, hence at any time;
+    'pirates_flux': the divergence term of the equation for pirates;
+    'pirates_source': the source term f generated by the police;
+    'ships_interaction': the term cal_I1 generated by the pirates in the
+                         velocity field of the ships;
+    'police_forces': the term F1 of the vector field of the police;
+    'cost_integral': the integral of p_density * s_density in the cost.
+    The kernels whose L1 norm is at most pirates.prune_threshold are
+    considered to be zero.
 
-    cal_I2_x = numpy.zeros_like(xx)
-    cal_I2_y = numpy.zeros_like(xx)
-    for i in xrange(len(police)):
-        cal_I2_x += cut_off_ships(xx - police[i][0], yy - police[i][1]) * (police[i][0] - xx)
-        cal_I2_y += cut_off_ships(xx - police[i][0], yy - police[i][1]) * (police[i][1] - yy)
+    :param pirates: pirate class
 
-    cal_I_x = cal_I1_x + cal_I2_x
-    cal_I_y = cal_I1_y + cal_I2_y
-    vel_x = cal_I_x + nu_x
-    vel_y = cal_I_y + nu_y
+    :output pruned: frozenset of strings. It is empty if
+                    pirates.prune_threshold is None
+    """
+    if pirates.prune_threshold is None:
+        return frozenset()
 
-    # (vel_x, vel_y) should be at most of norm 1!!!
-    vel_pseudo_norm = numpy.maximum(numpy.sqrt(vel_x**2 + vel_y**2), 1.)
-    vel_x = vel_x / vel_pseudo_norm
-    vel_y = vel_y / vel_pseudo_norm
-        
-    s_new = pde.one_step_hyperbolic_godunov(s_density, velocity, vel_x, vel_y, dx, dy, dt)
+    def small(kernel):
+        return pirates.dx * pirates.dy * numpy.sum(numpy.abs(kernel)) <= pirates.prune_threshold
 
-    s_new = numpy.minimum(numpy.maximum(s_new, 0.), 1.)
+    no_pirates = not numpy.any(pirates.initial_density_pirates)
+    no_ships = not numpy.any(pirates.initial_density_ships)
+    no_police = pirates.police_vessels == 0
 
+    pruned = set()
+    if no_pirates:
+        pruned.add('pirates')
+    if no_ships:
+        pruned.add('ships')
+    if no_pirates or no_ships or small(pirates.kernel_mathcal_K):
+        pruned.add('pirates_flux')
+    if no_police or not numpy.any(pirates.a):
+        pruned.add('pirates_source')
+    if no_pirates or no_ships or all(small(k) for k in pirates.ships_kernels):
+        pruned.add('ships_interaction')
+    if no_police or no_pirates or no_ships:
+        pruned.add('police_forces')
+    if no_pirates or no_ships:
+        pruned.add('cost_integral')
 
-    
-    ################################
-    # Evolution of police position
-    ################################
+    return frozenset(pruned)
 
-    police_new = []
-    for i in xrange(len(police)):
-        temp = cut_off_police(police[i][0] - xx, police[i][1] - yy) * p_density * s_density
-        F1_x = dx * dy * numpy.sum(temp * (xx - police[i][0]))
-        F1_y = dx * dy * numpy.sum(temp * (yy - police[i][1]))
 
-        F2_x = police_sum_x - M * police[i][0]
-        F2_y = police_sum_y - M * police[i][1]
 
-        F3_x = controls(time)[i][0]   #control_x
-        F3_y = controls(time)[i][1]   #control_y
 
-        police_new.append(ode.ode(F1_x + F2_x + F3_x, F1_y + F2_y + F3_y, police[i], dt))
+#
+# function for solving the system in a one temporal step with refined patches
+#
+def one_step_evolution_amr(patches, p_density, s_density, police, pirates, time):
+    """
+    This function performs a one time step evolution for the whole system,
+    advancing the densities on the base mesh and on the refined patches.
+    The terms coupling the equations (the convolutions, the velocity fields
+    and the source term f) are computed on the base mesh; the fluxes of the
+    densities are computed on each mesh (see amr.one_step).
 
+    :param patches: list of amr.patch. They are advanced in place
+    :param p_density: numpy 2d array describing the density of pirates at time t
+    :param s_density: numpy 2d array describing the density of ships at time t
+    :param police: list containing the position of police
+    :param pirates: pirate class
+    :param time: float. initial time
 
+    The output is a tuple (p_new, s_new, police_new) as for one_step_evolution.
+    The densities are the composite ones, averaged on the base mesh.
+    """
+    xx = pirates.x_mesh
+    yy = pirates.y_mesh
+    full_box = (0, pirates.n_y, 0, pirates.n_x)
+
+    p_convolution = pirates.dx * pirates.dy * convolution.convolve(s_density, pirates.p_kernel, full_box)
+    div = pirates_divergence(p_density, p_convolution, pirates.dx, pirates.dy, pirates.kappa)
+    (p_vel_x, p_vel_y) = pirates_velocity(p_convolution, pirates.dx, pirates.dy, pirates.kappa,
+                                          p_density.dtype)
+    (trash, f) = pirates_terms(p_density, s_density, police, xx, yy,
+                               pirates.p_kernel, pirates.cut_off_C_pirates,
+                               pirates.dx, pirates.dy, pirates.kappa, pirates.a, full_box,
+                               pruned = ('pirates_flux',))
+    (vel_x, vel_y) = ships_velocity(p_density, police, xx, yy, pirates.cut_off_C_ships,
+                                    pirates.dx, pirates.dy, pirates.ships_direction_mesh[0],
+                                    pirates.ships_direction_mesh[1], full_box, pirates.s_kernels)
+    forces = police_forces(p_density, s_density, police, xx, yy,
+                           pirates.cut_off_C_police, pirates.dx, pirates.dy)
+    police_new = police_evolution(police, forces, pirates.dt, pirates.controls, time)
+
+    (p_new, s_new) = amr.one_step(patches, p_density, s_density, xx, yy, div, p_vel_x, p_vel_y, -f,
+                                  vel_x, vel_y, pirates.ships_speed,
+                                  pirates.dx, pirates.dy, pirates.dt)
 
     return (p_new, s_new, police_new)
 
@@ -150,11 +530,17 @@ def one_step_evolution(p_density, s_density, police, xx, yy,
 # 
 # def evolution(p_density, s_density, police, xx, yy,
 #                        p_kernel, cut_off, dx, dy, dt):
-def evolution(pirates):
+def evolution(pirates, one_step = None, integral = None):
     """
     This function performs the evolution for the whole system
 
     :param pirates: pirate class
+    :param one_step: function (p_density, s_density, police, time) returning
+                     the tuple (p_new, s_new, police_new). If None, the time
+                     step is one_step_evolution (or one_step_evolution_amr)
+    :param integral: function (p_density, s_density) returning
+                     numpy.sum(p_density * s_density) in double precision.
+                     If None, the sum is computed directly
 
     The output is a tuple (p_new, s_new, police_new) of three elements.
     :output p_new: numpy 2d array of the same shape as p_density
@@ -163,6 +549,76 @@ def evolution(pirates):
                    describing the density of ships at time t + dt
     :output police_new: list of final position of police vessels
     """
+    checkpoint = resume_state(pirates) if pirates.resume else None
+
+    # the states are saved by a background thread, which is flushed at the
+    # end and on errors
+    output = writer([pirates], checkpoint)
+    try:
+        time_loop(pirates, one_step, integral, output, checkpoint)
+    except:
+        output.close(check = False)
+        raise
+    output.close()
+
+    # the evolution is finished: its checkpoint is not needed
+    save.remove(os.path.join(pirates.base_directory, 'checkpoint'), '.pkl')
+
+
+def resume_state(pirates):
+    """
+    This function returns the checkpoint of the simulation directory (see
+    save.checkpoint_Save), or None if there is none or if it was saved with
+    other parameters or by another version of the library.
+    """
+    checkpoint = save.checkpoint_Load(pirates.base_directory)
+    if checkpoint is None:
+        logging.info('No checkpoint in ' + pirates.base_directory + ': the evolution starts at time 0')
+        return None
+    if checkpoint['key'] != cache.key(pirates):
+        logging.warning('The checkpoint in ' + pirates.base_directory + ' was saved with other parameters ' +
+                        'or by another version of the library: the evolution starts at time 0')
+        return None
+
+    logging.info('Resuming from the checkpoint at step ' + str(checkpoint['step']) + ', time ' +
+                 str(pirates.time[checkpoint['step']]))
+    return checkpoint
+
+
+def writer(members, checkpoint = None):
+    """
+    This function returns the writer (see save.writer) of the states of the
+    pirate classes members. The states of the members whose output_format
+    is 'series' are saved in a time series (see save.series), with a frame
+    for each printing time, the others with the codec, the encoding and the
+    precision of the first member. If checkpoint is not None, the outputs
+    of the single member are continued from it.
+    """
+    resume = checkpoint['print_number'] - 1 if checkpoint is not None else 0
+    series = {}
+    for p in members:
+        if p.output_format == 'series':
+            series[p.base_directory] = save.series(p.base_directory, numpy.sum(p.printing),
+                                                   numpy.shape(p.initial_density_pirates),
+                                                   p.police_vessels, p.dtype, resume)
+
+    output = save.writer(members[0].save_queue, series, members[0].compression,
+                         members[0].compression_threads, members[0].encoding, members[0].keyframes,
+                         members[0].precision)
+    if checkpoint is not None:
+        output.previous.update(checkpoint['previous'])
+
+    return output
+
+
+def time_loop(pirates, one_step, integral, output, checkpoint = None):
+    """
+    This function contains the time loop of evolution. The states and the
+    cost are saved by output (see save.writer). Every
+    pirates.checkpoint_every time steps, the state of the loop is saved in
+    a checkpoint; if checkpoint is not None, the loop is resumed from it
+    and gives the same results as an uninterrupted one.
+    """
 
     p_density = pirates.initial_density_pirates
     s_density = pirates.initial_density_ships
@@ -170,44 +626,238 @@ def evolution(pirates):
 
     print_number = 1
     steps = len(pirates.time)
-    cost = pirates.dt * numpy.sum(p_density * s_density)
-    for i in xrange(1, steps):
+    cost = pirates.dt * numpy.sum(p_density * s_density, dtype = numpy.float64)
+    patches = []
+    monitor = None
+    first = 1
+    if checkpoint is not None:
+        (p_density, s_density, police) = (checkpoint['p_density'], checkpoint['s_density'], checkpoint['police'])
+        (cost, print_number) = (checkpoint['cost'], checkpoint['print_number'])
+        (patches, monitor) = (checkpoint['patches'], checkpoint['monitor'])
+        first = checkpoint['step'] + 1
+    streams = [(q, q.prepare(pirates, None if checkpoint is None else checkpoint['streams'][q.name]))
+               for q in pirates.streams]
+    key = cache.key(pirates) if pirates.checkpoint_every > 0 else None
+    if one_step is None and pirates.amr_threshold is None:
+        pruned = inactive_terms(pirates)
+        logging.info('Pruned terms: ' + (', '.join(sorted(pruned)) or 'none'))
+    else:
+        pruned = frozenset()
+    if pirates.concurrent:
+        pool = ThreadPool(3)
+    else:
+        pool = None
+    if pirates.steady_tolerance is not None and checkpoint is None:
+        monitor = steady.monitor(pirates.steady_tolerance, pirates.steady_window, pirates.dt)
+    # the threads of the concurrent updates are stopped on errors as well
+    try:
+        for i in xrange(first, steps):
+
+            police_old = police
+            p_old = p_density
+            s_old = s_density
+            cost_old = cost
+
+            # refined patches
+            if one_step is None and pirates.amr_threshold is not None and (i - 1) % pirates.amr_regrid == 0:
+                patches = amr.regrid(patches, p_density, s_density,
+                                     pirates.dx, pirates.dy, pirates.amr_threshold,
+                                     pirates.amr_ratio, pirates.amr_buffer)
+                logging.debug('Step ' + str(i) + ': ' + str(len(patches)) + ' refined patches, boxes ' + str([q.box for q in patches]))
+
+            # evolution from t to t + dt
+            if one_step is not None:
+                (p_density, s_density, police) = one_step(p_density, s_density, police, pirates.time[i])
+            elif pirates.amr_threshold is not None:
+                (p_density, s_density, police) = one_step_evolution_amr(patches, p_density, s_density, police,
+                                                                        pirates, pirates.time[i])
+            else:
+                (p_density, s_density, police) = one_step_evolution(p_density, s_density, police, pirates.x_mesh, pirates.y_mesh,
+                                                                    pirates.p_kernel, pirates.cut_off_C_pirates, pirates.cut_off_C_ships, pirates.cut_off_C_police, pirates.dx, pirates.dy,
+                                                                    pirates.dt, pirates.kappa, pirates.a, pirates.ships_speed, pirates.ships_direction_mesh[0], pirates.ships_direction_mesh[1], pirates.controls, pirates.time[i],
+                                                                    active_region = pirates.active_region, s_kernels = pirates.s_kernels, pool = pool,
+                                                                    pruned = pruned)
+
+            police = pirates.project(police)
+        
+            # cost
+            lenght2 = 0.
+            if integral is not None:
+                cost += pirates.dt * integral(p_density, s_density)
+            elif 'cost_integral' not in pruned:
+                cost += pirates.dt * numpy.sum(p_density * s_density, dtype = numpy.float64)
+            for ii in xrange(0, pirates.police_vessels):
+                lenght2 += (police[ii][0] - police_old[ii][0])**2 + (police[ii][1] - police_old[ii][1])**2
+            cost += numpy.sqrt(lenght2)
+        
+            # progresses
+            sys.stdout.write('\r')
+            # the exact output you're looking for:
+            percentage = i * 100 /steps
+            sys.stdout.write("[%-100s] %d%%" % ('='*percentage, percentage))
+            sys.stdout.flush()
+
+            if i%100 == 0:
+                logging.info('Completed step ' + str(i) + ' over ' + str(steps) + ' steps at time ' + str(datetime.now()))
+        
+            # steady state
+            stop = (monitor is not None and i < steps - 1 and
+                    monitor.update(p_old, p_density, s_old, s_density, police_old, police))
+
+            # printing
+            if pirates.printing[i] or stop:
+            #if True:
+                name = 'saving_' + str(print_number).zfill(4)
+                output.solution_Save(pirates.base_directory, name, pirates.time[i], p_density, s_density, police, cost)
+                print_number += 1
+
+            # output streams
+            for (q, directory) in streams:
+                if i % q.every == 0 or i == steps - 1 or stop:
+                    (x, y, p_saved, s_saved) = q.extract(pirates, p_density, s_density, police)
+                    output.solution_Save(directory, q.next_name(), pirates.time[i], p_saved, s_saved, police, cost,
+                                         mesh = (x, y))
+
+            # checkpoint
+            if pirates.checkpoint_every > 0 and i % pirates.checkpoint_every == 0 and i < steps - 1 and not stop:
+                output.checkpoint_Save(pirates.base_directory,
+                                       {'key': key, 'step': i, 'p_density': p_density, 's_density': s_density,
+                                        'police': police, 'cost': cost, 'print_number': print_number,
+                                        'patches': patches, 'monitor': monitor,
+                                        'streams': dict((q.name, q.count) for (q, directory) in streams)})
+
+            if stop:
+                logging.info('Steady state at time ' + str(pirates.time[i]) + ' (step ' + str(i) +
+                             ' over ' + str(steps) + '): ' + monitor.criterion())
+                logging.info('Cost at time ' + str(pirates.time[i]) + ' = ' + str(cost))
+                # the running cost of the last step is extrapolated up to tMax
+                cost += (steps - 1 - i) * (cost - cost_old)
+                break
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # saving the cost
+    output.cost_Save(pirates.base_directory, 'cost', cost)
+
+    logging.info('Final cost = ' + str(cost))
+
+
+
+#
+# function for computing the cost only
+#
+def evaluate_cost(pirates, controls = None, components = False):
+    """
+    This function performs the evolution for the whole system as evolution,
+    but it only computes the cost: nothing is saved, printed or logged, and
+    only the state at the current time is kept. The refined patches and the
+    steady state detection are not used.
+
+    :param pirates: pirate class
+    :param controls: function giving the controls for police vessels, or
+                     numpy array of shape (len(pirates.time) - 1, M, 2) whose
+                     entry k gives the controls used in the time step from
+                     pirates.time[k] to pirates.time[k + 1]. If None, the
+                     controls are pirates.controls
+    :param components: bool. If True, the two terms of the cost are also
+                       returned
+
+    :output cost: float. If components is True, the output is the tuple
+                  (cost, integral, length), where integral is the time
+                  integral of p_density * s_density and length is the length
+                  of the paths of the police vessels.
+    """
+    if controls is None:
+        controls = pirates.controls
+    elif isinstance(controls, numpy.ndarray):
+        controls = control_table(controls, pirates.time)
+
+    pruned = inactive_terms(pirates)
+    pool = ThreadPool(3) if pirates.concurrent else None
+    try:
+        (p_density, s_density, police, integral, length) = advance(pirates, initial_state(pirates), controls,
+                                                                   0, len(pirates.time) - 1, pruned, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if components:
+        return (integral + length, integral, length)
+
+    return integral + length
+
 
+#
+# state of the system for the cost only evolution
+#
+def initial_state(pirates):
+    """
+    This function returns the state at time 0 used by advance: the tuple
+    (p_density, s_density, police, integral, length), where integral and
+    length are the two terms of the cost accumulated so far.
+    """
+    p_density = pirates.initial_density_pirates
+    s_density = pirates.initial_density_ships
+    integral = pirates.dt * numpy.sum(p_density * s_density, dtype = numpy.float64)
+
+    return (p_density, s_density, pirates.police_initial_positions, integral, 0.)
+
+
+def advance(pirates, state, controls, first, last, pruned = (), pool = None):
+    """
+    This function advances the state (see initial_state) at time
+    pirates.time[first] up to time pirates.time[last], as evaluate_cost.
+    The arrays of state are not modified.
+
+    :param pirates: pirate class
+    :param state: tuple (p_density, s_density, police, integral, length)
+    :param controls: function giving the controls for police vessels
+    :param first: int. Index of the initial time
+    :param last: int. Index of the final time
+    :param pruned: terms given by inactive_terms, which are skipped
+    :param pool: multiprocessing.pool.ThreadPool or None (see
+                 one_step_evolution)
+
+    :output state: the state at time pirates.time[last]
+    """
+    (p_density, s_density, police, integral, length) = state
+    for i in xrange(first + 1, last + 1):
         police_old = police
-        
-        # evolution from t to t + dt
         (p_density, s_density, police) = one_step_evolution(p_density, s_density, police, pirates.x_mesh, pirates.y_mesh,
-                                                            pirates.kernel_mathcal_K, pirates.cut_off_C_pirates, pirates.cut_off_C_ships, pirates.cut_off_C_police, pirates.dx, pirates.dy,
-                                                            pirates.dt, pirates.kappa, pirates.a, pirates.ships_speed, pirates.ships_direction_mesh[0], pirates.ships_direction_mesh[1], pirates.controls, pirates.time[i])
-
+                                                            pirates.p_kernel, pirates.cut_off_C_pirates, pirates.cut_off_C_ships, pirates.cut_off_C_police, pirates.dx, pirates.dy,
+                                                            pirates.dt, pirates.kappa, pirates.a, pirates.ships_speed, pirates.ships_direction_mesh[0], pirates.ships_direction_mesh[1], controls, pirates.time[i],
+                                                            active_region = pirates.active_region, s_kernels = pirates.s_kernels, pool = pool,
+                                                            pruned = pruned)
         police = pirates.project(police)
-        
-        # cost
+
+        if 'cost_integral' not in pruned:
+            integral += pirates.dt * numpy.sum(p_density * s_density, dtype = numpy.float64)
         lenght2 = 0.
-        cost += pirates.dt * numpy.sum(p_density * s_density)
         for ii in xrange(0, pirates.police_vessels):
             lenght2 += (police[ii][0] - police_old[ii][0])**2 + (police[ii][1] - police_old[ii][1])**2
-        cost += numpy.sqrt(lenght2)
-        
-        # progresses
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        percentage = i * 100 /steps
-        sys.stdout.write("[%-100s] %d%%" % ('='*percentage, percentage))
-        sys.stdout.flush()
-
-        if i%100 == 0:
-            logging.info('Completed step ' + str(i) + ' over ' + str(steps) + ' steps at time ' + str(datetime.now()))
-        
-        # printing
-        if pirates.printing[i]:
-        #if True:
-            name = 'saving_' + str(print_number).zfill(4)
-            save.solution_Save(pirates.base_directory, name, pirates.time[i], p_density, s_density, police, cost)
-            print_number += 1
+        length += numpy.sqrt(lenght2)
 
-        
-    # saving the cost
-    save.cost_Save(pirates.base_directory, 'cost', cost)
+    return (p_density, s_density, police, integral, length)
 
-    logging.info('Final cost = ' + str(cost))
+
+#
+# controls given by a table
+#
+def control_table(table, time):
+    """
+    This function returns the function of time giving the controls
+    table[k] in the time step ending at time[k + 1].
+
+    :param table: numpy array of shape (len(time) - 1, M, 2)
+    :param time: numpy vector of the times of the evolution
+    """
+    assert (numpy.shape(table)[0] == len(time) - 1)
+
+    def controls(t):
+        return table[numpy.searchsorted(time, t) - 1]
+
+    return controls
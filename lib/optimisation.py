@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+### optimisation.py
+### optimisation of the controls of the police vessels
+###
+### The controls are linear combinations of a few functions of time
+### (piecewise constant functions or Fourier modes). The cost is minimized
+### by L-BFGS-B with gradients given by centered differences; the costs of
+### the perturbed controls are computed concurrently by a pool of worker
+### processes, each one with its own pirate class built once. Optionally,
+### each worker evaluates its share of the perturbed controls as a
+### scenarios.scenario_tree, so that their common initial histories are
+### computed once.
+
+import os
+import numpy
+import logging
+import multiprocessing
+import scipy.optimize
+import pirates
+import evolution
+import scenarios
+
+# pirate class and scenario tree of the worker process (see init_worker)
+WORKER_PIRATES = None
+WORKER_TREE = None
+
+
+#
+# class containing the parametrization of the controls
+#
+class linear_controls(object):
+
+    def __init__(self, basis, M):
+        """
+        Initialization function for the class.
+        The control of the vessel i in the time step k is
+            sum_j basis[k, j] * theta[j, i]
+
+        :param basis: numpy 2d array of shape (steps, J). Values of the J
+                      functions of time in each time step
+        :param M: int. Number of police vessels
+        """
+        self.basis = basis
+        self.shape = (numpy.shape(basis)[1], M, 2)
+        self.size = int(numpy.prod(self.shape))
+
+
+    #
+    # Function for the table of the controls
+    #
+    def table(self, theta):
+        """
+        This function returns the table of the controls (see
+        evolution.evaluate_cost) given by the coefficients theta.
+        """
+        return numpy.tensordot(self.basis, numpy.reshape(theta, self.shape), axes = 1)
+
+
+    #
+    # Function for the coefficients closest to a table
+    #
+    def fit(self, table):
+        """
+        This function returns the coefficients theta, as a flat vector, whose
+        table is the closest to table in the least squares sense.
+        """
+        steps = numpy.shape(self.basis)[0]
+        theta = numpy.linalg.lstsq(self.basis, numpy.reshape(table, (steps, -1)), rcond = None)[0]
+        return theta.ravel()
+
+
+def piecewise_constant(time, pieces):
+    """
+    This function returns the basis of the controls constant on pieces
+    intervals of equal length.
+
+    :param time: numpy vector of the times of the evolution
+    :param pieces: int. Number of intervals
+    """
+    j = numpy.minimum((pieces * time[1:] / time[-1]).astype(int), pieces - 1)
+    basis = numpy.zeros((len(time) - 1, pieces))
+    basis[numpy.arange(len(time) - 1), j] = 1.
+
+    return basis
+
+
+def fourier(time, modes):
+    """
+    This function returns the basis of the trigonometric polynomials of
+    degree modes on the interval [0, tMax].
+
+    :param time: numpy vector of the times of the evolution
+    :param modes: int. Degree of the polynomials
+    """
+    t = 2. * numpy.pi * time[1:] / time[-1]
+    columns = [numpy.ones_like(t)]
+    for m in xrange(1, modes + 1):
+        columns += [numpy.cos(m * t), numpy.sin(m * t)]
+
+    return numpy.array(columns).T
+
+
+#
+# functions executed by the worker processes
+#
+def init_worker(dirName, options):
+    global WORKER_PIRATES, WORKER_TREE
+    WORKER_PIRATES = pirates.load(dirName, **options)
+    WORKER_TREE = scenarios.scenario_tree(WORKER_PIRATES)
+
+
+def worker_cost(table):
+    return evolution.evaluate_cost(WORKER_PIRATES, table)
+
+
+def worker_tree_costs(tables):
+    return (WORKER_TREE.costs(tables), WORKER_TREE.report)
+
+
+#
+# class containing the optimisation
+#
+class optimiser(object):
+
+    def __init__(self, dirName, basis = 'piecewise', size = 10, processes = 1,
+                 step = 1e-3, options = None, tree = False):
+        """
+        Initialization function for the class. It starts the workers.
+
+        :param dirName: string. The simulation directory
+        :param basis: string. 'piecewise' for piecewise constant controls,
+                      'fourier' for trigonometric polynomials
+        :param size: int. Number of intervals or degree of the polynomials
+        :param processes: int. Number of worker processes
+        :param step: float. Step of the centered differences
+        :param options: dict or None. Keyword arguments of pirates.load
+        :param tree: bool. If True, the costs are computed by scenario trees,
+                     one for each worker
+        """
+        self.dirName = dirName
+        self.step = step
+        self.processes = processes
+        self.tree = tree
+        if options is None:
+            options = {}
+        self.simul_pirates = pirates.load(dirName, **dict(options))
+        time = self.simul_pirates.time
+        M = self.simul_pirates.police_vessels
+
+        if basis == 'piecewise':
+            self.controls = linear_controls(piecewise_constant(time, size), M)
+        elif basis == 'fourier':
+            self.controls = linear_controls(fourier(time, size), M)
+        else:
+            raise ValueError('Unknown basis of the controls: ' + str(basis))
+
+        # the initial controls are the ones of parameters.py
+        table = numpy.array([self.simul_pirates.controls(t) for t in time[1:]], dtype = float)
+        self.theta_0 = self.controls.fit(numpy.reshape(table, (len(time) - 1, M, 2)))
+
+        self.pool = multiprocessing.Pool(processes, init_worker, (dirName, options))
+        self.history = []
+        self.best = (numpy.inf, None)
+        self.evaluations = 0
+
+
+    #
+    # Function for the cost and its gradient
+    #
+    def cost_and_gradient(self, theta):
+        """
+        This function returns the cost of the controls theta and its gradient
+        by centered differences. The 2 * size + 1 costs are computed
+        concurrently.
+        """
+        theta = numpy.asarray(theta, dtype = float)
+        candidates = [theta]
+        for j in xrange(len(theta)):
+            e = numpy.zeros_like(theta)
+            e[j] = self.step
+            candidates += [theta + e, theta - e]
+
+        tables = [self.controls.table(c) for c in candidates]
+        if self.tree:
+            # consecutive candidates perturb neighbouring coefficients, hence
+            # each worker gets a contiguous share of them
+            shares = numpy.array_split(numpy.arange(len(tables)), min(self.processes, len(tables)))
+            results = self.pool.map(worker_tree_costs, [[tables[k] for k in share] for share in shares])
+            costs = sum((c for (c, report) in results), [])
+            computed = sum(report['computed'] for (c, report) in results)
+            requested = sum(report['requested'] for (c, report) in results)
+            logging.info('Scenario trees: ' + str(computed) + ' time steps computed instead of ' +
+                         str(requested) + ' (saved ' + '%.1f' % (100. * (1. - float(computed) / requested)) + '%)')
+        else:
+            costs = self.pool.map(worker_cost, tables)
+        self.evaluations += len(candidates)
+
+        cost = costs[0]
+        gradient = (numpy.array(costs[1::2]) - numpy.array(costs[2::2])) / (2. * self.step)
+        self.history.append((self.evaluations, cost, numpy.linalg.norm(gradient)))
+        logging.info('Evaluation ' + str(len(self.history)) + ': cost = ' + str(cost) +
+                     ', norm of the gradient = ' + str(numpy.linalg.norm(gradient)))
+        if cost < self.best[0]:
+            self.best = (cost, theta.copy())
+
+        return (cost, gradient)
+
+
+    #
+    # Function for the optimisation
+    #
+    def run(self, iterations = 50):
+        """
+        This function minimizes the cost and saves the convergence history
+        (optimisation_history.txt) and the best controls
+        (optimal_controls.npz) in the simulation directory.
+
+        :param iterations: int. Maximum number of iterations of L-BFGS-B
+
+        :output (cost, table): the best cost and its table of controls
+        """
+        try:
+            result = scipy.optimize.minimize(self.cost_and_gradient, self.theta_0, jac = True,
+                                             method = 'L-BFGS-B',
+                                             options = {'maxiter': iterations})
+            logging.info('L-BFGS-B: ' + str(result.message))
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+        (cost, theta) = self.best
+        table = self.controls.table(theta)
+
+        numpy.savetxt(os.path.join(self.dirName, 'optimisation_history.txt'), numpy.array(self.history),
+                      header = 'evaluations cost gradient_norm')
+        numpy.savez(os.path.join(self.dirName, 'optimal_controls'), theta = theta, table = table,
+                    basis = self.controls.basis, time = self.simul_pirates.time, c = cost)
+        logging.info('Best cost = ' + str(cost) + ' after ' + str(self.evaluations) + ' evaluations')
+
+        return (cost, table)
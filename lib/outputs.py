@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+### outputs.py
+### additional output streams of a simulation
+###
+### A stream saves the densities every few time steps in its own
+### subdirectory of the simulation directory (as saving_*.npz, with the
+### coordinates x and y of its mesh): on the whole mesh or on a part of it
+### (a fixed rectangle, or a window following the police vessels), possibly
+### averaged on blocks of cells. The averages conserve the mass: the mean
+### of each block, times the number of its cells, is the sum of the block.
+
+import os
+import glob
+import numpy
+
+
+#
+# class describing an output stream
+#
+class stream(object):
+
+    def __init__(self, name, every = 1, decimate = 1, box = None, follow = None):
+        """
+        Initialization function for the class.
+
+        :param name: string. Name of the subdirectory
+        :param every: int. Number of time steps between two saved states
+        :param decimate: int. Side of the blocks of cells averaged
+        :param box: tuple (x_1, x_2, y_1, y_2) or None. Rectangle saved
+        :param follow: float or None. If not None, half side of the square
+                       window saved, centered at the mean position of the
+                       police vessels (and kept in the domain)
+        """
+        if every < 1 or decimate < 1:
+            raise ValueError('The stream ' + name + ' needs every >= 1 and decimate >= 1')
+        if box is not None and follow is not None:
+            raise ValueError('The stream ' + name + ' cannot have both a box and a window')
+
+        self.name = name
+        self.every = int(every)
+        self.decimate = int(decimate)
+        self.box = box
+        self.follow = follow
+        self.count = 0
+
+
+    def __repr__(self):
+        return ('stream(' + repr(self.name) + ', every = ' + str(self.every) + ', decimate = ' +
+                str(self.decimate) + ', box = ' + repr(self.box) + ', follow = ' + repr(self.follow) + ')')
+
+
+    #
+    # Function preparing the subdirectory
+    #
+    def prepare(self, pirates, count = None):
+        """
+        This function creates the subdirectory of the stream in the
+        simulation directory of the pirate class and removes the states of
+        the previous runs.
+
+        :param count: int or None. If not None, the evolution is resumed:
+                      the first count states are kept and the following
+                      ones are saved after them
+
+        :output directory: string. Path of the subdirectory
+        """
+        directory = os.path.join(pirates.base_directory, self.name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if count is None:
+            for f in glob.glob(os.path.join(directory, 'saving_*.npz')):
+                os.remove(f)
+        self.count = count or 0
+
+        return directory
+
+
+    #
+    # Function for the part of the mesh
+    #
+    def window(self, pirates, police):
+        """
+        This function returns the slices (rows, columns) of the mesh saved by
+        the stream when the police vessels are at police. It raises a
+        ValueError if the box contains no point of the mesh.
+        """
+        (x, y) = (pirates.x, pirates.y)
+        if self.box is not None:
+            (x_1, x_2, y_1, y_2) = self.box
+            rows = slice(numpy.searchsorted(y, y_1), numpy.searchsorted(y, y_2, side = 'right'))
+            columns = slice(numpy.searchsorted(x, x_1), numpy.searchsorted(x, x_2, side = 'right'))
+            if rows.start >= rows.stop or columns.start >= columns.stop:
+                raise ValueError('The box of the stream ' + self.name + ' contains no point of the mesh')
+            return (rows, columns)
+
+        if self.follow is not None:
+            if pirates.police_vessels > 0:
+                (c_x, c_y) = numpy.mean(numpy.reshape(police, (-1, 2)), axis = 0)
+            else:
+                (c_x, c_y) = ((pirates.x_1 + pirates.x_2) / 2., (pirates.y_1 + pirates.y_2) / 2.)
+
+            # the window has the same number of points at all times
+            def side(c, start, h, n):
+                half = int(round(self.follow / h))
+                size = min(2 * half + 1, n)
+                first = int(round((c - start) / h)) - half
+                first = min(max(first, 0), n - size)
+                return slice(first, first + size)
+
+            return (side(c_y, pirates.y_1, pirates.dy, len(y)), side(c_x, pirates.x_1, pirates.dx, len(x)))
+
+        return (slice(None), slice(None))
+
+
+    #
+    # Function extracting the saved state
+    #
+    def extract(self, pirates, p_density, s_density, police):
+        """
+        This function returns the tuple (x, y, p_density, s_density) of the
+        coordinates and of the densities saved by the stream.
+        """
+        (rows, columns) = self.window(pirates, police)
+        x = pirates.x[columns]
+        y = pirates.y[rows]
+        p = p_density[rows, columns]
+        s = s_density[rows, columns]
+        if self.decimate > 1:
+            (x, y, p, s) = (average(x, self.decimate), average(y, self.decimate),
+                            average(p, self.decimate), average(s, self.decimate))
+
+        return (x, y, p, s)
+
+
+    #
+    # Function for the name of the next file
+    #
+    def next_name(self):
+        self.count += 1
+        return 'saving_' + str(self.count).zfill(4)
+
+
+#
+# function averaging on blocks
+#
+def average(a, factor):
+    """
+    This function returns the means of a on the blocks of factor cells (of
+    factor x factor cells for 2d arrays). The last blocks contain the
+    remaining cells.
+    """
+    a = numpy.asarray(a)
+    for axis in xrange(a.ndim):
+        n = a.shape[axis]
+        starts = numpy.arange(0, n, factor)
+        sizes = numpy.diff(numpy.append(starts, n))
+        shape = [1] * a.ndim
+        shape[axis] = len(starts)
+        a = numpy.add.reduceat(a, starts, axis = axis) / sizes.reshape(shape).astype(a.dtype)
+
+    return a
+
+
+#
+# function reading a stream
+#
+def parse(text):
+    """
+    This function returns the stream described by text, as
+    name:every=10,decimate=4 or name:every=2,follow=0.5 or
+    name:box=x_1/x_2/y_1/y_2.
+    """
+    (name, _, options) = text.partition(':')
+    if not name:
+        raise ValueError('Missing name in the stream ' + repr(text))
+
+    arguments = {}
+    for option in filter(None, options.split(',')):
+        (key, _, value) = option.partition('=')
+        if key in ('every', 'decimate'):
+            arguments[key] = int(value)
+        elif key == 'follow':
+            arguments[key] = float(value)
+        elif key == 'box':
+            arguments[key] = tuple(float(v) for v in value.split('/'))
+            if len(arguments[key]) != 4:
+                raise ValueError('The box of the stream ' + repr(text) + ' needs x_1/x_2/y_1/y_2')
+        else:
+            raise ValueError('Unknown option ' + repr(key) + ' in the stream ' + repr(text))
+
+    return stream(name, **arguments)
@@ -1,6 +1,74 @@
 #!/usr/bin/env python
 
+import os
 import numpy
+from multiprocessing.pool import ThreadPool
+
+# pool of threads computing the stencils on strips of rows (see set_threads)
+POOL = None
+POOL_PID = None
+THREADS = 1
+
+
+#
+# function for setting the number of threads
+#
+def set_threads(threads):
+    """
+    This function sets the number of threads computing the stencils.
+    The stencils are split in strips of rows, computed concurrently (NumPy
+    releases the GIL in the loops on large arrays). The results are the same
+    as with a single thread. A process forked after this call computes the
+    stencils in a single thread.
+
+    :param threads: int. Number of threads
+    """
+    global POOL, POOL_PID, THREADS
+
+    if POOL is not None and POOL_PID == os.getpid():
+        POOL.close()
+    POOL = None
+    THREADS = max(int(threads), 1)
+    if THREADS > 1:
+        POOL = ThreadPool(THREADS)
+        POOL_PID = os.getpid()
+
+
+#
+# function for computing a stencil on strips of rows
+#
+def strip_map(function, arguments, halo):
+    """
+    This function computes function(*arguments) on strips of rows, one for
+    each thread, and gathers the results. The rows are the second to last
+    axis, so that the arrays may have leading axes (a stack of states, see
+    ensemble.py).
+
+    :param function: function returning a numpy array with the rows of its
+                     first argument. The row i of the output should only
+                     depend on the rows i - halo, ..., i + halo of the input
+    :param arguments: list of arguments of function. The numpy arrays with
+                      the number of rows of the first argument are split in
+                      strips, the others are passed unchanged
+    :param halo: int. Number of rows shared by neighbouring strips
+
+    :output u: numpy array, the same as function(*arguments)
+    """
+    n = numpy.shape(arguments[0])[-2]
+    if POOL is None or POOL_PID != os.getpid() or n < 2 * THREADS * (halo + 1):
+        return function(*arguments)
+
+    bounds = numpy.linspace(0, n, THREADS + 1).astype(int)
+
+    def strip(k):
+        (r_0, r_1) = (bounds[k], bounds[k + 1])
+        (e_0, e_1) = (max(r_0 - halo, 0), min(r_1 + halo, n))
+        args = [a[..., e_0:e_1, :] if isinstance(a, numpy.ndarray) and a.ndim >= 2 and a.shape[-2] == n else a
+                for a in arguments]
+        return function(*args)[..., r_0 - e_0:r_1 - e_0, :]
+
+    return numpy.concatenate(POOL.map(strip, xrange(THREADS)), axis = -2)
+
 
 #
 # function for solving the 2d parabolic equation
@@ -30,14 +98,26 @@ def one_step_parabolic(u, x, y, f1, f2, dx, dy, dt):
     assert (numpy.shape(u) == numpy.shape(y))
     c = dt / (min(dx**2, dy**2))
     assert(c < 0.5)
-    
+
+    return strip_map(parabolic_stencil, [u, f1, f2, dx, dy, dt], 1)
+
+
+#
+# explicit stencil for the parabolic equation
+#
+def parabolic_stencil(u, f1, f2, dx, dy, dt):
+    """
+    This function computes the stencil of one_step_parabolic.
+    The arrays may have leading axes (a stack of states, see ensemble.py):
+    the stencil acts on the last two.
+    """
     u = augment(u)
 
     # Calculate the numerical Laplacian
-    u_xx = (1. / (dx**2)) * (u[1:-1, 2:] + u[1:-1, :-2] - 2 * u[1:-1, 1:-1])
-    u_yy = (1. / (dy**2)) * (u[2:, 1:-1] + u[:-2, 1:-1] - 2 * u[1:-1, 1:-1])
+    u_xx = (1. / (dx**2)) * (u[..., 1:-1, 2:] + u[..., 1:-1, :-2] - 2 * u[..., 1:-1, 1:-1])
+    u_yy = (1. / (dy**2)) * (u[..., 2:, 1:-1] + u[..., :-2, 1:-1] - 2 * u[..., 1:-1, 1:-1])
 
-    u_new = u[1:-1, 1:-1] + dt * (u_xx + u_yy + f1 + f2 * u[1:-1, 1:-1])
+    u_new = u[..., 1:-1, 1:-1] + dt * (u_xx + u_yy + f1 + f2 * u[..., 1:-1, 1:-1])
 
     return u_new
 
@@ -93,24 +173,41 @@ def one_step_hyperbolic(A, v, w_x, w_y, dx, dy, dt):
     return A
 
 
-def augment(u):
+#
+# function for finding the active region of a density
+#
+def active_box(u, halo):
     """
-    This function takes a 2D numpy array u of shape (u1, u2)
-    and produces a 2D numpy array of shape (u1 + 2, u2 + 2)
-    for taking care of zero Newmann boundary conditions
+    This function returns the smallest box containing the non-zero entries
+    of u, enlarged by halo cells in every direction and clipped to the
+    shape of u. It returns None if u is identically zero.
+
+    :param u: numpy 2d array
+    :param halo: int. Number of cells added around the support of u
+
+    :output box: tuple (i_0, i_1, j_0, j_1) of ints such that
+                 u[i_0:i_1, j_0:j_1] contains the support of u
     """
-    (u1, u2) = numpy.shape(u)
-    v = u[1,:].reshape((1, u2))
-    u = numpy.concatenate((v,u), axis = 0)
+    rows = numpy.flatnonzero(numpy.any(u != 0, axis = 1))
+    if len(rows) == 0:
+        return None
+    cols = numpy.flatnonzero(numpy.any(u != 0, axis = 0))
 
-    v = u[-2,:].reshape((1, u2))
-    u = numpy.concatenate((u,v), axis = 0)
+    (u1, u2) = numpy.shape(u)
+    return (max(rows[0] - halo, 0), min(rows[-1] + 1 + halo, u1),
+            max(cols[0] - halo, 0), min(cols[-1] + 1 + halo, u2))
 
-    v = u[:,1].reshape((u1 + 2, 1))
-    u = numpy.concatenate((v,u), axis = 1)
 
-    v = u[:,-2].reshape((u1 + 2, 1))
-    u = numpy.concatenate((u,v), axis = 1)
+def augment(u):
+    """
+    This function takes a 2D numpy array u of shape (u1, u2)
+    and produces a 2D numpy array of shape (u1 + 2, u2 + 2)
+    for taking care of zero Newmann boundary conditions.
+    A stack of arrays of shape (..., u1, u2) is augmented along the last two
+    axes.
+    """
+    u = numpy.concatenate((u[..., 1:2, :], u, u[..., -2:-1, :]), axis = -2)
+    u = numpy.concatenate((u[..., 1:2], u, u[..., -2:-1]), axis = -1)
 
     return u
 
@@ -135,19 +232,19 @@ def Godunov_Flux_x(u, v, pm):
 
     
     f1 = u * v(u)
-    mask_sh_pos = (u[:, :-1] <= u[:, 1:]) & (f1[:, :-1] <= f1[:, 1:])
-    mask_sh_neg = (u[:, :-1] <= u[:, 1:]) & (f1[:, :-1] > f1[:, 1:])
+    mask_sh_pos = (u[..., :-1] <= u[..., 1:]) & (f1[..., :-1] <= f1[..., 1:])
+    mask_sh_neg = (u[..., :-1] <= u[..., 1:]) & (f1[..., :-1] > f1[..., 1:])
 
-    mask_rar_neg = (u[:, :-1] > u[:, 1:]) & (u[:, 1:] >= pm)
-    mask_rar_pos = (u[:, :-1] > u[:, 1:]) & (u[:, :-1] <= pm)
+    mask_rar_neg = (u[..., :-1] > u[..., 1:]) & (u[..., 1:] >= pm)
+    mask_rar_pos = (u[..., :-1] > u[..., 1:]) & (u[..., :-1] <= pm)
 
     mask_pos = mask_sh_pos | mask_rar_pos
     mask_neg = mask_sh_neg | mask_rar_neg
     
     mask_theta = numpy.logical_not(mask_pos | mask_neg)
 
-    return mask_theta * pm * v(pm) + mask_pos * f1[:, :-1] + \
-           mask_neg * f1[:, 1:]
+    return mask_theta * u.dtype.type(pm * v(pm)) + mask_pos * f1[..., :-1] + \
+           mask_neg * f1[..., 1:]
 
 #
 # Godunov_Flux_y function
@@ -169,25 +266,25 @@ def Godunov_Flux_y(u, v, pm):
 
     
     f1 = u * v(u)
-    mask_sh_pos = (u[ :-1, :] <= u[1:, :]) & (f1[ :-1, :] <= f1[1:, :])
-    mask_sh_neg = (u[ :-1, :] <= u[1:, :]) & (f1[ :-1, :] > f1[1:, :])
+    mask_sh_pos = (u[..., :-1, :] <= u[..., 1:, :]) & (f1[..., :-1, :] <= f1[..., 1:, :])
+    mask_sh_neg = (u[..., :-1, :] <= u[..., 1:, :]) & (f1[..., :-1, :] > f1[..., 1:, :])
 
-    mask_rar_neg = (u[ :-1, :] > u[1:, :]) & (u[1:, :] >= pm)
-    mask_rar_pos = (u[ :-1, :] > u[1:, :]) & (u[ :-1, :] <= pm)
+    mask_rar_neg = (u[..., :-1, :] > u[..., 1:, :]) & (u[..., 1:, :] >= pm)
+    mask_rar_pos = (u[..., :-1, :] > u[..., 1:, :]) & (u[..., :-1, :] <= pm)
 
     mask_pos = mask_sh_pos | mask_rar_pos
     mask_neg = mask_sh_neg | mask_rar_neg
     
     mask_theta = numpy.logical_not(mask_pos | mask_neg)
 
-    return mask_theta * pm * v(pm) + mask_pos * f1[ :-1, :] + \
-           mask_neg * f1[1:, :]
+    return mask_theta * u.dtype.type(pm * v(pm)) + mask_pos * f1[..., :-1, :] + \
+           mask_neg * f1[..., 1:, :]
 
 #
 # function for solving the 2d hyperbolic equation
 # \pt A + div(A v(A) w(t,x)) = 0
 # with an explicit Godunov-type method
-def one_step_hyperbolic_godunov(A, v, w_x, w_y, dx, dy, dt):
+def one_step_hyperbolic_godunov(A, v, w_x, w_y, dx, dy, dt, fluxes = False):
     """
     This function performs a one time step for the hyperbolic equation
     \partial_t A + div(A v(A) w(x, y)) = 0
@@ -205,31 +302,55 @@ def one_step_hyperbolic_godunov(A, v, w_x, w_y, dx, dy, dt):
     :param dx: float. The size of the x-mesh
     :param dy: float. The size of the y-mesh
     :param dt: float. The time step. It should satisfy a stability condition
+    :param fluxes: bool. If True, the numerical fluxes are returned as well
 
     :output A_new: numpy 2d array of the same shape as A describing the state at
                    time t + dt
+    :output (A_new, flux_x, flux_y): if fluxes is True. flux_x[:, k] is the
+                   flux through the face between the columns k - 1 and k of A
+                   during the x-split, flux_y[k, :] is the flux through the
+                   face between the rows k - 1 and k during the y-split.
 
     """
 
+    if fluxes:
+        return godunov_stencil(A, v, w_x, w_y, dx, dy, dt, True)
+
+    return strip_map(godunov_stencil, [A, v, w_x, w_y, dx, dy, dt], 1)
+
+
+#
+# Godunov-type stencil for the hyperbolic equation
+#
+def godunov_stencil(A, v, w_x, w_y, dx, dy, dt, fluxes = False):
+    """
+    This function computes the stencil of one_step_hyperbolic_godunov.
+    The arrays may have leading axes (a stack of states, see ensemble.py):
+    the stencil acts on the last two.
+    """
     # x-split
     w_x = augment(w_x)
     A = augment(A)
-    w_x = 0.5 * (w_x[:, 1:] + w_x[:, :-1])
+    w_x = 0.5 * (w_x[..., 1:] + w_x[..., :-1])
 
     gf = Godunov_Flux_x(A, v, 0.5) * w_x
 
-    A = A[1:-1, 1:-1] + (dt / dx) * (gf[1:-1, :-1] - gf[1:-1, 1:])
+    A = A[..., 1:-1, 1:-1] + (dt / dx) * (gf[..., 1:-1, :-1] - gf[..., 1:-1, 1:])
+    flux_x = gf[..., 1:-1, :]
 
     
     # y-split
 
     w_y = augment(w_y)
     A = augment(A)
-    w_y = 0.5 * (w_y[1:, :] + w_y[:-1, :])
+    w_y = 0.5 * (w_y[..., 1:, :] + w_y[..., :-1, :])
 
     gf = Godunov_Flux_y(A, v, 0.5) * w_y
     
     
-    A = A[1:-1, 1:-1] + (dt / dy) * (gf[:-1, 1:-1] - gf[1:, 1:-1])
+    A = A[..., 1:-1, 1:-1] + (dt / dy) * (gf[..., :-1, 1:-1] - gf[..., 1:, 1:-1])
+
+    if fluxes:
+        return (A, flux_x, gf[..., 1:-1])
 
     return A
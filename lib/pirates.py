@@ -3,14 +3,26 @@
 ### pirates.py
 ### class containing all the relevant data
 
+import os
 import numpy as np
 import logging
+import convolution
+import artefacts
+import outputs
 
 class pirates(object):
 
     def __init__(self, x_1, x_2, y_1, y_2, n_x, n_y, M, tMax, d_o,
                  InitialDatum_rho, InitialDatum_A, speed_ships, nu, DirName,
-                 mathcal_K, cut_off_C_pirates, kappa, a, cut_off_C_ships, cut_off_C_police, controls, pictures = 90):
+                 mathcal_K, cut_off_C_pirates, kappa, a, cut_off_C_ships, cut_off_C_police, controls, pictures = 90,
+                 active_region = True, amr_threshold = None, amr_ratio = 2,
+                 amr_regrid = 10, amr_buffer = 2, concurrent = False,
+                 dtype = np.float64, kernel_tolerance = None, fft_memory = None,
+                 prune_threshold = 1e-12, steady_tolerance = None, steady_window = 50,
+                 artefact_cache = None, save_queue = 4, output_format = 'npz',
+                 compression = 'deflate', compression_threads = 1, encoding = 'dense',
+                 keyframes = 0, precision = 'full', streams = (), checkpoint_every = 0,
+                 resume = False):
         """
         Initializatium function for the class.
         :param x_1: float. Lower bound for x-coordinate of the domain
@@ -45,6 +57,79 @@ class pirates(object):
         :param a: array of floats. Coefficients a in the source term f for the eq
         :param controls: function giving a list of controls.
         :param pictures: int. Approximate number of pictures.
+        :param active_region: bool. If True, the time steps are only computed
+                              on the boxes containing the supports of the
+                              densities.
+        :param amr_threshold: float or None. If not None, the cells where the
+                              norm of the gradient of a density exceeds
+                              amr_threshold are refined (see amr.py).
+        :param amr_ratio: int. Refinement ratio of the patches.
+        :param amr_regrid: int. Number of time steps between two regriddings.
+        :param amr_buffer: int. Number of cells added around the flagged cells.
+        :param concurrent: bool. If True, the densities of pirates and ships
+                           and the police vessels are updated concurrently
+                           by three threads.
+        :param dtype: numpy float type of the densities and of the kernels,
+                      np.float64 or np.float32. The sums giving the police
+                      forces and the cost are always computed in double
+                      precision.
+        :param kernel_tolerance: float or None. If not None, the kernels of
+                                 the convolutions are replaced by sums of
+                                 separable kernels with this relative error.
+        :param fft_memory: float or None. If not None, the convolutions are
+                           computed by FFTs on tiles whose temporaries take
+                           at most fft_memory megabytes. It cannot be used
+                           together with kernel_tolerance.
+        :param prune_threshold: float or None. The kernels whose L1 norm is
+                                at most prune_threshold are considered to be
+                                zero, and the terms of the system which are
+                                identically zero are skipped (see
+                                evolution.inactive_terms). If None, no term
+                                is skipped.
+        :param steady_tolerance: float or None. If not None, the evolution
+                                 stops when the relative changes of the
+                                 densities and the displacement of the police
+                                 vessels per unit time stay below
+                                 steady_tolerance for steady_window time
+                                 steps. The remaining running cost is
+                                 extrapolated.
+        :param steady_window: int. Number of time steps of the sliding window.
+        :param artefact_cache: string or None. If not None, directory of the
+                               cache of the meshes, of the sampled kernels
+                               and of their factorizations or spectra (see
+                               artefacts.py). They are mapped in memory from
+                               the cache when they are there.
+        :param save_queue: int. Number of states which may wait to be saved
+                           by the background writer (see save.writer). If
+                           0, the states are saved synchronously.
+        :param output_format: string. 'npz' saves each state in a file
+                              saving_*.npz, 'series' in a single time series
+                              mapped in memory (see save.series).
+        :param compression: string. Codec of the files saving_*.npz:
+                            'deflate' (numpy.savez_compressed), 'none',
+                            'fast' or 'high' (see save.solution_Save).
+        :param compression_threads: int. Number of threads compressing the
+                                    chunks of the densities with the codecs
+                                    'fast' and 'high'.
+        :param encoding: string. Encoding of the densities in the files
+                         saving_*.npz: 'dense', 'crop' (box of the nonzero
+                         values) or 'sparse' (see save.encode).
+        :param keyframes: int. If larger than 1, one state every keyframes
+                          is saved in full and the others as differences
+                          from the previous state.
+        :param precision: string. Precision of the densities in the files
+                          saving_*.npz: 'full', or 'float16', 'uint16' and
+                          'uint8' for frames which are only plotted (see
+                          save.quantise).
+        :param streams: list of outputs.stream, or of their descriptions
+                        (see outputs.parse). Additional outputs, each in its
+                        subdirectory: decimated states, or states on a part
+                        of the mesh, at their own time steps.
+        :param checkpoint_every: int. If positive, number of time steps
+                                 between two checkpoints of the evolution
+                                 (see evolution.time_loop).
+        :param resume: bool. If True, the evolution is resumed from the
+                       checkpoint of the directory, if there is one.
         """
 
         # 2d domains
@@ -56,6 +141,11 @@ class pirates(object):
         self.n_x = n_x
         self.n_y = n_y
         self.check_domain()
+        self.dtype = np.dtype(dtype)
+        if artefact_cache is None:
+            self.artefacts = None
+        else:
+            self.artefacts = artefacts.store(artefact_cache)
 
         self.create_mesh()
         self.create_initial_datum(InitialDatum_rho, InitialDatum_A)
@@ -71,7 +161,10 @@ class pirates(object):
         # ships' velocity
         self.ships_speed = speed_ships
         self.ships_direction = nu
-        self.ships_direction_mesh = nu(self.x, self.y)
+        self.ships_direction_mesh = tuple(self.cached('nu ' + str(k),
+                                                      lambda k = k: np.asarray(nu(self.x, self.y)[k], dtype = self.dtype),
+                                                      nu)
+                                          for k in xrange(2))
         
         # time 
         self.time_of_simulation = tMax
@@ -90,13 +183,58 @@ class pirates(object):
         self.cut_off_C_pirates = cut_off_C_pirates
         self.cut_off_C_ships = cut_off_C_ships
         self.cut_off_C_police = cut_off_C_police
+        self.kernel_tolerance = kernel_tolerance
+        self.fft_memory = fft_memory
+        self.check_kernels()
         self.create_kernels()
+        if self.artefacts is not None:
+            logging.info('Artefacts: ' + str(self.artefacts.hits) + ' mapped from ' + artefact_cache +
+                         ', ' + str(self.artefacts.misses) + ' computed')
 
         # normalization function kappa
         self.kappa = kappa
 
         # coefficient a for the source term f in the equation for pirates
         self.a = a
+
+        # restriction of the stencils to the support of the densities
+        self.active_region = active_region
+
+        # adaptive mesh refinement
+        self.amr_threshold = amr_threshold
+        self.amr_ratio = amr_ratio
+        self.amr_regrid = amr_regrid
+        self.amr_buffer = amr_buffer
+
+        # concurrent update of the unknowns
+        self.concurrent = concurrent
+
+        # terms of the system skipped when they vanish
+        self.prune_threshold = prune_threshold
+
+        # detection of the steady states
+        self.steady_tolerance = steady_tolerance
+        self.steady_window = steady_window
+
+        # background writer of the states
+        self.save_queue = save_queue
+        if output_format not in ('npz', 'series'):
+            raise ValueError('Unknown output format ' + repr(output_format))
+        self.output_format = output_format
+        self.compression = compression
+        self.compression_threads = compression_threads
+        self.encoding = encoding
+        self.keyframes = keyframes
+        self.precision = precision
+        self.streams = [outputs.parse(q) if isinstance(q, basestring) else q for q in streams]
+        if len(set(q.name for q in self.streams)) < len(self.streams):
+            raise ValueError('The output streams need different names')
+        for q in self.streams:
+            q.window(self, self.police_initial_positions)
+
+        # checkpoints of the evolution
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
         
     #
     # Function for creating the space mesh
@@ -119,7 +257,8 @@ class pirates(object):
         """
         (self.x, self.dx) = np.linspace(self.x_1, self.x_2, self.n_x, retstep=True)
         (self.y, self.dy) = np.linspace(self.y_1, self.y_2, self.n_y, retstep=True)
-        self.x_mesh, self.y_mesh = np.meshgrid(self.x, self.y)
+        self.x_mesh = self.cached('x_mesh', lambda: np.meshgrid(self.x.astype(self.dtype), self.y.astype(self.dtype))[0])
+        self.y_mesh = self.cached('y_mesh', lambda: np.meshgrid(self.x.astype(self.dtype), self.y.astype(self.dtype))[1])
 
 
     #
@@ -133,9 +272,7 @@ class pirates(object):
         self.dt = the time step
 
         """
-        dxy = min(self.dx, self.dy)
-        dt = 0.25* min(dxy**2, dxy/self.ships_speed(0))
-        N = 2 + int(self.time_of_simulation / dt)
+        (N, dt) = time_steps(self.dx, self.dy, self.time_of_simulation, self.ships_speed)
         (self.time, self.dt) = np.linspace(0., self.time_of_simulation, N, retstep = True)
         assert (self.dt <= dt)
 
@@ -170,13 +307,73 @@ class pirates(object):
                         and mesh size self.dy
         self.kernel_mathcal_K = numpy 2d vector generated by the function
                                 self.mathcal_K
+        self.ships_kernels = tuple of the numpy 2d vectors x * C and y * C,
+                             where C is generated by self.cut_off_C_ships
+
+        self.p_kernel and self.s_kernels are the kernels passed to the
+        convolutions: the previous ones cropped to their support (see
+        convolution.cropped_kernel), their separable approximations if
+        self.kernel_tolerance is not None, or the kernels convolved by tiled
+        FFTs if self.fft_memory is not None.
 
         """
 
         self.kernel_x = self.x - (self.x_1 + self.x_2)/2.
         self.kernel_y = self.y - (self.y_1 + self.y_2)/2.
-        self.kernel_mathcal_K = self.mathcal_K(self.kernel_x, self.kernel_y)
+        self.kernel_mathcal_K = self.cached('kernel_mathcal_K',
+                                            lambda: np.asarray(self.mathcal_K(self.kernel_x, self.kernel_y), dtype = self.dtype),
+                                            self.mathcal_K)
+        C = []
+        def ships_kernel(mesh):
+            if not C:
+                C.append(self.cut_off_C_ships(self.x_mesh, self.y_mesh))
+            return np.asarray(mesh * C[0], dtype = self.dtype)
+        self.ships_kernels = (self.cached('ships_kernel x', lambda: ships_kernel(self.x_mesh), self.cut_off_C_ships),
+                              self.cached('ships_kernel y', lambda: ships_kernel(self.y_mesh), self.cut_off_C_ships))
+
+        if self.artefacts is None:
+            caches = (None, None, None)
+        else:
+            caches = (self.artefacts.cached('kernel_mathcal_K', self.mathcal_K, *self.mesh_parameters()),
+                      self.artefacts.cached('ships_kernel x', self.cut_off_C_ships, *self.mesh_parameters()),
+                      self.artefacts.cached('ships_kernel y', self.cut_off_C_ships, *self.mesh_parameters()))
+
+        if self.fft_memory is not None:
+            memory = self.fft_memory * 2.**20
+            self.p_kernel = convolution.fft_kernel(self.kernel_mathcal_K, memory, caches[0])
+            self.s_kernels = tuple(convolution.fft_kernel(k, memory, c)
+                                   for (k, c) in zip(self.ships_kernels, caches[1:]))
+            logging.info('FFT tiles of sizes ' +
+                         str([k.tile for k in (self.p_kernel, ) + self.s_kernels if k.data is not None]))
+        elif self.kernel_tolerance is None:
+            self.p_kernel = convolution.cropped_kernel(self.kernel_mathcal_K)
+            self.s_kernels = tuple(convolution.cropped_kernel(k) for k in self.ships_kernels)
+        else:
+            self.p_kernel = convolution.separable_kernel(self.kernel_mathcal_K, self.kernel_tolerance, caches[0])
+            self.s_kernels = tuple(convolution.separable_kernel(k, self.kernel_tolerance, c)
+                                   for (k, c) in zip(self.ships_kernels, caches[1:]))
+            logging.info('Separable kernels of ranks ' +
+                         str([k.rank for k in (self.p_kernel, ) + self.s_kernels]))
+
+
+        
+    #
+    # Functions for the cache of the artefacts
+    #
+    def mesh_parameters(self):
+        return (self.domain, self.n_x, self.n_y, self.dtype.str)
+
 
+    def cached(self, name, compute, *parameters):
+        """
+        This function returns compute(), or the same array taken from the
+        cache of the artefacts, where it depends on the mesh, on the dtype
+        and on parameters (numbers, arrays or functions).
+        """
+        if self.artefacts is None:
+            return compute()
+
+        return self.artefacts.array(artefacts.key(name, *(self.mesh_parameters() + parameters)), compute)
 
         
     #
@@ -192,8 +389,8 @@ class pirates(object):
         It creates self.initial_density_pirates and self.initial_density_ships.
         They are two 2d-numpy array of shapes (n_y, n_x)
         """
-        self.initial_density_pirates = InitialDatum_rho(self.x_mesh, self.y_mesh)
-        self.initial_density_ships = InitialDatum_A(self.x_mesh, self.y_mesh)
+        self.initial_density_pirates = np.asarray(InitialDatum_rho(self.x_mesh, self.y_mesh), dtype = self.dtype)
+        self.initial_density_ships = np.asarray(InitialDatum_A(self.x_mesh, self.y_mesh), dtype = self.dtype)
 
     #
     # Projection into the domain
@@ -230,6 +427,14 @@ class pirates(object):
             logging.info('Error: both n_x and n_y should be strictly positive')
             exit()
 
+    #
+    # Function for checking the options of the convolutions.
+    def check_kernels(self):
+        if self.kernel_tolerance is not None and self.fft_memory is not None:
+            print 'Error: kernel_tolerance and fft_memory cannot be both given'
+            logging.info('Error: kernel_tolerance and fft_memory cannot be both given')
+            exit()
+
     #
     # Function for checking the initial position of the police vessels.
     def check_positions(self):
@@ -254,3 +459,45 @@ class pirates(object):
                 print 'Error: the y position of the ' + str(i+1) + '-th vessel is not correct'
                 logging.info('Error: the y position of the ' + str(i+1) + '-th vessel is not correct')
                 exit()
+
+
+#
+# number of times of the time mesh
+#
+def time_steps(dx, dy, tMax, speed_ships):
+    """
+    This function returns the tuple (N, dt), where dt is the largest time
+    step allowed by the stability conditions and N is the number of times
+    of the time mesh from 0 to tMax.
+    """
+    dxy = min(dx, dy)
+    dt = 0.25* min(dxy**2, dxy/speed_ships(0))
+
+    return (2 + int(tMax / dt), dt)
+
+
+#
+# function for creating the pirate class from a simulation directory
+#
+def load(dirName, **options):
+    """
+    This function reads dirName/parameters.py and returns the corresponding
+    pirate class.
+
+    :param dirName: string. The simulation directory
+    :param options: keyword arguments of the pirate class (for instance
+                    dtype or kernel_tolerance). The keys n_x, n_y and tMax
+                    replace the values of parameters.py
+
+    :output simul_pirates: pirate class
+    """
+    p = {'numpy': np}
+    execfile(os.path.join(dirName, 'parameters.py'), p)
+    for key in ['n_x', 'n_y', 'tMax']:
+        if key in options:
+            p[key] = options.pop(key)
+
+    return pirates(p['x_1'], p['x_2'], p['y_1'], p['y_2'], p['n_x'], p['n_y'], p['M'], p['tMax'], p['d_o'],
+                   p['InitialDatum_rho'], p['InitialDatum_A'],
+                   p['speed_ships'], p['nu'], dirName, p['mathcal_K'], p['cut_off_C_pirates'], p['kappa'], p['a'],
+                   p['cut_off_C_ships'], p['cut_off_C_police'], p['controls'], **options)
@@ -10,9 +10,9 @@ import numpy
 import matplotlib
 import matplotlib.pyplot
 import os
-import glob
 import sys
 from multiprocessing import Pool
+import save
 
 #
 # Plotting initial data
@@ -138,8 +138,8 @@ def plt_solutions(pirates, levels = 10):
 
     dirName = pirates.base_directory
     
-    list_files = glob.glob(os.path.join(dirName, 'saving*.npz'))
-    list_files.sort()
+    # states saved in files saving_*.npz or in a time series
+    solutions = save.load_solutions(dirName)
 
     # plotting initial conditions
     plt_contour(pirates.x, pirates.y, pirates.initial_density_pirates, 'Pirates density at time t=0', 'pirates_plot_0000.png', pirates.base_directory, pirates.police_initial_positions, levels)
@@ -148,18 +148,16 @@ def plt_solutions(pirates, levels = 10):
 
     
     # pirates' and ships pictures
-    for FileName in list_files:
-        name = '_plot' + os.path.splitext(FileName)[0][1:][-5:] + '.png'
+    for (k, solution) in enumerate(solutions):
+        name = '_plot_' + str(k + 1).zfill(4) + '.png'
         pirate_file = 'pirates' + name
         ship_file = 'ships' + name
 
-        # read the file
-        npzf = numpy.load(FileName)
-        t = npzf['t']
-        p_density = npzf['r']
-        s_density = npzf['A']
-        police = npzf['d']
-        npzf.close()
+        # read the state
+        t = solution['t']
+        p_density = solution['r']
+        s_density = solution['A']
+        police = solution['d']
 
 
         # contour plot of density of pirates
@@ -4,9 +4,45 @@
 
 import numpy
 import os
+import glob
+import json
+import time
+import zlib
+import bz2
+import logging
+import threading
+import traceback
+import copy
+import cPickle
+import Queue
+from multiprocessing.pool import ThreadPool
+
+# codecs of the chunked densities: (compress, decompress). 'deflate' is
+# numpy.savez_compressed and 'none' numpy.savez, without chunks
+CODECS = {'fast': (lambda block: zlib.compress(block, 1), zlib.decompress),
+          'high': (lambda block: bz2.compress(block, 9), bz2.decompress)}
+
+# size in bytes of the chunks
+CHUNK = 2**18
+
+
+# Removing the previous version of a file
+def remove(filename, extension = '.npz'):
+    """This function removes filename (.npz by default), if it exists, so that it is
+    replaced by a new file instead of being overwritten: its hard links in
+    the cache of the results (see cache.py) are not modified.
+
+    :param filename: string containing the path, without the extension
+    :param extension: string. Extension of the file
+    """
+    try:
+        os.remove(filename + extension)
+    except OSError:
+        pass
 
 # Saving to disk the solution for (rho, A, d)
-def solution_Save(dirName, name, time, rho, A, d, cost):
+def solution_Save(dirName, name, time, rho, A, d, cost, codec = 'deflate', pool = None,
+                  encoding = 'dense', previous = None, precision = 'full', mesh = None):
     """This function saves the state of the simulation.
 
     :param dirName: string containing the path
@@ -16,10 +52,239 @@ def solution_Save(dirName, name, time, rho, A, d, cost):
     :param A: 2d-array. Density of the ships.
     :param d: array. Position of the police vessels.
     :param cost: float. Cost at time 'time'
+    :param codec: string. 'deflate' (numpy.savez_compressed), 'none'
+                  (numpy.savez), or 'fast' (zlib, level 1) and 'high' (bz2,
+                  level 9), compressing the densities by chunks of rows
+                  (see compress)
+    :param pool: ThreadPool compressing the chunks, or None
+    :param encoding: string. 'dense', 'crop' or 'sparse' (see encode)
+    :param previous: tuple (rho, A) of the previous state, or None. If not
+                     None, the densities are saved as differences from it
+    :param precision: string. 'full', or 'float16', 'uint16' and 'uint8'
+                      for the frames which are only plotted (see quantise)
+    :param mesh: tuple (x, y) or None. Coordinates of the mesh of the
+                 densities, if it is not the one of the simulation
+
+    :output size: int. Size in bytes of the file
     """
     filename = os.path.join(dirName, name)
+    remove(filename)
     
-    numpy.savez_compressed(filename, t=time, r=rho, A=A, d=d, c = cost)
+    arrays = dict(t=time, d=d, c = cost)
+    if mesh is not None:
+        arrays.update(x = mesh[0], y = mesh[1])
+    if precision != 'full':
+        # the previous state is quantised again as when it was saved
+        quantised = [quantise('r', rho, precision), quantise('A', A, precision)]
+        (rho, A) = (quantised[0].pop('r'), quantised[1].pop('A'))
+        arrays.update(quantised[0])
+        arrays.update(quantised[1])
+        if previous is not None:
+            previous = (quantise('r', previous[0], precision)['r'], quantise('A', previous[1], precision)['A'])
+
+    if encoding == 'dense' and previous is None:
+        arrays.update(r=rho, A=A)
+    else:
+        arrays.update(encode('r', rho, encoding, None if previous is None else previous[0]))
+        arrays.update(encode('A', A, encoding, None if previous is None else previous[1]))
+
+    if codec == 'deflate':
+        numpy.savez_compressed(filename, **arrays)
+    elif codec == 'none':
+        numpy.savez(filename, **arrays)
+    else:
+        for key in ['r', 'A', 'r_index', 'A_index', 'r_values', 'A_values']:
+            if key in arrays:
+                arrays.update(compress(key, arrays.pop(key), codec, pool))
+        numpy.savez(filename, **arrays)
+
+    return os.path.getsize(filename + '.npz')
+
+
+# Reducing the precision of a density
+def quantise(key, a, precision):
+    """This function reduces the precision of the density a, for the
+    frames which are only plotted: 'float16' keeps about 3 significant
+    digits, 'uint16' and 'uint8' map the interval [min(a, 0), max(a)] to
+    2**16 or 2**8 levels (zero stays zero).
+
+    :param key: string. Name of the array
+    :param a: numpy 2d array
+
+    :output arrays: dictionary of the arrays to be saved: key,
+                    key_precision, key_float (dtype of a), and key_offset
+                    and key_scale for the integers
+    """
+    arrays = {key + '_precision': numpy.array(precision), key + '_float': numpy.array(numpy.dtype(a.dtype).str)}
+    if precision == 'float16':
+        arrays[key] = numpy.asarray(a).astype(numpy.float16)
+    elif precision in ('uint16', 'uint8'):
+        offset = min(float(numpy.min(a)), 0.)
+        scale = (float(numpy.max(a)) - offset) / numpy.iinfo(precision).max or 1.
+        arrays[key + '_offset'] = numpy.array(offset)
+        arrays[key + '_scale'] = numpy.array(scale)
+        arrays[key] = numpy.rint((a - offset) / scale).astype(precision)
+    else:
+        raise ValueError('Unknown precision ' + repr(precision))
+
+    return arrays
+
+
+# Reading a density saved by quantise
+def dequantise(npzf, key, a):
+    """This function returns the density a, read from the open .npz file
+    npzf, in its original float type if it was quantised.
+    """
+    if key + '_precision' not in npzf.files:
+        return a
+
+    dtype = str(npzf[key + '_float'])
+    if str(npzf[key + '_precision']) == 'float16':
+        return a.astype(dtype)
+
+    return (a * npzf[key + '_scale'] + npzf[key + '_offset']).astype(dtype)
+
+
+# Unsigned integers with the bits of a float type
+def bits_type(dtype):
+    return numpy.dtype('u' + str(numpy.dtype(dtype).itemsize))
+
+
+# Encoding a density
+def encode(key, a, encoding, previous = None):
+    """This function encodes the bits of the density a, or their exclusive
+    or with the bits of previous (zero where the density did not change),
+    so that the zeros are not saved. The encoding is exact.
+
+    :param key: string. Name of the array
+    :param a: numpy 2d array
+    :param encoding: string. 'dense' saves all the bits, 'crop' the
+                     smallest box containing the nonzero ones, 'sparse' the
+                     indices and the values of the nonzero ones (or the
+                     box, if less than a quarter of them are zeros)
+    :param previous: numpy 2d array or None
+
+    :output arrays: dictionary of the arrays to be saved: key_encoding,
+                    key_size, key_type, key_delta, and key (dense and crop),
+                    key_box (crop), key_index and key_values (sparse)
+    """
+    a = numpy.ascontiguousarray(a)
+    bits = a.view(bits_type(a.dtype))
+    if previous is not None:
+        bits = bits ^ numpy.ascontiguousarray(previous, dtype = a.dtype).view(bits.dtype)
+
+    if encoding not in ['dense', 'crop', 'sparse']:
+        raise ValueError('Unknown encoding ' + repr(encoding))
+
+    arrays = {key + '_size': numpy.array(a.shape), key + '_type': numpy.array(a.dtype.str),
+              key + '_delta': numpy.array(previous is not None)}
+    if encoding == 'sparse':
+        index = numpy.flatnonzero(bits)
+        index = index.astype(numpy.int32 if bits.size < 2**31 else numpy.int64)
+        # the indices double the size of dense densities: they are cropped
+        if index.nbytes < bits.nbytes // 2:
+            arrays[key + '_encoding'] = numpy.array('sparse')
+            arrays[key + '_index'] = index
+            arrays[key + '_values'] = bits.ravel()[index]
+            return arrays
+        encoding = 'crop'
+
+    arrays[key + '_encoding'] = numpy.array(encoding)
+    if encoding == 'dense':
+        arrays[key] = bits
+    else:
+        rows = numpy.flatnonzero(numpy.any(bits, axis = 1))
+        columns = numpy.flatnonzero(numpy.any(bits, axis = 0))
+        if len(rows) > 0:
+            box = (rows[0], rows[-1] + 1, columns[0], columns[-1] + 1)
+        else:
+            box = (0, 0, 0, 0)
+        arrays[key + '_box'] = numpy.array(box)
+        arrays[key] = bits[box[0]:box[1], box[2]:box[3]]
+
+    return arrays
+
+
+# Reading a density saved by encode
+def decode(npzf, key, previous = None):
+    """This function returns the density key of the open .npz file npzf,
+    whether it was encoded (see encode) or not.
+
+    :param previous: numpy 2d array. The density of the previous state,
+                     needed if the state is saved as a difference (see
+                     is_delta)
+    """
+    if key + '_encoding' not in npzf.files:
+        return decompress(npzf, key)
+
+    encoding = str(npzf[key + '_encoding'])
+    shape = tuple(npzf[key + '_size'])
+    dtype = numpy.dtype(str(npzf[key + '_type']))
+    if encoding == 'dense':
+        bits = decompress(npzf, key)
+    else:
+        bits = numpy.zeros(shape, dtype = bits_type(dtype))
+        if encoding == 'crop':
+            (y_1, y_2, x_1, x_2) = npzf[key + '_box']
+            bits[y_1:y_2, x_1:x_2] = decompress(npzf, key)
+        else:
+            bits.flat[decompress(npzf, key + '_index')] = decompress(npzf, key + '_values')
+
+    if is_delta(npzf, key):
+        if previous is None:
+            raise ValueError('The density ' + key + ' is saved as a difference from the previous state')
+        bits = bits ^ numpy.ascontiguousarray(previous, dtype = dtype).view(bits.dtype)
+
+    return bits.view(dtype)
+
+
+def is_delta(npzf, key):
+    return key + '_delta' in npzf.files and bool(npzf[key + '_delta'])
+
+
+# Compressing an array by chunks
+def compress(key, a, codec, pool = None):
+    """This function splits the array a in chunks of rows of about CHUNK
+    bytes, and compresses them with codec, in parallel if pool is not None
+    (zlib and bz2 release the GIL).
+
+    :param key: string. Name of the array
+    :param a: numpy array
+    :param codec: string. Key of CODECS
+
+    :output arrays: dictionary of the arrays to be saved: key_codec,
+                    key_dtype, key_shape, key_rows (rows in a chunk) and the
+                    compressed chunks key_0, key_1, ... (as uint8 arrays)
+    """
+    a = numpy.ascontiguousarray(a)
+    rows = max(1, CHUNK // max(a.itemsize * int(numpy.prod(a.shape[1:])), 1))
+
+    chunks = [a[i:i + rows].tobytes() for i in xrange(0, a.shape[0], rows)]
+    function = CODECS[codec][0]
+    compressed = pool.map(function, chunks) if pool is not None else map(function, chunks)
+
+    arrays = {key + '_codec': numpy.array(codec), key + '_dtype': numpy.array(a.dtype.str),
+              key + '_shape': numpy.array(a.shape), key + '_rows': numpy.array(rows)}
+    for (k, c) in enumerate(compressed):
+        arrays[key + '_' + str(k)] = numpy.frombuffer(c, dtype = numpy.uint8)
+
+    return arrays
+
+
+# Reading an array saved by compress
+def decompress(npzf, key):
+    """This function returns the array key of the open .npz file npzf,
+    whether it was saved by chunks (see compress) or not.
+    """
+    if key in npzf.files or key + '_codec' not in npzf.files:
+        return npzf[key]
+
+    function = CODECS[str(npzf[key + '_codec'])][1]
+    shape = tuple(npzf[key + '_shape'])
+    rows = int(npzf[key + '_rows'])
+    chunks = [function(npzf[key + '_' + str(k)].tobytes()) for k in xrange(-(-shape[0] // rows))]
+
+    return numpy.frombuffer(b''.join(chunks), dtype = str(npzf[key + '_dtype'])).reshape(shape)
 
 
 # Saving the cost
@@ -31,9 +296,358 @@ def cost_Save(dirName, name, cost):
     :param cost: float. Cost at time 'time'
     """
     filename = os.path.join(dirName, name)
+    remove(filename)
     
     numpy.savez_compressed(filename, c = cost)
-    
 
 
+# Saving a checkpoint
+def checkpoint_Save(dirName, state):
+    """This function saves the checkpoint state (a dictionary) in
+    dirName/checkpoint.pkl. The file is written under another name and
+    renamed: a crash leaves the previous checkpoint.
+
+    :param dirName: string containing the path
+    :param state: dictionary of the values needed to resume the evolution
+                  (see evolution.time_loop)
+
+    :output size: int. Size in bytes of the file
+    """
+    filename = os.path.join(dirName, 'checkpoint.pkl')
+    with open(filename + '.tmp', 'wb') as f:
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(filename + '.tmp', filename)
+
+    return os.path.getsize(filename)
+
+
+# Reading a checkpoint
+def checkpoint_Load(dirName):
+    """This function returns the checkpoint saved in dirName by
+    checkpoint_Save, or None if there is none.
+    """
+    filename = os.path.join(dirName, 'checkpoint.pkl')
+    if not os.path.isfile(filename):
+        return None
+
+    with open(filename, 'rb') as f:
+        return cPickle.load(f)
+
+
+# Saving the states in a single time series
+class series(object):
+    """This class saves the states of the simulation in preallocated .npy
+    files, written through memory maps: series_r.npy and series_A.npy
+    (frames x n_y x n_x), series_d.npy (frames x M x 2), series_t.npy and
+    series_c.npy (frames). The header series.json describes the layout and
+    the number of frames already written; it is rewritten after each
+    frame: a reader (see load_series) may follow a running simulation.
+    """
+
+    def __init__(self, dirName, frames, shape, M, dtype, resume = 0):
+        """
+        :param dirName: string containing the path
+        :param frames: int. Maximum number of frames
+        :param shape: tuple (n_y, n_x). Shape of the densities
+        :param M: int. Number of police vessels
+        :param dtype: numpy float type of the densities
+        :param resume: int. If positive, the existing series is continued
+                       after its first resume frames
+        """
+        self.dirName = dirName
+        self.header = {'version': 1, 'frames': 0, 'capacity': int(frames),
+                       'arrays': {'t': ['series_t.npy', [], 'float64'],
+                                  'r': ['series_r.npy', list(shape), numpy.dtype(dtype).name],
+                                  'A': ['series_A.npy', list(shape), numpy.dtype(dtype).name],
+                                  'd': ['series_d.npy', [M, 2], 'float64'],
+                                  'c': ['series_c.npy', [], 'float64']}}
+        self.arrays = {}
+        for (key, (name, shape_key, dtype_key)) in self.header['arrays'].items():
+            filename = os.path.join(dirName, name)
+            if resume > 0:
+                self.arrays[key] = numpy.lib.format.open_memmap(filename, mode = 'r+')
+                continue
+            remove(os.path.splitext(filename)[0], '.npy')
+            self.arrays[key] = numpy.lib.format.open_memmap(filename, mode = 'w+', dtype = dtype_key,
+                                                            shape = (int(frames), ) + tuple(shape_key))
+        self.header['frames'] = resume
+        self.write_header()
+
+    def write_header(self):
+        filename = os.path.join(self.dirName, 'series.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.header, f, indent = 1, sort_keys = True)
+        os.rename(filename + '.tmp', filename)
+
+    def solution_Save(self, dirName, name, time, rho, A, d, cost):
+        """This function writes the next frame. The parameters are the ones
+        of solution_Save (name is not used).
+        """
+        k = self.header['frames']
+        if k == self.header['capacity']:
+            raise IndexError('The time series in ' + self.dirName + ' is full')
+
+        self.arrays['t'][k] = time
+        self.arrays['r'][k] = rho
+        self.arrays['A'][k] = A
+        self.arrays['d'][k] = numpy.reshape(d, numpy.shape(self.arrays['d'][k]))
+        self.arrays['c'][k] = cost
+        self.header['frames'] = k + 1
+        self.write_header()
+
+        return sum(a[k].nbytes for a in self.arrays.values())
+
+    def close(self):
+        for a in self.arrays.values():
+            a.flush()
+
+
+# Reading a time series
+def load_series(dirName):
+    """This function returns the states saved by series in dirName.
+
+    :param dirName: string containing the path
+
+    :output data: dictionary of read only memory maps with keys 't', 'r',
+                  'A', 'd' and 'c', restricted to the frames written (the
+                  entry k of each one is the frame k), as in the files
+                  saving_*.npz
+    """
+    with open(os.path.join(dirName, 'series.json')) as f:
+        header = json.load(f)
+
+    frames = header['frames']
+    return dict((key, numpy.load(os.path.join(dirName, name), mmap_mode = 'r')[:frames])
+                for (key, (name, shape, dtype)) in header['arrays'].items())
+
+
+# Reading the states
+def load_solutions(dirName):
+    """This function returns the list of the saved states in dirName, as
+    dictionaries with keys 't', 'r', 'A', 'd' and 'c' (and 'x' and 'y' in
+    the directories of the output streams, see outputs.py). They are read from
+    the time series if it is newer than the files saving_*.npz, without
+    copies; otherwise each file is read when its state is used.
+
+    :param dirName: string containing the path
+    """
+    list_files = sorted(glob.glob(os.path.join(dirName, 'saving*.npz')))
+    header = os.path.join(dirName, 'series.json')
+    if os.path.isfile(header) and (not list_files or
+                                   os.path.getmtime(header) >= max(os.path.getmtime(f) for f in list_files)):
+        data = load_series(dirName)
+        return [dict((key, data[key][k]) for key in data) for k in xrange(len(data['t']))]
+
+    solutions = []
+    decoded = {}
+    for FileName in list_files:
+        solutions.append(lazy_npz(FileName, solutions[-1] if solutions else None, decoded))
+
+    return solutions
+
+
+class lazy_npz(object):
+    """This class reads a file saving_*.npz when one of its arrays is
+    used, as a dictionary. The chunked arrays are decompressed, the
+    quantised densities restored and the encoded densities decoded: a density saved as a difference is rebuilt
+    from the previous keyframe, or from the last density decoded if it is
+    the one of the previous state (the states read in order are decoded
+    once).
+    """
+
+    def __init__(self, FileName, previous = None, decoded = None):
+        """
+        :param FileName: string. Path of the file
+        :param previous: lazy_npz of the previous state, or None
+        :param decoded: dictionary shared by the states of a directory,
+                        with the last density decoded for each key
+        """
+        self.FileName = FileName
+        self.previous = previous
+        self.decoded = decoded if decoded is not None else {}
+
+    def __getitem__(self, key):
+        if key not in ('r', 'A'):
+            npzf = numpy.load(self.FileName)
+            value = decompress(npzf, key)
+            npzf.close()
+            return value
+
+        # states back to a keyframe, or to the last state decoded
+        chain = []
+        value = None
+        state = self
+        while state is not None:
+            (last, density) = self.decoded.get(key, (None, None))
+            if last is state:
+                value = density
+                break
+            chain.append(state)
+            npzf = numpy.load(state.FileName)
+            delta = is_delta(npzf, key)
+            npzf.close()
+            if not delta:
+                break
+            state = state.previous
+
+        for state in reversed(chain):
+            npzf = numpy.load(state.FileName)
+            value = decode(npzf, key, value)
+            npzf.close()
+        self.decoded[key] = (self, value)
+
+        npzf = numpy.load(self.FileName)
+        value = dequantise(npzf, key, value)
+        npzf.close()
+
+        return value
+
+
+# Saving in a background thread
+class writer(object):
+    """This class saves the states of the simulation in a background thread,
+    so that the compression and the writes overlap with the computation.
+    The arrays are copied when they are queued. When the queue is full, the
+    simulation waits for the writer. The sizes and the time of the saves
+    are logged when the writer is closed.
+    """
+
+    def __init__(self, size, series = None, codec = 'deflate', threads = 1, encoding = 'dense',
+                 keyframes = 0, precision = 'full'):
+        """
+        :param size: int. Maximum number of states waiting in the queue. If
+                     0, the states are saved synchronously
+        :param series: dictionary or None. The states of the directories in
+                       its keys are saved in the corresponding series, the
+                       others in files saving_*.npz
+        :param codec: string. Codec of the files saving_*.npz (see
+                      solution_Save)
+        :param threads: int. Number of threads compressing the chunks of the
+                        densities with the codecs 'fast' and 'high'
+        :param encoding: string. Encoding of the densities in the files
+                         saving_*.npz (see encode)
+        :param keyframes: int. If larger than 1, one state every keyframes
+                          of each directory is saved in full, the others
+                          as differences from the previous state
+        :param precision: string. Precision of the densities in the files
+                          saving_*.npz (see quantise)
+        """
+        self.size = size
+        self.series = series if series is not None else {}
+        self.codec = codec
+        self.encoding = encoding
+        self.keyframes = keyframes
+        self.previous = {}
+        self.error = None
+        if codec not in ['deflate', 'none'] + CODECS.keys():
+            raise ValueError('Unknown codec ' + repr(codec))
+        if encoding not in ['dense', 'crop', 'sparse']:
+            raise ValueError('Unknown encoding ' + repr(encoding))
+        if precision not in ['full', 'float16', 'uint16', 'uint8']:
+            raise ValueError('Unknown precision ' + repr(precision))
+        self.precision = precision
+        self.pool = ThreadPool(threads) if threads > 1 and codec in CODECS else None
+
+        # states, bytes of the arrays, bytes written, seconds
+        self.states = 0
+        self.raw = 0
+        self.stored = 0
+        self.seconds = 0.
+        if size > 0:
+            self.queue = Queue.Queue(maxsize = size)
+            self.thread = threading.Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                job[0](*job[1:])
+            except Exception:
+                self.error = traceback.format_exc()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('Error in the writer thread:\n' + self.error)
+
+    def put(self, job):
+        self.check()
+        if self.size > 0:
+            self.queue.put(job)
+        else:
+            job[0](*job[1:])
+
+    def solution_Save(self, dirName, name, time, rho, A, d, cost, mesh = None):
+        """This function queues the state of the simulation. The parameters
+        are the ones of solution_Save.
+        """
+        self.put((self.save_state, dirName, name, time, numpy.array(rho), numpy.array(A),
+                  numpy.array(d), cost, mesh))
+
+    def save_state(self, dirName, name, time_state, rho, A, d, cost, mesh = None):
+        start = time.time()
+        if dirName in self.series:
+            stored = self.series[dirName].solution_Save(dirName, name, time_state, rho, A, d, cost)
+        else:
+            (count, previous) = self.previous.get(dirName, (0, None))
+            if self.keyframes <= 1 or count % self.keyframes == 0:
+                previous = None
+            stored = solution_Save(dirName, name, time_state, rho, A, d, cost, self.codec, self.pool,
+                                   self.encoding, previous, self.precision, mesh)
+            if self.keyframes > 1:
+                self.previous[dirName] = (count + 1, (rho, A))
+        self.seconds += time.time() - start
+        self.states += 1
+        self.raw += rho.nbytes + A.nbytes + d.nbytes
+        self.stored += stored
+
+    def cost_Save(self, dirName, name, cost):
+        """This function queues the final cost of the simulation. The
+        parameters are the ones of cost_Save.
+        """
+        self.put((cost_Save, dirName, name, cost))
+
+    def checkpoint_Save(self, dirName, state):
+        """This function queues a checkpoint (see checkpoint_Save). It is
+        saved after the states queued before it, with the reference states
+        of the differences (see keyframes) in state['previous']. The state
+        is copied when it is queued.
+        """
+        self.put((self.save_checkpoint, dirName, copy.deepcopy(state)))
+
+    def save_checkpoint(self, dirName, state):
+        state['previous'] = dict((name, value) for (name, value) in self.previous.items()
+                                 if name == dirName or name.startswith(os.path.join(dirName, '')))
+        size = checkpoint_Save(dirName, state)
+        logging.info('Checkpoint at step ' + str(state['step']) + ' (' + '%.1f' % (size / 2.**20) + ' MB)')
+
+    def close(self, check = True):
+        """This function waits for the states in the queue to be saved and
+        stops the thread.
 
+        :param check: bool. If True, an error of the writer is raised
+        """
+        if self.size > 0 and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for s in self.series.values():
+            s.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.states > 0:
+            logging.info('Saved ' + str(self.states) + ' states (' + self.codec + ', ' + self.encoding +
+                         ', ' + self.precision +
+                         (', keyframes every ' + str(self.keyframes) if self.keyframes > 1 else '') + '): ' +
+                         '%.1f' % (self.raw / 2.**20) + ' MB in ' + '%.1f' % (self.stored / 2.**20) +
+                         ' MB (ratio ' + '%.2f' % (float(self.raw) / max(self.stored, 1)) + ') in ' +
+                         '%.2f' % self.seconds + ' s, ' +
+                         '%.1f' % (self.raw / 2.**20 / max(self.seconds, 1e-9)) + ' MB/s')
+        if check:
+            self.check()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+### scenarios.py
+### costs of many control schedules sharing their initial histories
+###
+### The schedules are tables of controls (see evolution.control_table). They
+### are arranged in a tree: the schedules of a node agree up to the time step
+### of the node, where the state of the system is checkpointed, and the
+### branches of the node start from the checkpoint. Each time step of the
+### tree is computed once, whatever the number of schedules sharing it.
+
+import numpy
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+import evolution
+
+
+#
+# class containing the tree of the scenarios
+#
+class scenario_tree(object):
+
+    def __init__(self, pirates):
+        """
+        Initialization function for the class.
+
+        :param pirates: pirate class
+        """
+        self.pirates = pirates
+        self.steps = len(pirates.time) - 1
+        self.pruned = evolution.inactive_terms(pirates)
+
+        # totals over the batches
+        self.computed = 0
+        self.requested = 0
+        self.report = None
+
+
+    #
+    # Function for the table of a schedule
+    #
+    def table(self, controls):
+        """
+        This function returns the table of controls, given as a table or as
+        a function of time, as a numpy array of shape (steps, M, 2).
+        """
+        shape = (self.steps, self.pirates.police_vessels, 2)
+        if not isinstance(controls, numpy.ndarray):
+            controls = [controls(t) for t in self.pirates.time[1:]]
+
+        return numpy.reshape(numpy.array(controls, dtype = float), shape)
+
+
+    #
+    # Function for the costs of a batch of schedules
+    #
+    def costs(self, schedules):
+        """
+        This function returns the costs of the schedules, as
+        evolution.evaluate_cost, and logs the time steps saved by the tree.
+        The report of the batch is kept in self.report.
+
+        :param schedules: list of tables of controls (numpy arrays of shape
+                          (steps, M, 2)) or of functions giving the controls.
+                          Two schedules share a time step only if their
+                          tables are equal up to that step.
+
+        :output costs: list of floats. The cost of each schedule
+        """
+        start = time.time()
+        tables = numpy.array([self.table(c) for c in schedules])
+        costs = [None] * len(tables)
+        computed = 0
+        branch_points = 0
+
+        pool = ThreadPool(3) if self.pirates.concurrent else None
+        try:
+            # nodes to visit: (schedules, first step, state at the first step);
+            # the schedules of a node agree on the steps before the first one
+            nodes = [(numpy.arange(len(tables)), 0, evolution.initial_state(self.pirates))]
+            while nodes:
+                (group, first, state) = nodes.pop()
+
+                # first step where the schedules of the node differ
+                differ = numpy.any(tables[group, first:] != tables[group[0], first:], axis = (0, 2, 3))
+                last = first + numpy.argmax(differ) if numpy.any(differ) else self.steps
+
+                controls = evolution.control_table(tables[group[0]], self.pirates.time)
+                state = evolution.advance(self.pirates, state, controls, first, last, self.pruned, pool)
+                computed += last - first
+
+                if last == self.steps:
+                    for k in group:
+                        costs[k] = state[3] + state[4]
+                    continue
+
+                # checkpoint: the branches start from the state at time[last]
+                branch_points += 1
+                branches = {}
+                for k in group:
+                    branches.setdefault(tables[k, last].tobytes(), []).append(k)
+                for k in sorted(branches.values(), reverse = True):
+                    nodes.append((numpy.array(k), last, state))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        requested = len(tables) * self.steps
+        self.computed += computed
+        self.requested += requested
+        self.report = {'schedules': len(tables), 'branch_points': branch_points,
+                       'computed': computed, 'requested': requested,
+                       'saved': 1. - float(computed) / max(requested, 1),
+                       'seconds': time.time() - start}
+        logging.info('Scenario tree: ' + str(len(tables)) + ' schedules, ' + str(branch_points) +
+                     ' branch points, ' + str(computed) + ' time steps computed instead of ' +
+                     str(requested) + ' (saved ' + '%.1f' % (100. * self.report['saved']) + '%) in ' +
+                     '%.2f' % self.report['seconds'] + ' s')
+
+        return costs
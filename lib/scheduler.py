@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+### scheduler.py
+### runs of many simulation directories on a pool of processes
+###
+### Each job is a run of simulation.py in its own process, with its own log
+### (Simulation-pirates.txt in its directory). The jobs are started from the
+### most expensive one (estimated by n_x * n_y * number of time steps), so
+### that the pool is balanced at the end of the sweep. A job is finished
+### when simulation.py has written in its directory the marker finished.txt
+### with the hash of the current parameters.py and the same options:
+### resuming a sweep runs again only the jobs which failed, were
+### interrupted or were changed since.
+
+import os
+import sys
+import glob
+import time
+import logging
+import resource
+import hashlib
+import subprocess
+from multiprocessing.pool import ThreadPool
+import numpy
+import pirates
+
+# environment of the jobs: one thread each
+SINGLE_THREAD = {'OMP_NUM_THREADS': '1', 'OPENBLAS_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}
+
+# marker of the finished simulations
+MARKER = 'finished.txt'
+
+
+#
+# function for finding the simulation directories
+#
+def directories(patterns):
+    """
+    This function returns the sorted list of the simulation directories
+    (containing a parameters.py) matching the shell patterns.
+    """
+    found = set()
+    for pattern in patterns:
+        for name in glob.glob(pattern) or [pattern]:
+            if os.path.isfile(os.path.join(name, 'parameters.py')):
+                found.add(os.path.normpath(name))
+            else:
+                logging.warning('No parameters.py in ' + name + ': skipped')
+
+    return sorted(found)
+
+
+#
+# function estimating the cost of a simulation
+#
+def estimate(dirName):
+    """
+    This function returns n_x * n_y times the number of time steps of the
+    simulation in dirName, or 0 if its parameters cannot be read (the
+    error is then reported by the job).
+    """
+    p = {'numpy': numpy}
+    try:
+        execfile(os.path.join(dirName, 'parameters.py'), p)
+        dx = float(p['x_2'] - p['x_1']) / (p['n_x'] - 1)
+        dy = float(p['y_2'] - p['y_1']) / (p['n_y'] - 1)
+        (N, dt) = pirates.time_steps(dx, dy, p['tMax'], p['speed_ships'])
+    except Exception as e:
+        logging.warning('Cannot estimate the work of ' + dirName + ': ' + repr(e))
+        return 0
+
+    return p['n_x'] * p['n_y'] * (N - 1)
+
+
+#
+# function describing a run of a simulation
+#
+def signature(dirName, options):
+    """
+    This function returns the content of the marker of a run of
+    simulation.py on dirName with the options (list of strings): the SHA-1
+    of parameters.py and the options.
+    """
+    with open(os.path.join(dirName, 'parameters.py'), 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    return 'parameters.py ' + digest + '\noptions ' + ' '.join(options) + '\n'
+
+
+#
+# functions for the marker of the finished simulations
+#
+def mark_finished(dirName, options):
+    """
+    This function writes the marker of a successful run of simulation.py on
+    dirName with the options. The marker is written under a temporary name
+    and then renamed.
+    """
+    name = os.path.join(dirName, MARKER)
+    with open(name + '.tmp', 'w') as f:
+        f.write(signature(dirName, options))
+    os.rename(name + '.tmp', name)
+
+
+def unmark(dirName):
+    """
+    This function removes the marker of dirName, before its results are
+    overwritten.
+    """
+    try:
+        os.remove(os.path.join(dirName, MARKER))
+    except OSError:
+        pass
+
+
+def finished(dirName, options = ()):
+    """
+    This function returns True if the last run of simulation.py on dirName
+    ended successfully, with the current parameters.py and the options
+    (list of strings). The results restored from the cache count as a run.
+    """
+    try:
+        with open(os.path.join(dirName, MARKER)) as f:
+            return f.read() == signature(dirName, options)
+    except IOError:
+        return False
+
+
+#
+# function running a job
+#
+def run_job(job):
+    """
+    This function runs simulation.py on a directory and waits for it.
+
+    :param job: tuple (dirName, command), where command is the list of the
+                arguments of the process, dirName excluded
+
+    :output (dirName, returncode, seconds, errors): errors is the standard
+                error of the process
+    """
+    (dirName, command) = job
+
+    # the marker of an interrupted run must not be left
+    unmark(dirName)
+
+    environment = dict(os.environ)
+    environment.update(SINGLE_THREAD)
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(command + [dirName], stdout = devnull, stderr = subprocess.PIPE,
+                                   env = environment, cwd = os.path.dirname(command[1]))
+        errors = process.communicate()[1]
+
+    return (dirName, process.returncode, time.time() - start, errors)
+
+
+#
+# function for the sweep
+#
+def sweep(dirNames, processes, resume = False, options = None):
+    """
+    This function runs simulation.py on each directory, on a pool of
+    processes, from the most expensive simulation to the cheapest one.
+
+    :param dirNames: list of simulation directories
+    :param processes: int. Number of simulations running at the same time
+    :param resume: bool. If True, the simulations finished with the same
+                   parameters.py and options are skipped
+    :param options: list of strings or None. Options of simulation.py
+
+    :output failed: list of the directories whose run failed
+    """
+    if options is None:
+        options = []
+    if resume:
+        done = [d for d in dirNames if finished(d, options)]
+        if done:
+            logging.info('Resuming: ' + str(len(done)) + ' finished simulations skipped')
+        dirNames = [d for d in dirNames if d not in done]
+
+    work = dict((d, estimate(d)) for d in dirNames)
+    ordered = sorted(dirNames, key = lambda d: work[d], reverse = True)
+    simulation = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'simulation.py')
+    command = [sys.executable, simulation] + list(options)
+
+    logging.info('Sweep of ' + str(len(ordered)) + ' simulations on ' + str(processes) + ' processes')
+    for d in ordered:
+        logging.info('  ' + d + ': estimated work ' + str(work[d]))
+
+    start = time.time()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    failed = []
+    pool = ThreadPool(max(processes, 1))
+    try:
+        jobs = [(os.path.abspath(d), command) for d in ordered]
+        for (k, (dirName, code, seconds, errors)) in enumerate(pool.imap_unordered(run_job, jobs)):
+            status = 'finished' if code == 0 else 'FAILED (exit code ' + str(code) + ')'
+            message = ('[' + str(k + 1) + '/' + str(len(jobs)) + '] ' + dirName + ' ' + status +
+                       ' in ' + '%.1f' % seconds + ' s')
+            print(message)
+            logging.info(message)
+            if code != 0:
+                failed.append(dirName)
+                logging.error('Standard error of ' + dirName + ':\n' + errors)
+    finally:
+        pool.close()
+        pool.join()
+
+    # the CPU time of the jobs is about the time of a serial sweep
+    elapsed = time.time() - start
+    end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (end.ru_utime - usage.ru_utime) + (end.ru_stime - usage.ru_stime)
+    if elapsed > 0.:
+        logging.info('Sweep finished in ' + '%.1f' % elapsed + ' s, CPU time of the simulations ' +
+                     '%.1f' % cpu + ' s: speed-up ' + '%.2f' % (cpu / elapsed) + ' on ' +
+                     str(processes) + ' processes')
+    if failed:
+        logging.info('Failed simulations (run again with --resume): ' + ', '.join(failed))
+
+    return failed
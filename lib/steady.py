@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+### steady.py
+### detection of the steady states of the evolution
+
+import numpy
+import collections
+
+
+#
+# relative change of a density in a time step
+#
+def relative_change(old, new):
+    """
+    This function returns the tuple (L1, Linf) of the norms of new - old
+    relative to the ones of old. If old vanishes, the norms are not divided.
+    """
+    difference = numpy.abs(new - old)
+    norm_1 = numpy.sum(numpy.abs(old), dtype = numpy.float64)
+    norm_inf = numpy.max(numpy.abs(old))
+
+    L1 = numpy.sum(difference, dtype = numpy.float64)
+    Linf = numpy.max(difference)
+    if norm_1 > 0.:
+        L1 /= norm_1
+    if norm_inf > 0.:
+        Linf /= norm_inf
+
+    return (float(L1), float(Linf))
+
+
+#
+# class monitoring the convergence to a steady state
+#
+class monitor(object):
+
+    def __init__(self, tolerance, window, dt):
+        """
+        Initialization function for the class.
+        At each time step, the relative L1 and Linf changes of the densities
+        and the displacement of the police vessels are divided by dt. The
+        evolution is steady when all of them stay below tolerance for window
+        consecutive time steps.
+
+        :param tolerance: float. Tolerance on the rates of change
+        :param window: int. Number of time steps of the sliding window
+        :param dt: float. The time step
+        """
+        self.tolerance = tolerance
+        self.window = window
+        self.dt = dt
+        self.rates = collections.deque(maxlen = window)
+
+
+    #
+    # Function for updating the monitor after a time step
+    #
+    def update(self, p_old, p_new, s_old, s_new, police_old, police_new):
+        """
+        This function records the changes of a time step.
+
+        :output steady: bool. True if the evolution is steady
+        """
+        (p_L1, p_Linf) = relative_change(p_old, p_new)
+        (s_L1, s_Linf) = relative_change(s_old, s_new)
+        displacement = 0.
+        for (d_old, d_new) in zip(police_old, police_new):
+            displacement = max(displacement, numpy.sqrt((d_new[0] - d_old[0])**2 + (d_new[1] - d_old[1])**2))
+
+        self.rates.append(numpy.array([p_L1, p_Linf, s_L1, s_Linf, displacement]) / self.dt)
+
+        return self.steady()
+
+
+    #
+    # Function for checking the steadiness
+    #
+    def steady(self):
+        return (len(self.rates) == self.window and
+                max(numpy.max(r) for r in self.rates) < self.tolerance)
+
+
+    #
+    # Function describing the criterion
+    #
+    def criterion(self):
+        """
+        This function returns a string with the maximum rates of change over
+        the window.
+        """
+        rates = numpy.max(numpy.array(self.rates), axis = 0)
+        names = ['pirates L1', 'pirates Linf', 'ships L1', 'ships Linf', 'police']
+
+        return ('rates of change over the last ' + str(len(self.rates)) + ' steps below ' +
+                str(self.tolerance) + ': ' +
+                ', '.join(name + ' ' + '%.3e' % rate for (name, rate) in zip(names, rates)))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+###
+### optimise.py
+### 
+
+import sys
+import os
+import argparse
+import logging
+from datetime import datetime
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import optimisation
+
+if __name__ == '__main__':
+
+    desc = """optimise.py optimises the controls of the police vessels"""
+
+    parser = argparse.ArgumentParser(description = desc, prog = "optimise.py")
+    parser.add_argument('DirName', type=str, help="Enter the name of the directory")
+    parser.add_argument('-p', '--processes', type=int, default=1, help="Enter the number of worker processes")
+    parser.add_argument('-b', '--basis', type=str, default='piecewise', choices=['piecewise', 'fourier'], help="Enter the parametrisation of the controls")
+    parser.add_argument('-n', '--size', type=int, default=10, help="Enter the number of intervals or the degree of the Fourier polynomials")
+    parser.add_argument('-i', '--iterations', type=int, default=50, help="Enter the maximum number of iterations")
+    parser.add_argument('-s', '--step', type=float, default=1e-3, help="Enter the step of the finite differences")
+    parser.add_argument('-t', '--tree', action='store_true', help="Share the common initial histories of the perturbed controls")
+
+    args = parser.parse_args()
+
+    dirName = args.DirName
+
+    filelog = os.path.join(dirName, 'Optimisation-pirates.txt')
+
+    try:
+        os.remove(filelog)
+    except OSError:
+        pass
+
+    logging.basicConfig(filename = filelog,
+                        filemod = 'w', level = logging.DEBUG)
+    
+    logging.info('Started  at ' + str(datetime.now()))
+
+    optimiser = optimisation.optimiser(dirName, args.basis, args.size, args.processes, args.step, tree = args.tree)
+    (cost, table) = optimiser.run(args.iterations)
+    print 'Best cost = ' + str(cost)
+
+    logging.info('Finished  at ' + str(datetime.now()))
@@ -8,6 +8,7 @@ import os
 import argparse
 import numpy
 import logging
+import time
 from datetime import datetime
 
 
@@ -15,39 +16,147 @@ path = os.path.join(os.getcwd(), "lib")
 sys.path.insert(0, path)
 
 import pirates
+import pde
 import evolution
+import decomposition
+import ensemble
+import cache
+import scheduler
 
 if __name__ == '__main__':
 
     desc = """simulation.py performs the simulation"""
 
     parser = argparse.ArgumentParser(description = desc, prog = "simulation.py")
-    parser.add_argument('DirName', type=str, help="Enter the name of the directory")
+    parser.add_argument('DirName', type=str, nargs='+', help="Enter the name of the directory. With several directories, the scenarios sharing the mesh and the initial data are evolved together as an ensemble")
+    parser.add_argument('-p', '--processes', type=int, default=1, help="Enter the number of worker processes sharing the mesh")
+    parser.add_argument('-t', '--threads', type=int, default=1, help="Enter the number of threads computing the stencils")
+    parser.add_argument('-c', '--concurrent', dest='concurrent', action='store_true', help="Update pirates, ships and police concurrently")
+    parser.add_argument('-s', '--single', dest='single', action='store_true', help="Compute the densities in single precision")
+    parser.add_argument('--no-active-region', dest='active_region', action='store_false', help="Compute the time steps on the whole mesh instead of the bounding box of the densities")
+    parser.add_argument('--amr-threshold', dest='amr_threshold', type=float, default=None, help="Enter the norm of the gradients of the densities above which the cells are refined")
+    parser.add_argument('--amr-ratio', dest='amr_ratio', type=int, default=2, help="Enter the refinement ratio of the patches")
+    parser.add_argument('--amr-regrid', dest='amr_regrid', type=int, default=10, help="Enter the number of time steps between two regriddings of the patches")
+    parser.add_argument('--amr-buffer', dest='amr_buffer', type=int, default=2, help="Enter the number of cells added around the refined cells")
+    parser.add_argument('-k', '--kernel-tolerance', dest='kernel_tolerance', type=float, default=None, help="Enter the relative error of the separable approximation of the kernels")
+    parser.add_argument('-f', '--fft-memory', dest='fft_memory', type=float, default=None, help="Enter the memory in MB of the tiles of the FFT convolutions")
+    parser.add_argument('--no-prune', dest='prune', action='store_false', help="Compute all the terms of the system, also the ones which vanish identically")
+    parser.add_argument('-e', '--steady-tolerance', dest='steady_tolerance', type=float, default=None, help="Enter the tolerance on the rates of change for stopping at a steady state")
+    parser.add_argument('-w', '--steady-window', dest='steady_window', type=int, default=50, help="Enter the number of time steps of the window of the steady state detection")
+    parser.add_argument('--cache', type=str, default=os.environ.get('PIRATES_CACHE'), help="Enter the directory of the cache of the results (default: $PIRATES_CACHE)")
+    parser.add_argument('--cache-size', dest='cache_size', type=float, default=1024., help="Enter the maximum size in MB of the cache of the results")
+    parser.add_argument('-o', '--output', type=str, choices=['npz', 'series'], default='npz', help="Enter the format of the saved states: a file for each state or a single time series mapped in memory")
+    parser.add_argument('-z', '--compression', type=str, choices=['deflate', 'none', 'fast', 'high'], default='deflate', help="Enter the compression of the saved states: deflate (numpy.savez_compressed), none, fast (zlib) or high (bz2) by chunks")
+    parser.add_argument('--compression-threads', dest='compression_threads', type=int, default=1, help="Enter the number of threads compressing the chunks of the saved states")
+    parser.add_argument('--encoding', type=str, choices=['dense', 'crop', 'sparse'], default='dense', help="Enter the encoding of the saved densities: dense, crop (box of the nonzero values) or sparse (indices and values)")
+    parser.add_argument('--keyframes', type=int, default=0, help="Enter the period of the states saved in full; the others are saved as differences from the previous state")
+    parser.add_argument('--precision', type=str, choices=['full', 'float16', 'uint16', 'uint8'], default='full', help="Enter the precision of the saved densities: full, or float16, uint16 and uint8 for frames which are only plotted")
+    parser.add_argument('--stream', dest='streams', type=str, action='append', default=[], help="Enter an additional output, saved in its subdirectory, as name:every=10,decimate=4 (averages on blocks of 4 x 4 cells every 10 time steps), name:follow=0.5 (window following the police) or name:box=x_1/x_2/y_1/y_2; the option can be repeated")
+    parser.add_argument('--checkpoint-every', dest='checkpoint_every', type=int, default=0, help="Enter the number of time steps between two checkpoints of the evolution")
+    parser.add_argument('-r', '--resume', dest='resume', action='store_true', help="Resume the evolution from the last checkpoint of the directory")
+    parser.add_argument('--artefacts', type=str, default=os.environ.get('PIRATES_ARTEFACTS'), help="Enter the directory of the cache of the meshes and kernels (default: $PIRATES_ARTEFACTS)")
 
     args = parser.parse_args()
 
-    dirName = args.DirName
+    dirName = args.DirName[0]
 
-    filelog = os.path.join(dirName, 'Simulation-pirates.txt')
+    # the options, for the markers of the finished runs (see scheduler.py)
+    arguments = [a for a in sys.argv[1:] if a not in args.DirName]
 
-    try:
-        os.remove(filelog)
-    except OSError:
-        pass
+    # with several directories, the log is written in each of them
+    for (k, name) in enumerate(args.DirName):
+        scheduler.unmark(name)
+        filelog = os.path.join(name, 'Simulation-pirates.txt')
 
-    logging.basicConfig(filename = filelog,
-                        filemod = 'w', level = logging.DEBUG)
+        try:
+            os.remove(filelog)
+        except OSError:
+            pass
+
+        if k == 0:
+            logging.basicConfig(filename = filelog,
+                                filemod = 'w', level = logging.DEBUG)
+        else:
+            handler = logging.FileHandler(filelog)
+            handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            logging.getLogger().addHandler(handler)
     
     logging.info('Started  at ' + str(datetime.now()))
 
-    # Reads all parameters, Initial Datum, Flow and MaxCharSpeed
-    execfile(os.path.join(dirName, "parameters.py"))
+    # options of the pirates classes, the same for all the directories
+    options = dict(concurrent = args.concurrent,
+                   dtype = numpy.float32 if args.single else numpy.float64,
+                   active_region = args.active_region,
+                   amr_threshold = args.amr_threshold,
+                   amr_ratio = args.amr_ratio,
+                   amr_regrid = args.amr_regrid,
+                   amr_buffer = args.amr_buffer,
+                   kernel_tolerance = args.kernel_tolerance,
+                   fft_memory = args.fft_memory,
+                   steady_tolerance = args.steady_tolerance,
+                   steady_window = args.steady_window,
+                   artefact_cache = args.artefacts,
+                   output_format = args.output,
+                   compression = args.compression,
+                   compression_threads = args.compression_threads,
+                   encoding = args.encoding,
+                   keyframes = args.keyframes,
+                   precision = args.precision,
+                   streams = args.streams,
+                   checkpoint_every = args.checkpoint_every,
+                   resume = args.resume)
+    if not args.prune:
+        options['prune_threshold'] = None
 
-    
-    simul_pirates = pirates.pirates(x_1, x_2, y_1, y_2, n_x, n_y, M, tMax, d_o,
-                                    InitialDatum_rho, InitialDatum_A,
-                                    speed_ships, nu, dirName, mathcal_K, cut_off_C_pirates, kappa, a, cut_off_C_ships, cut_off_C_police, controls)
+    pde.set_threads(args.threads)
+
+    if len(args.DirName) > 1:
+        # options which the ensembles do not use
+        ignored = [('-p', args.processes > 1), ('-c', args.concurrent),
+                   ('--amr-threshold', args.amr_threshold is not None),
+                   ('-k', args.kernel_tolerance is not None), ('-f', args.fft_memory is not None),
+                   ('-e', args.steady_tolerance is not None), ('--cache', args.cache is not None),
+                   ('--checkpoint-every', args.checkpoint_every > 0), ('--resume', args.resume)]
+        for (option, given) in ignored:
+            if given:
+                message = 'The ensembles do not use ' + option + ': the option is ignored'
+                print(message)
+                logging.warning(message)
+
+        members = [pirates.load(name, **options) for name in args.DirName]
+        for group in ensemble.groups(members):
+            ensemble.ensemble(group).run()
+            print(' ')
+    else:
+        # the decomposition has no refined patches (and the cache key must
+        # not contain them)
+        if args.processes > 1 and args.amr_threshold is not None:
+            message = 'The decomposition does not use --amr-threshold: the option is ignored'
+            print(message)
+            logging.warning(message)
+            options['amr_threshold'] = None
+
+        # Reads all parameters, Initial Datum, Flow and MaxCharSpeed
+        simul_pirates = pirates.load(dirName, **options)
+
+        # the cache does not keep the output streams, nor the states saved
+        # before the checkpoint of a resumed run
+        key = cache.key(simul_pirates) if args.cache is not None and not args.streams and not args.resume else None
+        if key is not None and cache.restore(args.cache, key, dirName):
+            logging.info('Results reused from the cache entry ' + key)
+        else:
+            start = time.time()
+            if args.processes > 1:
+                decomposition.run(simul_pirates, args.processes)
+            else:
+                evolution.evolution(simul_pirates)
+            print(' ')
+
+            if key is not None:
+                cache.store(args.cache, key, dirName, start)
+                cache.evict(args.cache, args.cache_size * 2**20)
+
+    for name in args.DirName:
+        scheduler.mark_finished(name, arguments)
 
-    evolution.evolution(simul_pirates)
-    print(' ')
     logging.info('Finished  at ' + str(datetime.now()))
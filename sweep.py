@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+###
+### sweep.py
+### 
+
+import sys
+import os
+import argparse
+import logging
+import multiprocessing
+from datetime import datetime
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import scheduler
+
+if __name__ == '__main__':
+
+    desc = """sweep.py performs the simulations of many directories on a pool of processes.
+              The arguments after -- are passed to simulation.py"""
+
+    parser = argparse.ArgumentParser(description = desc, prog = "sweep.py")
+    parser.add_argument('DirNames', type=str, nargs='+', help="Enter the names of the directories, or shell patterns")
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help="Enter the number of simulations running at the same time")
+    parser.add_argument('-r', '--resume', dest='resume', action='store_true', help="Skip the simulations already finished")
+    parser.add_argument('-l', '--log', type=str, default='Sweep-pirates.txt', help="Enter the name of the log file of the sweep")
+
+    argv = sys.argv[1:]
+    if '--' in argv:
+        (argv, options) = (argv[:argv.index('--')], argv[argv.index('--') + 1:])
+    else:
+        options = []
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(filename = args.log, level = logging.DEBUG)
+    
+    logging.info('Started  at ' + str(datetime.now()))
+
+    failed = scheduler.sweep(scheduler.directories(args.DirNames), args.jobs, args.resume, options)
+
+    logging.info('Finished  at ' + str(datetime.now()))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+#######################################
+# test-active-region.py
+#
+# compares the stencils computed on the whole grid
+# with the ones restricted to the active box
+#
+#######################################
+
+
+import numpy
+import sys
+import os
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import pde
+
+def v(A):
+    return 1. - A
+
+if __name__ == '__main__':
+
+    (x, dx) = numpy.linspace(0., 1., 60, retstep=True)
+    (y, dy) = numpy.linspace(0., 1., 50, retstep=True)
+    xx, yy = numpy.meshgrid(x, y)
+    dt = 0.25 * min(dx**2, dx / 1.)
+
+    A = numpy.zeros_like(xx)
+    A[20:30, 10:25] = numpy.random.rand(10, 15)
+    w_x = numpy.cos(3 * yy)
+    w_y = numpy.sin(2 * xx)
+    f2 = - numpy.exp(xx * yy)
+
+    box = pde.active_box(A, 2)
+    b = numpy.s_[box[0]:box[1], box[2]:box[3]]
+    print 'active box: ', box
+
+    A_full = pde.one_step_hyperbolic_godunov(A, v, w_x, w_y, dx, dy, dt)
+    A_box = numpy.zeros_like(A)
+    A_box[b] = pde.one_step_hyperbolic_godunov(A[b], v, w_x[b], w_y[b], dx, dy, dt)
+    print 'Godunov, max difference: ', numpy.max(numpy.abs(A_full - A_box))
+
+    u_full = pde.one_step_parabolic(A, xx, yy, 0., f2, dx, dy, dt)
+    u_box = numpy.zeros_like(A)
+    u_box[b] = pde.one_step_parabolic(A[b], xx[b], yy[b], 0., f2[b], dx, dy, dt)
+    print 'parabolic, max difference: ', numpy.max(numpy.abs(u_full - u_box))
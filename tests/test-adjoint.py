@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+#######################################
+# test-adjoint.py
+#
+# compares the gradient of the cost given by the adjoint
+# with the centered differences of evolution.evaluate_cost
+# usage: python tests/test-adjoint.py simulations/test-cost/control_circle
+#
+#######################################
+
+
+import numpy
+import sys
+import os
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import pirates
+import evolution
+import adjoint
+
+if __name__ == '__main__':
+
+    dirName = sys.argv[1]
+    execfile(os.path.join(dirName, "parameters.py"))
+
+    # small problem
+    (n_x, n_y, tMax) = (30, 30, 0.2)
+    simul_pirates = pirates.pirates(x_1, x_2, y_1, y_2, n_x, n_y, M, tMax, d_o,
+                                    InitialDatum_rho, InitialDatum_A,
+                                    speed_ships, nu, dirName, mathcal_K, cut_off_C_pirates, kappa, a, cut_off_C_ships, cut_off_C_police, controls)
+
+    steps = len(simul_pirates.time) - 1
+    table = numpy.array([controls(t) for t in simul_pirates.time[1:]], dtype = float).reshape((steps, M, 2))
+
+    (cost, gradient) = adjoint.gradient(simul_pirates, table, snapshots = 3)
+    print 'cost: ', cost, ' evaluate_cost: ', evolution.evaluate_cost(simul_pirates, table)
+
+    direction = numpy.random.randn(steps, M, 2)
+    eps = 1e-4
+    difference = (evolution.evaluate_cost(simul_pirates, table + eps * direction) -
+                  evolution.evaluate_cost(simul_pirates, table - eps * direction)) / (2 * eps)
+    print 'directional derivative, adjoint: ', numpy.sum(gradient * direction), ' differences: ', difference
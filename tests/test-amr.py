@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+#######################################
+# test-amr.py
+#
+# checks that the composite time step of lib/amr.py conserves the mass,
+# and compares the densities evolved with refined patches with the ones
+# evolved on a uniform mesh refined everywhere
+#
+#######################################
+
+
+import numpy
+import sys
+import os
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import amr
+
+def v(A):
+    return 1. - A
+
+#
+# cell centered mesh of [0, 1]^2 with n x n cells
+#
+def mesh(n):
+    h = 1. / n
+    x = (numpy.arange(n) + 0.5) * h
+    xx, yy = numpy.meshgrid(x, x)
+
+    return (xx, yy, h)
+
+#
+# the fields of the equations, which do not depend on the densities
+#
+def fields(xx, yy):
+    v_x = 2. * numpy.sin(3. * yy)
+    v_y = 2. * numpy.cos(2. * xx)
+    f2 = numpy.zeros_like(xx)
+    w_x = 0.8 + 0. * xx
+    w_y = 0.4 + 0. * xx
+
+    return (v_x, v_y, f2, w_x, w_y)
+
+#
+# densities concentrated far from the boundary
+#
+def initial(xx, yy):
+    rho = numpy.exp(- 200. * ((xx - 0.5)**2 + (yy - 0.5)**2))
+    A = 0.8 * numpy.exp(- 100. * ((xx - 0.4)**2 + (yy - 0.45)**2))
+
+    return (rho, A)
+
+#
+# composite time step, with the term - div(V rho) of the base mesh
+#
+def step(patches, rho, A, xx, yy, h, dt):
+    (v_x, v_y, f2, w_x, w_y) = fields(xx, yy)
+    grad_y, grad_x = numpy.gradient(v_x * rho, h, h)
+    div = - grad_x
+    grad_y, grad_x = numpy.gradient(v_y * rho, h, h)
+    div = div - grad_y
+
+    return amr.one_step(patches, rho, A, xx, yy, div, v_x, v_y, f2, w_x, w_y, v, h, h, dt)
+
+
+if __name__ == '__main__':
+
+    n = 32
+    r = 2
+    steps = 60
+    (xx, yy, h) = mesh(n)
+    dt = 0.2 * h**2
+
+    # a patch of ratio 1 gives the time step of the base mesh
+    (rho, A) = initial(xx, yy)
+    q = amr.patch((8, 20, 6, 22), 1, rho, A)
+    (rho_1, A_1) = step([q], rho, A, xx, yy, h, dt)
+    (rho_0, A_0) = step([], rho, A, xx, yy, h, dt)
+    print 'ratio 1, max difference from the base mesh: ', numpy.max(numpy.abs(rho_1 - rho_0)), numpy.max(numpy.abs(A_1 - A_0))
+    assert numpy.max(numpy.abs(rho_1 - rho_0)) < 1e-12
+    assert numpy.max(numpy.abs(A_1 - A_0)) < 1e-12
+
+    # evolution on the base mesh, with the patches and on the fine mesh,
+    # from the same initial data
+    (xx_f, yy_f, h_f) = mesh(r * n)
+    (rho_f, A_f) = initial(xx_f, yy_f)
+    (rho_c, A_c) = (amr.restrict(rho_f, r), amr.restrict(A_f, r))
+    (rho_a, A_a) = (rho_c, A_c)
+    patches = amr.regrid([], rho_a, A_a, h, h, 2., r, 2)
+    for q in patches:
+        b = numpy.s_[r * q.box[0]:r * q.box[1], r * q.box[2]:r * q.box[3]]
+        (q.p_density, q.s_density) = (rho_f[b].copy(), A_f[b].copy())
+    error = 0.
+    for i in xrange(steps):
+        if i > 0 and i % 10 == 0:
+            patches = amr.regrid(patches, rho_a, A_a, h, h, 2., r, 2)
+        (rho_c, A_c) = step([], rho_c, A_c, xx, yy, h, dt)
+
+        # away from the boundary of the domain the patches exchange the
+        # mass with the base mesh only, hence the mass changes as with a
+        # step of the base mesh
+        (rho_0, A_0) = step([], rho_a, A_a, xx, yy, h, dt)
+        (rho_a, A_a) = step(patches, rho_a, A_a, xx, yy, h, dt)
+        error = max(error, abs(numpy.sum(rho_a) - numpy.sum(rho_0)) * h**2,
+                    abs(numpy.sum(A_a) - numpy.sum(A_0)) * h**2)
+        for k in xrange(r * r):
+            (rho_f, A_f) = step([], rho_f, A_f, xx_f, yy_f, h_f, dt / (r * r))
+    print 'patches: ', [q.box for q in patches]
+    print 'maximum error on the mass: ', error
+    assert error < 1e-14
+
+    # distance from the fine mesh, averaged on the base mesh
+    (rho_f, A_f) = (amr.restrict(rho_f, r), amr.restrict(A_f, r))
+    errors = {}
+    for (name, rho, A) in [('base', rho_c, A_c), ('patches', rho_a, A_a)]:
+        errors[name] = (h**2 * numpy.sum(numpy.abs(rho - rho_f)), h**2 * numpy.sum(numpy.abs(A - A_f)))
+        print name + ', L1 distance from the fine mesh of pirates and ships: ', errors[name]
+    assert errors['patches'][0] < errors['base'][0]
+    assert errors['patches'][1] < errors['base'][1]
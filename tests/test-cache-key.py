@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+#######################################
+# test-cache-key.py
+#
+# checks that the key of the cache of the results (cache.key) changes with
+# the options of the saved states, and only with them
+# usage: python tests/test-cache-key.py simulations/test-cost/control_circle
+#
+#######################################
+
+
+import sys
+import os
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import pirates
+import cache
+
+if __name__ == '__main__':
+
+    dirName = sys.argv[1]
+    reference = cache.key(pirates.load(dirName, n_x = 30, n_y = 30, tMax = 0.2))
+
+    options = [('precision', 'uint8'), ('precision', 'float16'), ('compression', 'fast'),
+               ('encoding', 'sparse'), ('keyframes', 10), ('output_format', 'series')]
+    for (name, value) in options:
+        key = cache.key(pirates.load(dirName, n_x = 30, n_y = 30, tMax = 0.2, **{name: value}))
+        print name, '=', value, ': key changed ', key != reference
+        assert key != reference
+
+    key = cache.key(pirates.load(dirName, n_x = 30, n_y = 30, tMax = 0.2, concurrent = True))
+    print 'concurrent = True : key unchanged ', key == reference
+    assert key == reference
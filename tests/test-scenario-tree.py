@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+#######################################
+# test-scenario-tree.py
+#
+# compares the costs given by scenarios.scenario_tree with the ones of
+# evolution.evaluate_cost, for schedules which differ after some time
+# usage: python tests/test-scenario-tree.py simulations/test-cost/control_circle
+#
+#######################################
+
+
+import numpy
+import sys
+import os
+import time
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import pirates
+import evolution
+import scenarios
+
+if __name__ == '__main__':
+
+    dirName = sys.argv[1]
+    simul_pirates = pirates.load(dirName, n_x = 30, n_y = 30, tMax = 0.2)
+
+    tree = scenarios.scenario_tree(simul_pirates)
+    table = tree.table(simul_pirates.controls)
+    steps = numpy.shape(table)[0]
+
+    # the schedules are perturbed on the last half, quarter, ... of the time interval
+    schedules = [table]
+    for k in [steps // 2, 3 * steps // 4, 7 * steps // 8]:
+        for sign in [1., -1.]:
+            perturbed = table.copy()
+            perturbed[k:] += sign * 0.1
+            schedules.append(perturbed)
+
+    start = time.time()
+    costs = tree.costs(schedules)
+    print 'tree: ', tree.report, ' ', time.time() - start, ' s'
+
+    start = time.time()
+    reference = [evolution.evaluate_cost(simul_pirates, s) for s in schedules]
+    print 'evaluate_cost: ', time.time() - start, ' s'
+    print 'maximum difference of the costs: ', numpy.max(numpy.abs(numpy.array(costs) - numpy.array(reference)))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+#######################################
+# test-separable-kernel.py
+#
+# compares the convolution with a kernel and with its
+# separable approximations
+#
+#######################################
+
+
+import numpy
+import scipy.signal
+import sys
+import os
+
+
+path = os.path.join(os.getcwd(), "lib")
+sys.path.insert(0, path)
+
+import convolution
+
+if __name__ == '__main__':
+
+    x = numpy.linspace(-1., 1., 101)
+    y = numpy.linspace(-1., 1., 81)
+    xx, yy = numpy.meshgrid(x, y)
+    kernel = (xx**2 + yy**2 < 0.3**2) * (0.3**2 - xx**2 - yy**2)
+
+    h = numpy.random.rand(81, 101)
+    exact = scipy.signal.convolve2d(h, kernel, mode = 'same')
+
+    for tolerance in [1e-1, 1e-2, 1e-4, 1e-8]:
+        separable = convolution.separable_kernel(kernel, tolerance)
+        c = convolution.convolve(h, separable)
+        print 'tolerance: ', tolerance, ' rank: ', separable.rank, ' error on the kernel: ', separable.error,
+        print ' relative error: ', numpy.max(numpy.abs(c - exact)) / numpy.max(numpy.abs(exact))
+
+    box = (10, 40, 20, 90)
+    c = convolution.convolve(h, separable, box)
+    print 'box, max difference: ', numpy.max(numpy.abs(c - exact[10:40, 20:90]))